@@ -1,15 +1,27 @@
 from __future__ import annotations
 import asyncio
+import atexit
+import signal
+import sys
+import traceback
 import forta_agent
+import numpy as np
 from forta_agent import get_json_rpc_url
 from web3 import Web3
-from src.db.db_utils import db_utils
-from src.db.controller import init_async_db
-from src.findings import UncertainPriorityFeeFindings, PriorityFeeFindings
+from src.db.db_utils import db_utils, roll_up_history
+from src.db.controller import init_async_db, snapshot_db
+from src.findings import UncertainPriorityFeeFindings, PriorityFeeFindings, SEVERITIES, classify_priority_fees, \
+    classify_uncertain_priority_fees
 from src.utils import get_protocols_by_chain, get_key_by_value, calculate_new_base_fee
 from src.forecaster import forecast
-from src.config import test_mode, history_capacity, minimal_capacity_to_forecast, critical_enable, high_enable, \
-    medium_enable, low_enable, debug_logs_enabled, win_streak_limit
+from src.scheduler import forecast_scheduler
+from src.profiler import profiler
+from src.memory import memory_monitor
+from src.seen_hashes import seen_hashes
+from src.scoring import FutureRow, score_transactions, to_record
+from src.workers import get_dispatcher
+from src.config import test_mode, history_capacity, minimal_capacity_to_forecast, debug_logs_enabled, \
+    win_streak_limit, workers_count, database_path, in_memory_db, snapshot_every_n_blocks
 
 global blocks_counter
 global current_capacity
@@ -19,6 +31,14 @@ initialized = False
 real_base_fee_detected = False
 maybe_base_fee = float('inf')
 win_streak = 0
+# the hour whose max priority fees are compared with the forecasts when it is closed
+drift_hour = None
+# the forecasts of the drift_hour saved when it was started, the refreshed forecasts replace them in the database
+drift_rows = {}
+
+# only these columns are read from the database
+BLOCK_COLUMNS = ['block_hash', 'gas_used_total', 'gas_limit_total', 'base_fee']
+FUTURE_COLUMNS = ['contract', 'priority_fee', 'priority_fee_lower', 'priority_fee_upper']
 
 web3 = Web3(Web3.HTTPProvider(get_json_rpc_url()))
 chain_id = web3.eth.chain_id
@@ -37,12 +57,31 @@ async def my_initialize(block_event: forta_agent.block_event.BlockEvent):
     global current_capacity
     global current_block
 
+    # the in-memory database can't be shared with the worker processes
+    in_memory = in_memory_db and workers_count == 0
+    if in_memory_db and not in_memory:
+        print('WARNING: The in-memory database is disabled in the worker mode')
+
     # initialize database tables
-    transaction_table, blocks_table, future_table = await init_async_db(test_mode)
+    transaction_table, blocks_table, future_table = await init_async_db(test_mode, database_path,
+                                                                        wal=workers_count > 0,
+                                                                        protocols_addresses=protocols_addresses,
+                                                                        in_memory=in_memory)
     db_utils.set_tables(transaction_table, blocks_table, future_table)
+    if in_memory:
+        atexit.register(save_snapshot)
+        # the container is stopped with SIGTERM, the atexit handlers are not called when the signal kills the process
+        try:
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                signal.signal(signum, save_snapshot_and_exit)
+        except ValueError:
+            print('WARNING: The database is saved only at the normal exit since the agent is not in the main thread')
 
     # if the database is not empty (in case the agent was restarted) we need to clear the old blocks firstly
-    await clean_db(block_event.block_number, blocks_table, transaction_table)
+    await clean_db(block_event.block_number, block_event.block.timestamp, blocks_table, transaction_table)
+
+    # restore when the stored forecasts expire
+    await forecast_scheduler.load(future_table)
 
     current_block = block_event.block_number
     # we will count the blocks since agent's start
@@ -53,6 +92,31 @@ async def my_initialize(block_event: forta_agent.block_event.BlockEvent):
     initialized = True
 
 
+def save_snapshot():
+    """
+    This function saves the in-memory database at exit
+    @return:
+    """
+    if asyncio.run(snapshot_db()) and debug_logs_enabled:
+        print(f'INFO: The database is saved to {db_utils.get_engine()[1]}')
+
+
+def save_snapshot_and_exit(signum, frame):
+    """
+    This function is the handler of SIGTERM and SIGINT, it saves the in-memory database and exits. If the signal has
+    interrupted the event, the exit rolls the event back first and the database is saved at exit by save_snapshot()
+    @param signum: the received signal
+    @param frame: the interrupted frame
+    @return:
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        save_snapshot()
+        atexit.unregister(save_snapshot)
+    sys.exit(0)
+
+
 async def analyze_transaction(transaction_event: forta_agent.transaction_event.TransactionEvent):
     """
     This function is triggered by handle_transaction using function main(). It is responsible for the adding the
@@ -63,7 +127,6 @@ async def analyze_transaction(transaction_event: forta_agent.transaction_event.T
     """
     global maybe_base_fee
     global real_base_fee_detected
-    global current_block
     global win_streak
     findings = []
 
@@ -73,8 +136,8 @@ async def analyze_transaction(transaction_event: forta_agent.transaction_event.T
     if not real_base_fee_detected and transaction_event.gas_price < maybe_base_fee and transaction_event.block_number == current_block:
         maybe_base_fee = transaction_event.gas_price
 
-    # Then we will save and analyze the transactions only for our protocols
-    if transaction_event.to in protocols_addresses:
+    # Then we will save and analyze the transactions only for our protocols, the re-delivered ones are skipped
+    if transaction_event.to in protocols_addresses and seen_hashes.add(transaction_event.hash):
 
         # get the database tables
         transactions = db_utils.get_transactions()
@@ -82,13 +145,14 @@ async def analyze_transaction(transaction_event: forta_agent.transaction_event.T
         future = db_utils.get_future()
 
         # get the previous block
-        prev_block_row = await blocks.get_row_by_criteria({'block': transaction_event.block.number - 1})
+        prev_block_row = await blocks.get_first_columns_by_criteria(BLOCK_COLUMNS,
+                                                                    {'block': transaction_event.block.number - 1})
         prev_base_fee = prev_block_row.base_fee if prev_block_row else None
 
         # since we have forecasted value for each hour, we need to calculate the timestamp rounded for the hour
         hourly_timestamp = transaction_event.block.timestamp - transaction_event.block.timestamp % 3600
         # get these rows from the database
-        future_rows = await future.get_all_rows_by_criteria({'timestamp': hourly_timestamp})
+        future_rows = await future.get_columns_by_criteria(FUTURE_COLUMNS, {'timestamp': hourly_timestamp})
         # and extract the estimation for the current protocol
         future_row = None
         if future_rows:
@@ -100,10 +164,12 @@ async def analyze_transaction(transaction_event: forta_agent.transaction_event.T
         # if there is no estimation in the database but the capacity is big enough to calculate it then we need to
         # trigger the forecaster
         if not future_row and current_capacity > minimal_capacity_to_forecast:
-            await forecast(transaction_event.to)
+            refit = forecast_scheduler.refit(transaction_event.to)
+            last_hour = await forecast(transaction_event.to, refit)
+            forecast_scheduler.record(transaction_event.to, last_hour, transaction_event.block.timestamp, refit)
 
             # and try to get the forecasted values again
-            future_rows = await future.get_all_rows_by_criteria({'timestamp': hourly_timestamp})
+            future_rows = await future.get_columns_by_criteria(FUTURE_COLUMNS, {'timestamp': hourly_timestamp})
             future_row = None
             if future_rows:
                 for fr in future_rows:
@@ -127,8 +193,6 @@ async def analyze_transaction(transaction_event: forta_agent.transaction_event.T
                 real_base_fee_detected = False
                 win_streak = 0
 
-            error = priority_fee - future_row.priority_fee
-
             if debug_logs_enabled:
                 print(f'INFO: Protocol: {get_key_by_value(protocols, transaction_event.to)}\n'
                       f'INFO: Real priority fee: {int(priority_fee / 10 ** 9)} GWei\n'
@@ -136,20 +200,12 @@ async def analyze_transaction(transaction_event: forta_agent.transaction_event.T
                       f'INFO: Excepted priority fee lower: {int(future_row.priority_fee_lower / 10 ** 9)} GWei\n'
                       f'INFO: Excepted priority fee: {int(future_row.priority_fee / 10 ** 9)} GWei')
 
-            if error > 2 * uncertainty and critical_enable:
-                findings.append(PriorityFeeFindings.critical(protocols, transaction_event.to,
-                                                             future_row.priority_fee_upper,
-                                                             priority_fee, transaction_event.hash))
-            elif error > 1.5 * uncertainty and high_enable:
-                findings.append(PriorityFeeFindings.high(protocols, transaction_event.to, future_row.priority_fee_upper,
-                                                         priority_fee, transaction_event.hash))
-            elif error > uncertainty and medium_enable:
-                findings.append(PriorityFeeFindings.medium(protocols, transaction_event.to,
-                                                           future_row.priority_fee_upper,
-                                                           priority_fee, transaction_event.hash))
-            elif priority_fee > future_row.priority_fee_upper and low_enable:
-                findings.append(PriorityFeeFindings.low(protocols, transaction_event.to, future_row.priority_fee_upper,
-                                                        priority_fee, transaction_event.hash))
+            severity = int(classify_priority_fees(np.array([priority_fee]), future_row.priority_fee,
+                                                  future_row.priority_fee_upper, uncertainty)[0])
+            if severity >= 0:
+                findings.append(getattr(PriorityFeeFindings, SEVERITIES[severity])(
+                    protocols, transaction_event.to, future_row.priority_fee_upper, priority_fee,
+                    transaction_event.hash))
 
         elif prev_base_fee and future_row:
 
@@ -168,10 +224,6 @@ async def analyze_transaction(transaction_event: forta_agent.transaction_event.T
             priority_fee_lower = transaction_event.gas_price - base_fee_upper
             priority_fee_upper = transaction_event.gas_price - base_fee_lower
 
-            # we need to calculate the error range
-            error_lower = priority_fee_lower - future_row.priority_fee
-            error_upper = priority_fee_upper - future_row.priority_fee
-
             if debug_logs_enabled:
                 print(f'INFO: Protocol: {get_key_by_value(protocols, transaction_event.to)}\n'
                       f'INFO: Upper priority fee: {int(priority_fee_upper / 10 ** 9)} GWei\n'
@@ -181,23 +233,13 @@ async def analyze_transaction(transaction_event: forta_agent.transaction_event.T
                       f'INFO: Excepted priority fee: {int(future_row.priority_fee / 10 ** 9)} GWei')
 
             # finally we can create the alert depending on how far the priority fee is from the estimated value
-            if error_lower > 2 * uncertainty and critical_enable:
-                findings.append(
-                    UncertainPriorityFeeFindings.critical(protocols, transaction_event.to,
-                                                          future_row.priority_fee_upper,
-                                                          priority_fee_lower, transaction_event.hash))
-            elif error_upper > 2 * uncertainty and high_enable:
-                findings.append(
-                    UncertainPriorityFeeFindings.high(protocols, transaction_event.to, future_row.priority_fee_upper,
-                                                      priority_fee_lower, transaction_event.hash))
-            elif priority_fee_lower > future_row.priority_fee_upper and medium_enable:
-                findings.append(
-                    UncertainPriorityFeeFindings.medium(protocols, transaction_event.to, future_row.priority_fee_upper,
-                                                        priority_fee_lower, transaction_event.hash))
-            elif priority_fee_upper > future_row.priority_fee_upper and low_enable:
-                findings.append(
-                    UncertainPriorityFeeFindings.low(protocols, transaction_event.to, future_row.priority_fee_upper,
-                                                     priority_fee_lower, transaction_event.hash))
+            severity = int(classify_uncertain_priority_fees(np.array([priority_fee_lower]),
+                                                            np.array([priority_fee_upper]), future_row.priority_fee,
+                                                            future_row.priority_fee_upper, uncertainty)[0])
+            if severity >= 0:
+                findings.append(getattr(UncertainPriorityFeeFindings, SEVERITIES[severity])(
+                    protocols, transaction_event.to, future_row.priority_fee_upper, priority_fee_lower,
+                    transaction_event.hash))
 
         elif real_base_fee_detected and prev_base_fee:
             base_fee = calculate_new_base_fee(prev_base_fee, prev_block_row.gas_limit_total,
@@ -217,6 +259,120 @@ async def analyze_transaction(transaction_event: forta_agent.transaction_event.T
     return findings
 
 
+async def get_future_rows(hourly_timestamp: int) -> dict:
+    """
+    This function returns the forecasted values for the hour
+    @param hourly_timestamp: timestamp rounded for the hour
+    @return: dict with the protocol address as a key and the future row as a value
+    """
+    future_rows = await db_utils.get_future().get_columns_by_criteria(FUTURE_COLUMNS, {'timestamp': hourly_timestamp})
+    rows = {}
+    for fr in future_rows or []:
+        rows.setdefault(fr.contract, fr)
+    return rows
+
+
+async def forecast_protocols(protocols_to_forecast: list, timestamp: int) -> None:
+    """
+    This function triggers the forecaster for the protocols one by one
+    @param protocols_to_forecast: protocol addresses
+    @param timestamp: current block timestamp
+    @return:
+    """
+    for protocol in protocols_to_forecast:
+        refit = forecast_scheduler.refit(protocol)
+        last_hour = await forecast(protocol, refit)
+        forecast_scheduler.record(protocol, last_hour, timestamp, refit)
+
+
+async def analyze_block_transactions(transaction_events: list, score=score_transactions,
+                                     forecast_missing=forecast_protocols) -> list:
+    """
+    This function is the batch version of analyze_transaction() for the transactions of one block. The previous block,
+    the forecasted values and the base fee are fetched once, all the protocol transactions are classified in one
+    vectorized pass and inserted into the database at once. The findings are the same as if the transactions were
+    analyzed one by one in the same order.
+    @param transaction_events: Transaction events of the same block in the order they were received
+    @param score: function that classifies and stores the protocol transactions, see score_transactions()
+    @param forecast_missing: function that forecasts the protocols without the estimation, see forecast_protocols()
+    @return: list of the findings for each event
+    """
+    global maybe_base_fee
+    global real_base_fee_detected
+    global win_streak
+    results = [[] for _ in transaction_events]
+
+    # the re-delivered transactions are skipped as in analyze_transaction()
+    protocol_indices = [i for i, e in enumerate(transaction_events)
+                        if e.to in protocols_addresses and seen_hashes.add(e.hash)]
+    if not protocol_indices:
+        for transaction_event in transaction_events:
+            if not real_base_fee_detected and transaction_event.gas_price < maybe_base_fee and \
+                    transaction_event.block_number == current_block:
+                maybe_base_fee = transaction_event.gas_price
+        return results
+
+    blocks = db_utils.get_blocks()
+    block = transaction_events[0].block
+
+    prev_block_row = await blocks.get_first_columns_by_criteria(BLOCK_COLUMNS, {'block': block.number - 1})
+    prev_base_fee = prev_block_row.base_fee if prev_block_row else None
+    base_fee = calculate_new_base_fee(prev_base_fee, prev_block_row.gas_limit_total,
+                                      prev_block_row.gas_used_total) if prev_base_fee else None
+
+    hourly_timestamp = block.timestamp - block.timestamp % 3600
+    future_rows = await get_future_rows(hourly_timestamp)
+
+    # the forecaster is triggered once for each protocol without the estimation
+    missing = [p for p in dict.fromkeys(transaction_events[i].to for i in protocol_indices) if p not in future_rows]
+    if missing and current_capacity > minimal_capacity_to_forecast:
+        await forecast_missing(missing, block.timestamp)
+        future_rows = await get_future_rows(hourly_timestamp)
+
+    # the state of the base fee detection depends on the order of the transactions, so it is replayed first. It is just
+    # a few comparisons per transaction, the rest of the work is done with the arrays.
+    detected, maybe_base_fees = [], []
+    analyzed = set(protocol_indices)
+    for i, transaction_event in enumerate(transaction_events):
+        if not real_base_fee_detected and transaction_event.gas_price < maybe_base_fee and \
+                transaction_event.block_number == current_block:
+            maybe_base_fee = transaction_event.gas_price
+        if i not in analyzed:
+            continue
+        detected.append(real_base_fee_detected)
+        maybe_base_fees.append(maybe_base_fee)
+        if real_base_fee_detected and prev_base_fee and transaction_event.to in future_rows and \
+                transaction_event.gas_price - base_fee < 0:
+            real_base_fee_detected = False
+            win_streak = 0
+
+    records = [to_record(transaction_events[i]) for i in protocol_indices]
+    findings = await score(records, np.array(detected, dtype=bool), maybe_base_fees, prev_base_fee, base_fee,
+                           {contract: FutureRow(*fr) for contract, fr in future_rows.items()}, protocols)
+    for i, record_findings in zip(protocol_indices, findings):
+        results[i] = record_findings
+
+    return results
+
+
+async def analyze_transactions(transaction_events: list, **kwargs) -> list:
+    """
+    This function is triggered by handle_transactions using function main(). It splits the transactions by the blocks
+    and analyzes each block with one batch.
+    @param transaction_events: Transaction events in the order they were received
+    @param kwargs: the functions passed to analyze_block_transactions()
+    @return: list of the findings for each event
+    """
+    results = []
+    start = 0
+    for i in range(1, len(transaction_events) + 1):
+        if i == len(transaction_events) or \
+                transaction_events[i].block_number != transaction_events[start].block_number:
+            results.extend(await analyze_block_transactions(transaction_events[start:i], **kwargs))
+            start = i
+    return results
+
+
 async def base_fee_logic(block_number: int):
     """
     This function is triggered by handle_block using function main(). It receives the previous block number,
@@ -238,7 +394,7 @@ async def base_fee_logic(block_number: int):
     transactions = db_utils.get_transactions()
 
     # get the record 2 blocks behind the actual (remember that block_number in this function is actual_block_number - 1)
-    prev_block = await blocks.get_row_by_criteria({'block': block_number - 1})
+    prev_block = await blocks.get_first_columns_by_criteria(BLOCK_COLUMNS, {'block': block_number - 1})
     calculated_base_fee = None
 
     if prev_block and prev_block.base_fee:
@@ -275,7 +431,7 @@ async def base_fee_logic(block_number: int):
     maybe_base_fee = float('inf')
 
     # then we will need to update all the transactions for the previous block with calculated priority fees
-    transactions_in_block = await transactions.get_all_rows_by_criteria({'block': block_number})
+    transactions_in_block = await transactions.get_columns_by_criteria(['tx', 'gas_price'], {'block': block_number})
     transactions_hashes_and_priority_fees = {tx.tx: tx.gas_price - base_fee_to_insert for tx in transactions_in_block}
     for tx, priority_fee in transactions_hashes_and_priority_fees.items():
         await transactions.update_row_by_criteria({'priority_fee': priority_fee}, {'tx': tx})
@@ -286,7 +442,7 @@ async def base_fee_logic(block_number: int):
         if debug_logs_enabled:
             print("INFO: Win Streak limit was earned! The real base_fee was detected.")
 
-        block = await blocks.get_row_by_criteria({'block': block_number})
+        block = await blocks.get_first_columns_by_criteria(BLOCK_COLUMNS, {'block': block_number})
 
         await blocks.update_row_by_criteria(
             {'base_fee': calculate_new_base_fee(block.base_fee, block.gas_limit_total,
@@ -300,7 +456,6 @@ async def analyze_blocks(block_event: forta_agent.block_event.BlockEvent) -> Non
     @param block_event: Block event received from handle_block()
     @return:
     """
-    global maybe_base_fee
     global blocks_counter
     global current_capacity
     global real_base_fee_detected
@@ -310,7 +465,7 @@ async def analyze_blocks(block_event: forta_agent.block_event.BlockEvent) -> Non
     blocks = db_utils.get_blocks()
     transactions = db_utils.get_transactions()
 
-    prev_block = await blocks.get_row_by_criteria({'block': block_event.block_number - 1})
+    prev_block = await blocks.get_first_columns_by_criteria(BLOCK_COLUMNS, {'block': block_event.block_number - 1})
 
     # if the node somehow lose any block than we need to reset win streak and switch back to the undetected mode
     if not prev_block:
@@ -328,28 +483,28 @@ async def analyze_blocks(block_event: forta_agent.block_event.BlockEvent) -> Non
             {'block_hash': canonical_block.get('hash'), 'gas_limit_total': canonical_block.get('gasLimit'),
              'gas_used_total': canonical_block.get('gasUsed')}, {'block': block_event.block_number - 1})
 
-        prev_block = await blocks.get_row_by_criteria({'block': block_event.block_number - 1})
+        prev_block = await blocks.get_first_columns_by_criteria(BLOCK_COLUMNS, {'block': block_event.block_number - 1})
 
     current_block = block_event.block_number
 
     # in case we already found the real base fee we can insert it on the fly, else we will do it with the next block
     # in the base_fee_logic() function.
     if real_base_fee_detected:
-        if not prev_block.base_fee:
-            prev_prev_row = await blocks.get_row_by_criteria({'block': block_event.block_number - 2})
+        prev_base_fee = prev_block.base_fee
+        if not prev_base_fee:
+            prev_prev_row = await blocks.get_first_columns_by_criteria(BLOCK_COLUMNS,
+                                                                       {'block': block_event.block_number - 2})
             prev_base_fee = calculate_new_base_fee(prev_prev_row.base_fee, prev_prev_row.gas_limit_total,
                                                    prev_prev_row.gas_used_total)
-            blocks.update_row_by_criteria({'base_fee': prev_base_fee}, {'block': block_event.block_number - 1})
-            prev_block.base_fee = prev_base_fee
-        base_fee = calculate_new_base_fee(prev_block.base_fee, prev_block.gas_limit_total,
-                                          prev_block.gas_used_total)
+            await blocks.update_row_by_criteria({'base_fee': prev_base_fee}, {'block': block_event.block_number - 1})
+        base_fee = calculate_new_base_fee(prev_base_fee, prev_block.gas_limit_total, prev_block.gas_used_total)
     else:
         base_fee = None
 
     # clean the database every 1k blocks
     blocks_counter += 1
     if blocks_counter > 1000:
-        await clean_db(block_event.block_number, blocks, transactions)
+        await clean_db(block_event.block_number, block_event.block.timestamp, blocks, transactions)
         current_capacity = await blocks.count_rows()
         blocks_counter = 0
 
@@ -360,41 +515,125 @@ async def analyze_blocks(block_event: forta_agent.block_event.BlockEvent) -> Non
                             'base_fee': base_fee})
 
 
-async def clean_db(block_number: int, blocks, transactions):
+async def refresh_forecasts(block_event: forta_agent.block_event.BlockEvent) -> None:
+    """
+    This function is triggered by handle_block using function main(). It refits the models of the protocols whose
+    forecasts are close to the expiration, so the transactions don't have to wait for the forecaster
+    @param block_event: Block event received from handle_block()
+    @return:
+    """
+    if current_capacity <= minimal_capacity_to_forecast:
+        return
+
+    for protocol in forecast_scheduler.due(block_event.block.timestamp, protocols_addresses):
+        refit = forecast_scheduler.refit(protocol)
+        if debug_logs_enabled:
+            print(f'INFO: {"Refitting" if refit else "Refreshing"} forecast for '
+                  f'{get_key_by_value(protocols, protocol)}, '
+                  f'expires at: {forecast_scheduler.expires_at(protocol)}')
+        try:
+            last_hour = await forecast(protocol, refit)
+        except Exception:
+            # the failed refit is retried after an hour as if there was not enough data, so it doesn't fail every block
+            print(f'WARNING: Refit of {get_key_by_value(protocols, protocol)} has failed:\n{traceback.format_exc()}')
+            last_hour = None
+        forecast_scheduler.record(protocol, last_hour, block_event.block.timestamp, refit)
+
+
+async def track_drift(block_event: forta_agent.block_event.BlockEvent) -> None:
     """
-    this function removes old rows from the database
+    This function is triggered by handle_block using function main(). When the block starts the new hour, the max
+    priority fees of the protocols in the closed hour are compared with the forecasts, so the drifted models are
+    refitted by the scheduler. The priority fees of the closed hour are already calculated by base_fee_logic(). The
+    forecasts are saved when the hour is started, since the forecast refreshed during the hour replaces the row of this
+    hour and would hide the drift of the model that was actually used.
+    @param block_event: Block event received from handle_block()
+    @return:
+    """
+    global drift_hour
+    global drift_rows
+
+    hour = block_event.block.timestamp - block_event.block.timestamp % 3600
+    if drift_hour is not None and hour > drift_hour:
+        observed = await db_utils.get_transactions().get_max_grouped_by_range('priority_fee', 'contract', 'timestamp',
+                                                                             drift_hour, drift_hour + 3600)
+        # the protocols forecasted for the first time during the hour are compared with that forecast
+        future_rows = {**await get_future_rows(drift_hour), **drift_rows}
+        for contract, priority_fee in observed.items():
+            if priority_fee is None or contract not in future_rows:
+                continue
+            forecast_scheduler.drift.observe(contract, priority_fee, future_rows[contract])
+            if debug_logs_enabled and forecast_scheduler.drift.drifted(contract):
+                print(f'INFO: Forecast of {get_key_by_value(protocols, contract)} has drifted, '
+                      f'residual: {forecast_scheduler.drift.residual(contract):.2f}, '
+                      f'coverage: {forecast_scheduler.drift.coverage(contract):.2f}')
+    if hour != drift_hour:
+        drift_rows = await get_future_rows(hour)
+    drift_hour = hour
+
+
+async def clean_db(block_number: int, timestamp: int, blocks, transactions):
+    """
+    this function removes old rows from the database. The old transactions are rolled up to the hourly max priority
+    fees, the old hourly fees are rolled up to the daily ones, so the forecaster keeps the longer history in less space
     @param block_number:
+    @param timestamp: timestamp of the block
     @param blocks:
     @param transactions:
     @return:
     """
-
-    await asyncio.gather(
-        blocks.delete_old(block_number, history_capacity),
-        transactions.delete_old(block_number, history_capacity),
-    )
+    await blocks.delete_old(block_number, history_capacity)
+    await roll_up_history(timestamp)
 
 
 async def main(event: forta_agent.transaction_event.TransactionEvent | forta_agent.block_event.BlockEvent):
     """
     This function is used to start logic functions in the different threads and then gather the findings
     """
-    global initialized
-    global blocks_counter
-    global real_base_fee_detected
-
-    if isinstance(event, forta_agent.transaction_event.TransactionEvent):
-        return await asyncio.gather(
-            analyze_transaction(event),
-        )
-    else:
-        if not initialized:
-            await my_initialize(event)
-        await asyncio.gather(
-            analyze_blocks(event),
-            base_fee_logic(event.block_number - 1),
-        ) if not real_base_fee_detected else await analyze_blocks(event)
-        return []
+    if isinstance(event, forta_agent.block_event.BlockEvent) and not initialized:
+        await my_initialize(event)
+
+    # in the worker mode the protocols are scored and forecasted by the worker processes
+    dispatcher = get_dispatcher(protocols, test=test_mode, path=database_path) if workers_count > 0 else None
+    workers = {'score': dispatcher.score, 'forecast_missing': dispatcher.forecast} if dispatcher else {}
+
+    # all the database operations of the event share one connection and are committed together
+    try:
+        async with db_utils.unit_of_work():
+            if isinstance(event, forta_agent.transaction_event.TransactionEvent) and dispatcher:
+                findings = await analyze_transactions([event], **workers)
+            elif isinstance(event, forta_agent.transaction_event.TransactionEvent):
+                findings = await asyncio.gather(
+                    analyze_transaction(event),
+                )
+            elif isinstance(event, list):
+                findings = await analyze_transactions(event, **workers)
+            else:
+                await asyncio.gather(
+                    analyze_blocks(event),
+                    base_fee_logic(event.block_number - 1),
+                ) if not real_base_fee_detected else await analyze_blocks(event)
+                await track_drift(event)
+                findings = []
+    except Exception:
+        # the transactions were not stored, so they should not be skipped when they are re-delivered
+        seen_hashes.rollback()
+        raise
+    seen_hashes.commit()
+
+    # the refits are made after the block is committed, so the write transaction is not held during the fits
+    if isinstance(event, forta_agent.block_event.BlockEvent) and not dispatcher:
+        await refresh_forecasts(event)
+
+    # the in-memory database is saved only when the block is committed
+    if isinstance(event, forta_agent.block_event.BlockEvent) and event.block_number % snapshot_every_n_blocks == 0:
+        await snapshot_db()
+
+    # the workers refit the models in the background after the block is committed
+    if dispatcher and isinstance(event, forta_agent.block_event.BlockEvent) and \
+            current_capacity > minimal_capacity_to_forecast:
+        dispatcher.refresh(event.block.timestamp, protocols_addresses)
+    return findings
 
 
 def provide_handle_transaction():
@@ -404,11 +643,30 @@ def provide_handle_transaction():
     """
 
     def wrapped_handle_transaction(transaction_event: forta_agent.transaction_event.TransactionEvent) -> list:
-        return [finding for findings in asyncio.run(main(transaction_event)) for finding in findings]
+        with profiler.profile('handle_transaction', transaction_event.block_number, transaction_event.to), \
+                memory_monitor.measure('handle_transaction', block=transaction_event.block_number,
+                                       protocol=transaction_event.to):
+            return [finding for findings in asyncio.run(main(transaction_event)) for finding in findings]
 
     return wrapped_handle_transaction
 
 
+def provide_handle_transactions():
+    """
+    This function is just a wrapper for the handle_transactions()
+    @return:
+    """
+
+    def wrapped_handle_transactions(transaction_events: list) -> list:
+        if not transaction_events:
+            return []
+        with profiler.profile('handle_transactions', transaction_events[0].block_number), \
+                memory_monitor.measure('handle_transactions', block=transaction_events[0].block_number):
+            return [finding for findings in asyncio.run(main(transaction_events)) for finding in findings]
+
+    return wrapped_handle_transactions
+
+
 def provide_handle_block():
     """
     This function is just a wrapper for the handle_block()
@@ -416,7 +674,9 @@ def provide_handle_block():
     """
 
     def wrapped_handle_block(block_event: forta_agent.block_event.BlockEvent) -> list:
-        return [finding for findings in asyncio.run(main(block_event)) for finding in findings]
+        with profiler.profile('handle_block', block_event.block_number), \
+                memory_monitor.measure('handle_block', block=block_event.block_number):
+            return [finding for findings in asyncio.run(main(block_event)) for finding in findings]
 
     return wrapped_handle_block
 
@@ -430,6 +690,45 @@ def handle_transaction(transaction_event: forta_agent.transaction_event.Transact
     return provide_handle_transaction()(transaction_event)
 
 
+def handle_transactions(transaction_events: list):
+    """
+    This function is the batch version of the handle_transaction()
+    @param transaction_events: list of forta_agent.transaction_event.TransactionEvent in the order they were received
+    @return: findings in the order of the events
+    """
+    return provide_handle_transactions()(transaction_events)
+
+
+class TransactionsBuffer:
+    """
+    This class is an adapter for the callers that receive the transactions one by one. It collects the transactions of
+    the block and analyzes them with handle_transactions() when the transaction of the next block is received, so the
+    findings of the block are returned one call later. The rest of the transactions should be analyzed with flush().
+    """
+
+    def __init__(self, handler=handle_transactions):
+        self.handler = handler
+        self.transaction_events = []
+
+    def add(self, transaction_event: forta_agent.transaction_event.TransactionEvent) -> list:
+        """
+        @param transaction_event: forta_agent.transaction_event.TransactionEvent
+        @return: findings of the previous block if the event starts the new one
+        """
+        findings = []
+        if self.transaction_events and self.transaction_events[-1].block_number != transaction_event.block_number:
+            findings = self.flush()
+        self.transaction_events.append(transaction_event)
+        return findings
+
+    def flush(self) -> list:
+        """
+        @return: findings of the buffered transactions
+        """
+        transaction_events, self.transaction_events = self.transaction_events, []
+        return self.handler(transaction_events)
+
+
 def handle_block(block_event: forta_agent.block_event.BlockEvent):
     """
     This function is used by Forta SDK
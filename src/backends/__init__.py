@@ -0,0 +1,41 @@
+from importlib import import_module
+
+from src.config import default_forecasting_backend, forecasting_backends, ETHER_protocols, POLYGON_protocols, \
+    AVALANCHE_protocols
+
+# the backends are imported only when they are used, so their dependencies are optional
+BACKENDS = {
+    'prophet': ('src.backends.prophet_backend', 'ProphetBackend'),
+    'deeplog': ('src.backends.deeplog_backend', 'DeepLogBackend'),
+}
+
+
+def get_backend_class(name: str):
+    """
+    @param name: name of the backend from the BACKENDS
+    @return: backend class
+    """
+    if name not in BACKENDS:
+        raise ValueError(f'Unknown forecasting backend: {name}')
+    module, class_name = BACKENDS[name]
+    return getattr(import_module(module), class_name)
+
+
+def get_backend_name(protocol: str) -> str:
+    """
+    @param protocol: protocol address
+    @return: name of the backend configured for the protocol in the forecasting_backends or the default one
+    """
+    for protocols in (ETHER_protocols, POLYGON_protocols, AVALANCHE_protocols):
+        for name, address in protocols.items():
+            if address.lower() == protocol and name in forecasting_backends:
+                return forecasting_backends[name]
+    return default_forecasting_backend
+
+
+def create_backend(protocol: str):
+    """
+    @param protocol: protocol address
+    @return: new backend instance for the protocol
+    """
+    return get_backend_class(get_backend_name(protocol))()
@@ -0,0 +1,42 @@
+import pandas as pd
+
+
+class ForecastBackend:
+    """
+    This class is the interface of the forecasting backends. The backend is fitted on the hourly max priority fees and
+    predicts the expected priority fee with its bounds for the upcoming hours.
+    """
+    name = None
+
+    def fit(self, train: pd.DataFrame) -> None:
+        """
+        @param train: DataFrame with the 'ds' (hour) and 'y' (max priority fee) columns, the empty hours are NaN
+        @return:
+        """
+        raise NotImplementedError
+
+    def predict(self, start: pd.Timestamp, periods: int) -> pd.DataFrame:
+        """
+        @param start: the first hour to predict
+        @param periods: the amount of hours to predict
+        @return: DataFrame with the 'ds', 'yhat', 'yhat_lower' and 'yhat_upper' columns
+        """
+        raise NotImplementedError
+
+    def serialize(self) -> bytes:
+        """
+        @return: the fitted model that can be restored with load()
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def load(cls, data: bytes) -> 'ForecastBackend':
+        """
+        @param data: the model returned by serialize()
+        @return: the fitted backend
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def hours(start: pd.Timestamp, periods: int) -> pd.DataFrame:
+        return pd.DataFrame({'ds': pd.date_range(start, periods=periods, freq=pd.Timedelta(hours=1))})
@@ -0,0 +1,65 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from .base import ForecastBackend
+
+
+class DeepLogBackend(ForecastBackend):
+    """
+    The experimental backend based on the TODS DeepLog (LSTM) anomaly detector, as in research/tods_analyse.ipynb.
+    DeepLog marks the anomalous hours of the history, and the bounds for each hour of the day are the quantiles of the
+    normal hours. It always runs on the CPU and requires the `tods` package to be installed.
+    """
+    name = 'deeplog'
+
+    def __init__(self, profile: dict = None, epochs: int = 10, interval_width: float = 0.8):
+        self.profile = profile
+        self.epochs = epochs
+        self.interval_width = interval_width
+
+    def fit(self, train: pd.DataFrame) -> None:
+        # the backend should never try to use the GPU
+        os.environ.setdefault('CUDA_VISIBLE_DEVICES', '-1')
+        try:
+            from tods.detection_algorithm.DeepLog import DeepLog
+        except ImportError as e:
+            raise ImportError('The deeplog forecasting backend requires the tods package') from e
+
+        train = train.dropna(subset=['y'])
+        values = train['y'].to_numpy(dtype=np.float64).reshape(-1, 1)
+
+        detector = DeepLog(epochs=self.epochs)
+        detector.fit(values)
+        normal = train[np.asarray(detector.predict(values)).flatten() == 0]
+        self.profile = self.build_profile(normal if len(normal) else train)
+
+    def build_profile(self, train: pd.DataFrame) -> dict:
+        """
+        @param train: DataFrame with the 'ds' and 'y' columns of the normal hours, the empty hours are skipped
+        @return: dict with the expected value and the bounds for each hour of the day and for the whole day. The hours
+        of the day without the values are left out, so they are predicted with the bounds of the whole day
+        """
+        lower_q, upper_q = (1 - self.interval_width) / 2, (1 + self.interval_width) / 2
+        train = train.dropna(subset=['y'])
+
+        def bounds(y: pd.Series) -> list:
+            return [float(y.median()), float(y.quantile(lower_q)), float(y.quantile(upper_q))]
+
+        return {'hours': {str(hour): bounds(y) for hour, y in train.groupby(train['ds'].dt.hour)['y']},
+                'all': bounds(train['y'])}
+
+    def predict(self, start: pd.Timestamp, periods: int) -> pd.DataFrame:
+        future = self.hours(start, periods)
+        values = np.array([self.profile['hours'].get(str(hour), self.profile['all']) for hour in future['ds'].dt.hour])
+        future['yhat'], future['yhat_lower'], future['yhat_upper'] = values[:, 0], values[:, 1], values[:, 2]
+        return future
+
+    def serialize(self) -> bytes:
+        return json.dumps(self.profile).encode()
+
+    @classmethod
+    def load(cls, data: bytes) -> 'DeepLogBackend':
+        return cls(json.loads(data.decode()))
@@ -0,0 +1,38 @@
+import logging
+
+import pandas as pd
+from prophet import Prophet
+from prophet.serialize import model_to_json, model_from_json
+
+from .base import ForecastBackend
+
+logger = logging.getLogger('prophet')
+logger.setLevel(logging.ERROR)
+logger = logging.getLogger('cmdstanpy')
+logger.setLevel(logging.ERROR)
+logger = logging.getLogger('stanpy')
+logger.setLevel(logging.ERROR)
+
+
+class ProphetBackend(ForecastBackend):
+    """
+    The default backend, it fits the Prophet model with the daily and weekly seasonality
+    """
+    name = 'prophet'
+
+    def __init__(self, model: Prophet = None):
+        self.model = model
+
+    def fit(self, train: pd.DataFrame) -> None:
+        self.model = Prophet()
+        self.model.fit(train)
+
+    def predict(self, start: pd.Timestamp, periods: int) -> pd.DataFrame:
+        return self.model.predict(self.hours(start, periods))[['ds', 'yhat', 'yhat_lower', 'yhat_upper']]
+
+    def serialize(self) -> bytes:
+        return model_to_json(self.model).encode()
+
+    @classmethod
+    def load(cls, data: bytes) -> 'ProphetBackend':
+        return cls(model_from_json(data.decode()))
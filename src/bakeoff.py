@@ -0,0 +1,186 @@
+import argparse
+import asyncio
+import json
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from src.backends import BACKENDS, get_backend_class
+from src.config import forecast_horizon
+from src.db.controller import init_async_db
+from src.db.db_utils import db_utils
+from src.findings import SEVERITIES, classify_priority_fees
+from src.forecaster import hourly_max_priority_fees
+from src.memory import read_rss, reset_peak_rss
+from src.utils import get_protocols_by_chain
+
+RESULT_COLUMNS = ['protocol', 'backend', 'origins', 'fit_time', 'fit_time_max', 'predict_time', 'peak_memory_mb',
+                  'peak_rss_mb', 'coverage', 'mae_gwei', 'transactions', 'critical', 'high']
+
+
+def count_alerts(transactions: np.ndarray, forecast: pd.DataFrame, hours_count: int = None) -> tuple:
+    """
+    This function counts the alerts that the agent would produce for the transactions with this forecast. Only the
+    severities enabled in the config are counted
+    @param transactions: array with the timestamp and priority_fee columns
+    @param forecast: DataFrame returned by the backend
+    @param hours_count: the amount of the first forecasted hours to evaluate, the whole forecast if it is None
+    @return: amount of the evaluated transactions, critical and high alerts
+    """
+    hours_count = len(forecast) if hours_count is None else min(hours_count, len(forecast))
+    first_hour = int((forecast['ds'].iloc[0] - pd.Timestamp(0)) // pd.Timedelta(seconds=1))
+    hours = transactions[:, 0] - transactions[:, 0] % 3600
+    mask = (hours >= first_hour) & (hours < first_hour + hours_count * 3600) & ~np.isnan(transactions[:, 1])
+    if not mask.any():
+        return 0, 0, 0
+
+    # the forecasted values are stored as the integers
+    index = ((hours[mask] - first_hour) // 3600).astype(int)
+    expected = forecast['yhat'].to_numpy().astype(np.int64)[index]
+    expected_upper = forecast['yhat_upper'].to_numpy().astype(np.int64)[index]
+    expected_lower = forecast['yhat_lower'].to_numpy().astype(np.int64)[index]
+
+    severities = classify_priority_fees(transactions[mask, 1], expected, expected_upper,
+                                        expected_upper - expected_lower)
+    return int(mask.sum()), int((severities == SEVERITIES.index('critical')).sum()), \
+        int((severities == SEVERITIES.index('high')).sum())
+
+
+def measure_peak_memory(backend_class, train: pd.DataFrame, horizon: int) -> float:
+    """
+    This function fits the backend once more with the allocations tracing, so the tracing doesn't affect the timings
+    @return: peak memory of the python allocations in MB
+    """
+    tracemalloc.start()
+    try:
+        backend = backend_class()
+        backend.fit(train)
+        backend.predict(train['ds'].iloc[-1], horizon)
+        return tracemalloc.get_traced_memory()[1] / 2 ** 20
+    finally:
+        tracemalloc.stop()
+
+
+def backtest(backend_class, series: pd.DataFrame, transactions: np.ndarray, min_train: int, step: int,
+             horizon: int) -> dict:
+    """
+    This function runs the rolling-origin backtest: the backend is fitted on the hours before each origin and predicts
+    the horizon starting from the origin, as the agent does after each refit
+    @param backend_class: backend to evaluate
+    @param series: hourly max priority fees with the 'ds' and 'y' columns
+    @param transactions: array with the timestamp and priority_fee columns
+    @param min_train: the amount of hours before the first origin
+    @param step: the amount of hours between the origins
+    @param horizon: the amount of predicted hours
+    @return: metrics of the backend
+    """
+    fit_times, predict_times, peak_rss, covered, errors = [], [], [], [], []
+    evaluated = critical = high = 0
+
+    for origin in range(min_train, len(series), step):
+        train = series.iloc[:origin]
+
+        backend = backend_class()
+        # tracemalloc doesn't see the native allocations of the models, so the peak RSS of the fit is measured too
+        reset_peak_rss()
+        rss_before = read_rss()[0]
+        start = time.perf_counter()
+        backend.fit(train)
+        fit_times.append(time.perf_counter() - start)
+        peak_rss.append(max(read_rss()[1] - rss_before, 0))
+
+        start = time.perf_counter()
+        forecast = backend.predict(series['ds'].iloc[origin], horizon)
+        predict_times.append(time.perf_counter() - start)
+
+        actual = series.iloc[origin:origin + horizon].reset_index(drop=True)
+        observed = actual['y'].notna().to_numpy()
+        y = actual['y'].to_numpy()[observed]
+        lower = forecast['yhat_lower'].to_numpy()[:len(actual)][observed]
+        upper = forecast['yhat_upper'].to_numpy()[:len(actual)][observed]
+        covered.extend((lower <= y) & (y <= upper))
+        errors.extend(np.abs(y - forecast['yhat'].to_numpy()[:len(actual)][observed]))
+
+        # the next origin replaces the forecast, so the overlapping hours are evaluated only once
+        counts = count_alerts(transactions, forecast, step)
+        evaluated, critical, high = evaluated + counts[0], critical + counts[1], high + counts[2]
+
+    if not fit_times:
+        return {}
+
+    return {'origins': len(fit_times),
+            'fit_time': float(np.mean(fit_times)),
+            'fit_time_max': float(np.max(fit_times)),
+            'predict_time': float(np.mean(predict_times)),
+            'peak_memory_mb': measure_peak_memory(backend_class, series.iloc[:len(series) - 1], horizon),
+            'peak_rss_mb': max(peak_rss) / 2 ** 20,
+            'coverage': float(np.mean(covered)) if covered else None,
+            'mae_gwei': float(np.mean(errors)) / 10 ** 9 if errors else None,
+            'transactions': evaluated,
+            'critical': critical,
+            'high': high}
+
+
+def format_table(results: list) -> str:
+    """
+    @param results: list of the metrics
+    @return: the metrics as the text table
+    """
+    def cell(value):
+        return f'{value:.3f}' if isinstance(value, float) else str(value)
+
+    rows = [RESULT_COLUMNS] + [[cell(result.get(column)) for column in RESULT_COLUMNS] for result in results]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(RESULT_COLUMNS))]
+    return '\n'.join('  '.join(value.ljust(width) for value, width in zip(row, widths)) for row in rows)
+
+
+async def main(args):
+    protocols = get_protocols_by_chain(args.chain_id)
+    if args.protocols:
+        protocols = {name: address for name, address in protocols.items() if name in args.protocols}
+
+    # the collected database is only read, so it is not migrated or changed by the backtest
+    transaction_table, blocks_table, future_table = await init_async_db(path=args.db, read_only=True)
+    db_utils.set_tables(transaction_table, blocks_table, future_table)
+    registered = transaction_table.model.__table__.c.contract.type.registry.ids
+
+    backends = list(args.backends)
+    results = []
+    for name, address in protocols.items():
+        if address.lower() not in registered:
+            print(f'WARNING: {name} is skipped, the database has no rows of it')
+            continue
+        series, _ = await hourly_max_priority_fees(address.lower())
+        transactions = await transaction_table.get_array_by_criteria(['timestamp', 'priority_fee'],
+                                                                     {'contract': address.lower()})
+        for backend_name in list(backends):
+            # the optional dependencies of the backend may be not installed
+            try:
+                result = backtest(get_backend_class(backend_name), series, transactions, args.min_train, args.step,
+                                  args.horizon)
+            except ImportError as e:
+                print(f'WARNING: {backend_name} backend is skipped: {e}')
+                backends.remove(backend_name)
+                continue
+            if result:
+                results.append({'protocol': name, 'backend': backend_name, **result})
+
+    print(format_table(results))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rolling-origin backtest of the forecasting backends')
+    parser.add_argument('--db', default='./test.db', help='path to the collected database')
+    parser.add_argument('--backends', nargs='+', default=list(BACKENDS), help='backends to compare')
+    parser.add_argument('--protocols', nargs='+', help='protocol names from the config, all by default')
+    parser.add_argument('--chain-id', type=int, default=1, help='chain id to select the protocols from the config')
+    parser.add_argument('--min-train', type=int, default=72, help='the amount of hours before the first origin')
+    parser.add_argument('--step', type=int, default=forecast_horizon, help='the amount of hours between the origins')
+    parser.add_argument('--horizon', type=int, default=forecast_horizon + 1, help='the amount of predicted hours')
+    parser.add_argument('--output', help='path to the JSON report')
+    asyncio.run(main(parser.parse_args()))
@@ -1,12 +1,53 @@
+import os
+
 test_mode = False  # The mode when the bot uses test database
 debug_logs_enabled = True  # Print the debug logs
 history_capacity = 6300 * 7  # The amount of blocks to store in the database
+raw_history_period = 3600 * 24 * 2  # The amount of seconds of the raw transactions, the older ones are rolled up hourly
+hourly_history_period = 3600 * 24 * 28  # The amount of seconds of the hourly fees, the older ones are rolled up daily
+daily_history_period = 3600 * 24 * 365  # The amount of seconds of the daily fees to store
 minimal_capacity_to_forecast = 6300 * 1  # The minimal amount of the blocks to start forecasting
+forecast_horizon = 24  # The amount of hours to forecast after the last collected hour
+forecast_refresh_lead = 3600 * 2  # The amount of seconds before the forecast expiration to start refreshing it
+forecast_refits_per_block = 1  # The max amount of the scheduled refits per block
+forecast_max_model_age = 3600 * 24 * 3  # The amount of seconds the model can extend its forecast without the refit
+drift_ewma_alpha = 0.2  # The weight of the last hour in the smoothed residual and coverage of the forecast
+drift_residual_threshold = 1.0  # The model is refitted when the smoothed residual exceeds this amount of the intervals
+drift_coverage_threshold = 0.5  # The model is refitted when the smoothed share of the hours inside the interval is less
+drift_min_hours = 3  # The amount of the observed hours before the drift of the new forecast is checked
+default_forecasting_backend = 'prophet'  # The forecasting backend: 'prophet' or experimental 'deeplog'
 critical_enable = True  # Enables critical alerts
 high_enable = True  # Enables high alerts
 medium_enable = False  # Enables medium alerts
 low_enable = False  # Enables low alerts
 win_streak_limit = 20  # The needed amount of successful checks to be sure that the base_fee was properly calculated
+workers_count = 0  # The amount of the worker processes that analyze the protocols, 0 analyzes them in the agent
+sqlite_busy_timeout = 30  # The amount of seconds to wait for the database locked by the other process
+seen_hashes_capacity = 100000  # The amount of the last transaction hashes kept to skip the re-delivered transactions
+database_path = os.environ.get('DATABASE_PATH')  # The database file, ./main.db or ./test.db by default
+in_memory_db = False  # Keeps the database in memory, the database file is used only for its snapshots
+snapshot_every_n_blocks = 100  # The amount of blocks between the snapshots of the in-memory database
+
+# The profiling of the event handling, can be also enabled with the environment variables
+profiling_enabled = os.environ.get('PROFILING_ENABLED', 'false').lower() == 'true'  # Enables the sampling profiler
+profiling_every_n = int(os.environ.get('PROFILING_EVERY_N', 1000))  # Every Nth handled event is saved
+profiling_latency_threshold = float(os.environ.get('PROFILING_LATENCY_THRESHOLD', 1))  # Events slower (sec) are saved
+profiling_interval = float(os.environ.get('PROFILING_INTERVAL', 0.005))  # The interval (sec) between the stack samples
+profiling_dir = os.environ.get('PROFILING_DIR', './profiles')  # The directory for the profiles
+profiling_max_files = int(os.environ.get('PROFILING_MAX_FILES', 200))  # The amount of the newest profiles to keep
+
+# The memory monitoring, can be also configured with the environment variables
+memory_tracking_enabled = os.environ.get('MEMORY_TRACKING_ENABLED', 'false').lower() == 'true'  # Enables tracemalloc
+memory_tracking_every_n = int(os.environ.get('MEMORY_TRACKING_EVERY_N', 100))  # Every Nth measurement is attributed
+memory_tracking_frames = int(os.environ.get('MEMORY_TRACKING_FRAMES', 4))  # The amount of the traced frames
+memory_budget_mb = int(os.environ.get('MEMORY_BUDGET_MB', 0))  # RSS (MB) to shrink caches and defer refits, 0 is off
+memory_shrink_interval = float(os.environ.get('MEMORY_SHRINK_INTERVAL', 60))  # The min seconds between cache shrinks
+memory_metrics_path = os.environ.get('MEMORY_METRICS_PATH', '')  # The JSONL file for the memory metrics, '' is off
+
+# Specify the forecasting backend for the specific protocols here, e.g. "Uniswap": "deeplog"
+forecasting_backends = {
+
+}
 
 # Specify your own protocols for the Ethereum here
 ETHER_protocols = {
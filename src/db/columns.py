@@ -0,0 +1,78 @@
+from sqlalchemy import Integer, LargeBinary, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.types import TypeDecorator
+
+
+class HexBinary(TypeDecorator):
+    """
+    This type stores the hex strings such as the hashes and the addresses as the bytes, that is twice smaller. The values
+    are still the '0x' prefixed lowercase strings in the code.
+    """
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        # web3 returns the hashes as HexBytes
+        if isinstance(value, bytes):
+            return bytes(value)
+        digits = value[2:] if value.startswith('0x') else value
+        try:
+            # the odd length values such as '0x1' are left padded, so they are read back as '0x01'
+            return bytes.fromhex(digits.rjust(len(digits) + len(digits) % 2, '0'))
+        except ValueError:
+            raise ValueError(f'{value} is not a hex string') from None
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else '0x' + value.hex()
+
+
+class ProtocolRegistry:
+    """
+    This class keeps the mapping between the protocol addresses and their keys in the protocols table. The protocols are
+    registered when the database is initialized, so the mapping is never changed during the events handling.
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.addresses = {}
+
+    def sync(self, connection, table, addresses=()):
+        """
+        This function registers the addresses and loads the keys of all the registered protocols
+        @param connection: sync connection
+        @param table: protocols table
+        @param addresses: protocol addresses to register
+        @return:
+        """
+        if addresses:
+            connection.execute(insert(table).on_conflict_do_nothing(),
+                               [{'address': address.lower()} for address in dict.fromkeys(addresses)])
+        for key, address in connection.execute(select(table.c.id, table.c.address)):
+            self.ids[address] = key
+            self.addresses[key] = address
+
+
+class ProtocolKey(TypeDecorator):
+    """
+    This type stores the protocol address as the integer key of the protocols table. The values are still the addresses
+    in the code, so the criteria and the rows don't change.
+    """
+    impl = Integer
+    cache_ok = True
+
+    def __init__(self, registry: ProtocolRegistry):
+        super().__init__()
+        self.registry = registry
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        try:
+            return self.registry.ids[value.lower()]
+        except KeyError:
+            raise ValueError(f'Protocol {value} is not registered') from None
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else self.registry.addresses[value]
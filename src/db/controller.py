@@ -1,15 +1,54 @@
+import os
+
+import aiosqlite
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.pool import StaticPool
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 
+from .columns import ProtocolRegistry
 from .db_utils import db_utils
 from .models import wrapped_models as wrapped_models_func
 from .methods import wrapped_methods
+from .migrations import migrate, check_schema
+from src.config import sqlite_busy_timeout
+
+
+async def get_driver_connection(connection):
+    """
+    @param connection: AsyncConnection of the engine
+    @return: aiosqlite connection under the pool
+    """
+    return (await connection.get_raw_connection()).driver_connection
 
 
-async def init_async_db(test=False):
+async def init_async_db(test=False, path=None, wal=False, protocols_addresses=(), in_memory=False, read_only=False):
     name = "test" if test else "main"
-    engine = create_async_engine(fr'sqlite+aiosqlite:///./{name}.db', future=True, echo=False)
+    path = path or f'./{name}.db'
+
+    if read_only:
+        # the tools that only read the database, e.g. the live one of the agent, don't migrate or change it
+        if not os.path.exists(path):
+            raise FileNotFoundError(f'The database {path} does not exist')
+        engine = create_async_engine(f'sqlite+aiosqlite:///file:{path}?mode=ro&uri=true', future=True, echo=False,
+                                     connect_args={'timeout': sqlite_busy_timeout})
+    elif in_memory:
+        # the single connection keeps the in-memory database alive, the file is used only for the snapshots
+        engine = create_async_engine('sqlite+aiosqlite://', future=True, echo=False, poolclass=StaticPool)
+        if os.path.exists(path):
+            async with engine.connect() as conn:
+                async with aiosqlite.connect(path) as source:
+                    await source.backup(await get_driver_connection(conn))
+    else:
+        engine = create_async_engine(fr'sqlite+aiosqlite:///{path}', future=True, echo=False,
+                                     connect_args={'timeout': sqlite_busy_timeout})
+    db_utils.set_engine(engine if in_memory and not read_only else None, path)
+
+    # the write-ahead log lets the worker processes read the database while the other process writes it
+    if wal and not in_memory and not read_only:
+        async with engine.connect() as conn:
+            await conn.execute(text('PRAGMA journal_mode=WAL'))
 
     session = sessionmaker(
         engine, expire_on_commit=False, class_=AsyncSession
@@ -17,10 +56,48 @@ async def init_async_db(test=False):
 
     base = declarative_base()
     db_utils.set_base(base)
-    wrapped_models = await wrapped_models_func(base)
+    db_utils.set_session(session)
+    # the protocols are stored as the keys of the protocols table, so they should be registered before the usage
+    registry = ProtocolRegistry()
+    wrapped_models = await wrapped_models_func(base, registry)
 
-    async with engine.begin() as conn:
-        await conn.run_sync(base.metadata.create_all)
+    if read_only:
+        # the protocols are only loaded, so the protocols without the rows can't be queried
+        async with engine.connect() as conn:
+            await conn.run_sync(check_schema, base.metadata)
+            await conn.run_sync(registry.sync, base.metadata.tables['protocols'])
+        rebuilt = False
+    else:
+        async with engine.begin() as conn:
+            await conn.run_sync(base.metadata.create_all)
+            rebuilt = await conn.run_sync(migrate, base.metadata)
+            await conn.run_sync(registry.sync, base.metadata.tables['protocols'], protocols_addresses)
 
-    transactions, blocks, future = await wrapped_methods(wrapped_models, session)
+    # the space of the rebuilt tables is returned to the file system
+    if rebuilt:
+        async with engine.connect() as conn:
+            await conn.execute(text('VACUUM'))
+
+    transactions, blocks, future, hourly_fees, daily_fees = await wrapped_methods(wrapped_models, session)
+    db_utils.set_rollups(hourly_fees, daily_fees)
     return transactions, blocks, future
+
+
+async def snapshot_db() -> bool:
+    """
+    This function saves the in-memory database to its file. The snapshot is written to the temporary file and moved
+    over the previous one, so the file always contains the complete snapshot even if the agent is killed meanwhile
+    @return: False if the database is not in memory
+    """
+    engine, path = db_utils.get_engine()
+    if engine is None:
+        return False
+
+    tmp_path = f'{path}.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    async with engine.connect() as conn:
+        async with aiosqlite.connect(tmp_path) as target:
+            await (await get_driver_connection(conn)).backup(target)
+    os.replace(tmp_path, path)
+    return True
@@ -1,9 +1,19 @@
+from src.config import raw_history_period, hourly_history_period, daily_history_period
+from .methods import unit_of_work
+
+
 class DBUtils:
     def __init__(self):
         self.transactions = None
         self.base = None
         self.blocks = None
         self.future = None
+        self.hourly_fees = None
+        self.daily_fees = None
+        self.session = None
+        # the engine of the in-memory database and the file of its snapshots
+        self.engine = None
+        self.path = None
 
     def get_transactions(self):
         return self.transactions
@@ -14,13 +24,57 @@ class DBUtils:
     def get_future(self):
         return self.future
 
+    def get_hourly_fees(self):
+        return self.hourly_fees
+
+    def get_daily_fees(self):
+        return self.daily_fees
+
     def set_tables(self, transactions, blocks, future):
         self.transactions = transactions
         self.blocks = blocks
         self.future = future
 
+    def set_rollups(self, hourly_fees, daily_fees):
+        self.hourly_fees = hourly_fees
+        self.daily_fees = daily_fees
+
+    def get_session(self):
+        return self.session
+
+    def unit_of_work(self):
+        return unit_of_work(self.session)
+
     def set_base(self, base):
         self.base = base
 
+    def set_session(self, session):
+        self.session = session
+
+    def get_engine(self):
+        return self.engine, self.path
+
+    def set_engine(self, engine, path):
+        self.engine = engine
+        self.path = path
+
 
 db_utils = DBUtils()
+
+
+async def roll_up_history(timestamp: int):
+    """
+    This function rolls the old transactions up to the hourly max priority fees and the old hourly fees up to the daily
+    ones, so the forecaster keeps the longer history in less space. The daily fees older than their period are removed
+    @param timestamp: the current time, the periods are counted back from it
+    @return:
+    """
+    hourly_fees = db_utils.get_hourly_fees()
+    daily_fees = db_utils.get_daily_fees()
+    hour = timestamp - timestamp % 3600
+    day = timestamp - timestamp % 86400
+
+    # the roll ups are ordered, so the rows are moved to the longer periods in one pass
+    await hourly_fees.roll_up(db_utils.get_transactions(), 3600, hour - raw_history_period)
+    await daily_fees.roll_up(hourly_fees, 86400, day - hourly_history_period)
+    await daily_fees.delete_old_by_timestamp(day - daily_history_period)
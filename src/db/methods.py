@@ -1,6 +1,44 @@
-from sqlalchemy import delete, update, func
+import asyncio
+from collections import namedtuple
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+
+import numpy as np
+from sqlalchemy import delete, update, func, tuple_
+from sqlalchemy.dialects.sqlite import insert
 from sqlalchemy.future import select
 
+# the unit of work opened for the current event, it is inherited by the tasks started inside it
+current_unit_of_work = ContextVar('current_unit_of_work', default=None)
+
+
+class UnitOfWork:
+    def __init__(self, session):
+        self.session = session
+        # the session can't be used by the concurrent tasks, so the methods inside the unit of work are serialized
+        self.lock = asyncio.Lock()
+
+
+@asynccontextmanager
+async def unit_of_work(async_session):
+    """
+    All the methods called inside this context share one session, one connection and one transaction. The transaction
+    is committed on exit or rolled back if an exception is raised. Nested contexts reuse the outer one.
+    @param async_session: session maker
+    """
+    if async_session is None or current_unit_of_work.get() is not None:
+        yield current_unit_of_work.get()
+        return
+
+    async with async_session() as session:
+        async with session.begin():
+            uow = UnitOfWork(session)
+            token = current_unit_of_work.set(uow)
+            try:
+                yield uow
+            finally:
+                current_unit_of_work.reset(token)
+
 
 async def wrapped_methods(wrapped_models: list, async_session) -> list:
     return [Methods(model, async_session) for model in wrapped_models]
@@ -8,6 +46,15 @@ async def wrapped_methods(wrapped_models: list, async_session) -> list:
 
 def wrap_async(func):
     async def wrapper(*args, **kwargs):
+        # the caller may pass its own session to run several methods inside one transaction
+        if kwargs.get('session') is not None:
+            return await func(*args, **kwargs)
+
+        uow = current_unit_of_work.get()
+        if uow is not None:
+            async with uow.lock:
+                return await func(*args, **{**kwargs, **{'session': uow.session}})
+
         async with args[0]._session() as session:
             async with session.begin():
                 kwargs = {**kwargs, **{'session': session}}
@@ -22,6 +69,29 @@ class Methods:
     def __init__(self, model: object(), session):
         self.__model = model
         self._session = session
+        # the rows that conflict on the unique index are merged instead of being inserted twice
+        self._conflict_columns = next((list(index.columns) for index in model.__table__.indexes if index.unique), None)
+
+    @property
+    def model(self):
+        """
+        @return: the model of the table, e.g. the source of the roll_up()
+        """
+        return self.__model
+
+    def _insert(self):
+        """
+        @return: insert statement, it is the upsert if the table has the unique index. The stored values are kept when
+        the new ones are NULL, e.g. the priority fee that was calculated after the transaction was inserted
+        """
+        q = insert(self.__model)
+        if not self._conflict_columns:
+            return q
+        conflict_keys = [c.key for c in self._conflict_columns]
+        columns = [c for c in self.__model.__table__.columns if not c.primary_key and c.key not in conflict_keys]
+        return q.on_conflict_do_update(
+            index_elements=self._conflict_columns,
+            set_={c: func.coalesce(q.excluded[c.key], c) for c in columns})
 
     @wrap_async
     async def commit(self, session):
@@ -29,24 +99,78 @@ class Methods:
 
     @wrap_async
     async def paste_row(self, kwargs, session):
-        session.add(self.__model(**kwargs))
-        await session.flush()
+        await session.execute(self._insert(), kwargs)
+
+    @wrap_async
+    async def paste_rows(self, rows: list, session, batch_size: int = 10000):
+        for i in range(0, len(rows), batch_size):
+            await session.execute(self._insert(), rows[i:i + batch_size])
 
     @wrap_async
     async def delete_old(self, block, th, session) -> int:
         return await session.execute(
             delete(self.__model).where(getattr(self.__model, 'block') < block - th))
 
+    @wrap_async
+    async def delete_block_range(self, first_block, last_block, session) -> int:
+        return await session.execute(
+            delete(self.__model).where(getattr(self.__model, 'block') >= first_block,
+                                       getattr(self.__model, 'block') <= last_block))
+
+    @wrap_async
+    async def delete_timestamp_range(self, first_timestamp, last_timestamp, session, contracts: list = None) -> int:
+        """
+        @param contracts: only the rows of these protocols are deleted, the rows of all the protocols if it is None
+        """
+        q = delete(self.__model).where(getattr(self.__model, 'timestamp') >= first_timestamp,
+                                       getattr(self.__model, 'timestamp') <= last_timestamp)
+        if contracts is not None:
+            q = q.where(getattr(self.__model, 'contract').in_(contracts))
+        return await session.execute(q)
+
     @wrap_async
     async def delete_old_by_timestamp(self, timestamp, session) -> int:
         return await session.execute(
             delete(self.__model).where(getattr(self.__model, 'timestamp') < timestamp))
 
+    @wrap_async
+    async def roll_up(self, source, period: int, before: int, session) -> int:
+        """
+        This function aggregates the rows of the source table older than the timestamp into the periods of this table
+        and deletes them from the source. Each period keeps the max priority fee of the protocol and the amount of its
+        transactions. The period that was partially rolled up before is merged with the new rows.
+        @param source: methods of the transactions or of the shorter roll up
+        @param period: the length of the period of this table in seconds
+        @param before: the older rows are rolled up
+        @return: amount of the rolled up rows of the source
+        """
+        model, source_model = self.__model, source.model
+        start = source_model.timestamp - source_model.timestamp % period
+        transactions = func.sum(source_model.transactions) if hasattr(source_model, 'transactions') else func.count()
+        rows = select(source_model.contract, start, func.max(source_model.priority_fee), transactions).where(
+            source_model.timestamp < before).group_by(source_model.contract, start)
+
+        q = insert(model).from_select([model.contract, model.timestamp, model.priority_fee, model.transactions], rows)
+        await session.execute(q.on_conflict_do_update(index_elements=self._conflict_columns, set_={
+            model.priority_fee: func.max(func.coalesce(q.excluded.priority_fee, model.priority_fee),
+                                         func.coalesce(model.priority_fee, q.excluded.priority_fee)),
+            model.transactions: model.transactions + q.excluded.transactions}))
+
+        result = await session.execute(delete(source_model).where(source_model.timestamp < before))
+        return result.rowcount
+
     @wrap_async
     async def delete_row_by_contract(self, contract, session) -> int:
         return await session.execute(
             delete(self.__model).where(getattr(self.__model, 'contract') == contract))
 
+    @wrap_async
+    async def replace_rows_by_contract(self, contract, rows: list, session):
+        await session.execute(
+            delete(self.__model).where(getattr(self.__model, 'contract') == contract))
+        if rows:
+            await session.execute(self._insert(), rows)
+
     @wrap_async
     async def get_all_rows(self, session) -> tuple or None:
         q = await session.execute(select(self.__model))
@@ -72,6 +196,104 @@ class Methods:
             select(self.__model).where(getattr(self.__model, list(criteria.keys())[0]) == list(criteria.values())[0]))
         return q.scalars().all()
 
+    @wrap_async
+    async def get_max(self, column: str, session, criteria: dict = None):
+        q = select(func.max(getattr(self.__model, column)))
+        for key, value in (criteria or {}).items():
+            q = q.where(getattr(self.__model, key) == value)
+        q = await session.execute(q)
+        return q.scalar()
+
+    @wrap_async
+    async def get_max_grouped(self, column: str, group_by: str, session) -> dict:
+        q = await session.execute(
+            select(getattr(self.__model, group_by), func.max(getattr(self.__model, column))).group_by(
+                getattr(self.__model, group_by)))
+        return dict(q.all())
+
+    @wrap_async
+    async def get_max_grouped_by_range(self, column: str, group_by: str, range_column: str, first, last,
+                                       session) -> dict:
+        """
+        @param first: the first value of the range_column, inclusive
+        @param last: the last value of the range_column, exclusive
+        @return: dict with the group as a key and the max value of the column in the range as a value
+        """
+        q = await session.execute(
+            select(getattr(self.__model, group_by), func.max(getattr(self.__model, column))).where(
+                getattr(self.__model, range_column) >= first, getattr(self.__model, range_column) < last).group_by(
+                getattr(self.__model, group_by)))
+        return dict(q.all())
+
+    def _select_columns(self, columns: list, criteria: dict):
+        q = select(*[getattr(self.__model, column) for column in columns])
+        for key, value in criteria.items():
+            q = q.where(getattr(self.__model, key) == value)
+        return q
+
+    @wrap_async
+    async def get_columns_by_criteria(self, columns: list, criteria: dict, session) -> list:
+        q = await session.execute(self._select_columns(columns, criteria))
+        return q.all()
+
+    @wrap_async
+    async def get_first_columns_by_criteria(self, columns: list, criteria: dict, session) -> tuple or None:
+        q = await session.execute(self._select_columns(columns, criteria).limit(1))
+        return q.first()
+
+    @wrap_async
+    async def get_array_by_criteria(self, columns: list, criteria: dict, session, dtype=float) -> np.ndarray:
+        q = await session.execute(self._select_columns(columns, criteria))
+        return np.array(q.all(), dtype=dtype).reshape(-1, len(columns))
+
+    @wrap_async
+    async def _get_page(self, q, session) -> list:
+        q = await session.execute(q)
+        return q.all()
+
+    async def _stream(self, q, batch_size: int, session, order_by: str = None):
+        """
+        The rows are read by the pages ordered by the column and the primary key instead of one open cursor. Neither the
+        connection nor the lock of the unit of work is held between the pages, so the consumer may use the database
+        while it iterates or abandon the iteration
+        @param order_by: the column to order the rows by, the rows are ordered by the primary key only if it is None
+        """
+        key = [self.__model.id] if order_by is None else [getattr(self.__model, order_by), self.__model.id]
+        row_type = namedtuple('Row', [column.key for column in q.selected_columns])
+        page = q.add_columns(*key).order_by(*key).limit(batch_size)
+        last = None
+        while True:
+            rows = await self._get_page(page if last is None else page.where(tuple_(*key) > tuple_(*last)),
+                                        session=session)
+            if rows:
+                last = tuple(rows[-1][-len(key):])
+                yield [row_type(*row[:-len(key)]) for row in rows]
+            if len(rows) < batch_size:
+                return
+
+    async def stream_columns_by_criteria(self, columns: list, criteria: dict, batch_size: int = 10000, session=None):
+        """
+        This function yields the selected columns of the matching rows by the chunks, so the large result sets are
+        never loaded at once
+        @return: async iterator over the lists of the rows
+        """
+        async for partition in self._stream(self._select_columns(columns, criteria), batch_size, session):
+            yield partition
+
+    async def stream_columns_by_range(self, columns: list, column: str, first, last, batch_size: int = 10000,
+                                      session=None):
+        """
+        This function yields the selected columns of the rows with the column value in the range by the chunks, the rows
+        are ordered by this column
+        @param first: the first value of the range, inclusive
+        @param last: the last value of the range, inclusive
+        @return: async iterator over the lists of the rows
+        """
+        q = self._select_columns(columns, {}).where(getattr(self.__model, column) >= first,
+                                                     getattr(self.__model, column) <= last)
+        async for partition in self._stream(q, batch_size, session, order_by=column):
+            yield partition
+
     @wrap_async
     async def count_rows(self, session) -> object or None:
         q = await session.execute(func.count(self.__model.id))
@@ -0,0 +1,101 @@
+from sqlalchemy import inspect, text
+
+
+def add_transactions_tx_index(connection, metadata):
+    """
+    The databases created before the unique index may contain the duplicated transactions, only the last inserted row
+    of each hash is kept
+    """
+    if 'ix_transactions_tx' in [index['name'] for index in inspect(connection).get_indexes('transactions')]:
+        return
+    connection.execute(text('DELETE FROM transactions WHERE tx IS NOT NULL AND id NOT IN '
+                            '(SELECT MAX(id) FROM transactions WHERE tx IS NOT NULL GROUP BY tx)'))
+    connection.execute(text('CREATE UNIQUE INDEX IF NOT EXISTS ix_transactions_tx ON transactions (tx)'))
+
+
+def is_outdated(connection, table) -> bool:
+    """
+    @return: True if the stored table has the other columns or the column types than the model
+    """
+    stored = {column['name']: str(column['type']) for column in inspect(connection).get_columns(table.name)}
+    return any(stored.get(column.name) != column.type.compile(connection.dialect) for column in table.columns)
+
+
+def encode_hashes_and_protocols(connection, metadata, batch_size: int = 10000):
+    """
+    The hashes were stored as the hex strings and the protocols as their addresses. SQLite can't change the column type,
+    so the outdated tables are rebuilt and their rows are copied through the new column types
+    """
+    tables = [metadata.tables[name] for name in ('transactions', 'blocks', 'future')]
+    tables = [table for table in tables if is_outdated(connection, table)]
+    if not tables:
+        return
+
+    # the protocols found in the stored rows are registered first, so their addresses can be converted to the keys
+    addresses = set()
+    for table in tables:
+        if 'contract' in [column['name'] for column in inspect(connection).get_columns(table.name)]:
+            addresses.update(row[0] for row in connection.execute(
+                text(f'SELECT DISTINCT contract FROM {table.name} WHERE contract IS NOT NULL')))
+    metadata.tables['transactions'].c.contract.type.registry.sync(connection, metadata.tables['protocols'], addresses)
+
+    for table in tables:
+        connection.execute(text(f'ALTER TABLE {table.name} RENAME TO {table.name}_old'))
+        for index in inspect(connection).get_indexes(f'{table.name}_old'):
+            connection.execute(text(f'DROP INDEX {index["name"]}'))
+        table.create(connection)
+
+        # the old columns have the same names as the keys of the new columns. Only the columns of the new table are
+        # copied, the missing ones are left empty
+        stored = [column['name'] for column in inspect(connection).get_columns(f'{table.name}_old')]
+        columns = {column.key: column.key if column.key in stored else column.name
+                   for column in table.columns if column.key in stored or column.name in stored}
+        selected = ', '.join(f'"{name}"' for name in columns.values())
+        rows = connection.execute(text(f'SELECT {selected} FROM {table.name}_old'))
+        while batch := rows.fetchmany(batch_size):
+            connection.execute(table.insert(), [dict(zip(columns, row)) for row in batch])
+        connection.execute(text(f'DROP TABLE {table.name}_old'))
+
+
+def add_transactions_contract_timestamp_index(connection, metadata):
+    """
+    The databases created before the retention have no index for the transactions of the protocol
+    """
+    connection.execute(text('CREATE INDEX IF NOT EXISTS ix_transactions_contract_timestamp '
+                            'ON transactions (contract_id, timestamp)'))
+
+
+# the migrations are idempotent and applied in this order after the tables are created
+MIGRATIONS = [
+    add_transactions_tx_index,
+    encode_hashes_and_protocols,
+    add_transactions_contract_timestamp_index,
+]
+
+
+def migrate(connection, metadata) -> bool:
+    """
+    This function brings the existing database to the current schema
+    @param connection: sync connection
+    @param metadata: metadata of the models
+    @return: True if the tables were rebuilt, so the database file can be compacted
+    """
+    outdated = any(is_outdated(connection, table) for table in metadata.sorted_tables)
+    for migration in MIGRATIONS:
+        migration(connection, metadata)
+    return outdated
+
+
+def check_schema(connection, metadata):
+    """
+    This function checks the database that is opened without the migrations, e.g. the read-only one
+    @param connection: sync connection
+    @param metadata: metadata of the models
+    @return:
+    """
+    existing = inspect(connection).get_table_names()
+    outdated = [table.name for table in metadata.sorted_tables
+                if table.name not in existing or is_outdated(connection, table)]
+    if outdated:
+        raise ValueError(f'The tables {", ".join(outdated)} have the outdated schema, the database should be opened by '
+                         f'the agent once to migrate it')
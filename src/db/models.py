@@ -1,16 +1,24 @@
-from sqlalchemy import Column, String, Integer, Boolean, Float, TIMESTAMP
+from sqlalchemy import Column, Integer, Index
 from sqlalchemy.ext.declarative import declarative_base
 
+from .columns import HexBinary, ProtocolKey, ProtocolRegistry
+
+
+async def wrapped_models(Base: declarative_base, registry: ProtocolRegistry):
+    class Protocols(Base):
+        __tablename__ = 'protocols'
+
+        id = Column(Integer, primary_key=True, autoincrement=True)
+        address = Column(HexBinary, unique=True)
 
-async def wrapped_models(Base: declarative_base):
     class Transactions(Base):
         __tablename__ = 'transactions'
 
         id = Column(Integer, primary_key=True, autoincrement=True)
         timestamp = Column(Integer)
-        tx = Column(String)
+        tx = Column(HexBinary, index=True, unique=True)
         block = Column(Integer)
-        contract = Column(String)
+        contract = Column('contract_id', ProtocolKey(registry), key='contract')
         gas = Column(Integer)
         gas_price = Column(Integer)
         priority_fee = Column(Integer)
@@ -20,7 +28,7 @@ async def wrapped_models(Base: declarative_base):
 
         id = Column(Integer, primary_key=True, autoincrement=True)
         block = Column(Integer)
-        block_hash = Column(String)
+        block_hash = Column(HexBinary)
         gas_used_total = Column(Integer)
         gas_limit_total = Column(Integer)
         base_fee = Column(Integer)
@@ -28,10 +36,34 @@ async def wrapped_models(Base: declarative_base):
     class Future(Base):
         __tablename__ = 'future'
         id = Column(Integer, primary_key=True, autoincrement=True)
-        contract = Column(String)
+        contract = Column('contract_id', ProtocolKey(registry), key='contract')
         timestamp = Column(Integer)
         priority_fee = Column(Integer)
         priority_fee_lower = Column(Integer)
         priority_fee_upper = Column(Integer)
 
-    return Transactions, Blocks, Future
+    class HourlyFees(Base):
+        __tablename__ = 'hourly_fees'
+
+        id = Column(Integer, primary_key=True, autoincrement=True)
+        contract = Column('contract_id', ProtocolKey(registry), key='contract')
+        timestamp = Column(Integer)
+        priority_fee = Column(Integer)
+        transactions = Column(Integer)
+
+    class DailyFees(Base):
+        __tablename__ = 'daily_fees'
+
+        id = Column(Integer, primary_key=True, autoincrement=True)
+        contract = Column('contract_id', ProtocolKey(registry), key='contract')
+        timestamp = Column(Integer)
+        priority_fee = Column(Integer)
+        transactions = Column(Integer)
+
+    # the forecaster reads the transactions of the protocol and the retention rolls up the old ones
+    Index('ix_transactions_contract_timestamp', Transactions.contract, Transactions.timestamp)
+    # the roll ups have one row per protocol and period
+    Index('ix_hourly_fees_contract_timestamp', HourlyFees.contract, HourlyFees.timestamp, unique=True)
+    Index('ix_daily_fees_contract_timestamp', DailyFees.contract, DailyFees.timestamp, unique=True)
+
+    return Transactions, Blocks, Future, HourlyFees, DailyFees
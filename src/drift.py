@@ -0,0 +1,68 @@
+from src.config import drift_ewma_alpha, drift_residual_threshold, drift_coverage_threshold, drift_min_hours
+
+
+class DriftTracker:
+    """
+    This class tracks how well the forecasts in use describe the observed hourly max priority fees of each protocol. The
+    residuals are normalized by the width of the forecasted interval, so the protocols with the different fee levels
+    share the thresholds. Both the residual and the share of the hours inside the interval are smoothed with the EWMA:
+    the model drifts when the residual is biased or the interval doesn't cover the observed fees anymore.
+    """
+
+    def __init__(self, alpha: float = drift_ewma_alpha, residual_threshold: float = drift_residual_threshold,
+                 coverage_threshold: float = drift_coverage_threshold, min_hours: int = drift_min_hours):
+        self.alpha = alpha
+        self.residual_threshold = residual_threshold
+        self.coverage_threshold = coverage_threshold
+        self.min_hours = min_hours
+        # contract -> [residual EWMA, coverage EWMA, amount of the observed hours]
+        self.stats = {}
+
+    def observe(self, contract: str, observed: int, future_row) -> None:
+        """
+        @param contract: protocol address
+        @param observed: max priority fee of the protocol for the closed hour
+        @param future_row: the forecasted values that were used for this hour
+        @return:
+        """
+        width = max(future_row.priority_fee_upper - future_row.priority_fee_lower, 1)
+        residual = (observed - future_row.priority_fee) / width
+        covered = float(future_row.priority_fee_lower <= observed <= future_row.priority_fee_upper)
+
+        stats = self.stats.get(contract)
+        if stats is None:
+            self.stats[contract] = [residual, covered, 1]
+            return
+        stats[0] += self.alpha * (residual - stats[0])
+        stats[1] += self.alpha * (covered - stats[1])
+        stats[2] += 1
+
+    def residual(self, contract: str) -> float or None:
+        """
+        @return: smoothed normalized residual, positive when the fees are higher than forecasted
+        """
+        return self.stats[contract][0] if contract in self.stats else None
+
+    def coverage(self, contract: str) -> float or None:
+        """
+        @return: smoothed share of the hours inside the forecasted interval
+        """
+        return self.stats[contract][1] if contract in self.stats else None
+
+    def drifted(self, contract: str) -> bool:
+        """
+        @param contract: protocol address
+        @return: True if the model of the protocol should be refitted
+        """
+        stats = self.stats.get(contract)
+        if stats is None or stats[2] < self.min_hours:
+            return False
+        return abs(stats[0]) > self.residual_threshold or stats[1] < self.coverage_threshold
+
+    def reset(self, contract: str) -> None:
+        """
+        This function forgets the residuals of the replaced model
+        @param contract: protocol address
+        @return:
+        """
+        self.stats.pop(contract, None)
@@ -0,0 +1,265 @@
+import argparse
+import asyncio
+import json
+import os
+from pathlib import Path
+
+from src.config import debug_logs_enabled
+from src.db.controller import init_async_db
+from src.db.db_utils import db_utils
+
+# the exported columns of the tables, the blocks and the transactions have the format of the imported files
+EXPORTED_COLUMNS = {
+    'blocks': ['block', 'block_hash', 'gas_used_total', 'gas_limit_total', 'base_fee'],
+    'transactions': ['timestamp', 'tx', 'block', 'contract', 'gas', 'gas_price', 'priority_fee'],
+    'future': ['contract', 'timestamp', 'priority_fee', 'priority_fee_lower', 'priority_fee_upper'],
+    'hourly_fees': ['contract', 'timestamp', 'priority_fee', 'transactions'],
+    'daily_fees': ['contract', 'timestamp', 'priority_fee', 'transactions'],
+}
+# these tables are exported incrementally by the block ranges, the rest are exported as the snapshots since their rows
+# are replaced or merged
+INCREMENTAL_COLUMNS = {'blocks': 'block', 'transactions': 'block'}
+HEX_COLUMNS = ['tx', 'block_hash']
+FORMATS = {'parquet': '.parquet', 'arrow': '.arrow'}
+MANIFEST = 'manifest.json'
+
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError('The export requires the pyarrow package') from e
+    return pyarrow
+
+
+def get_schema(pa, table: str):
+    """
+    @return: arrow schema of the exported table, the protocols are dictionary encoded since there are just a few of them
+    """
+    def column_type(column):
+        if column == 'contract':
+            return pa.dictionary(pa.int32(), pa.string())
+        return pa.string() if column in HEX_COLUMNS else pa.int64()
+
+    return pa.schema([(column, column_type(column)) for column in EXPORTED_COLUMNS[table]])
+
+
+def to_arrow(pa, table: str, rows: list):
+    """
+    @param table: name of the table
+    @param rows: the selected rows of the table
+    @return: arrow table with the rows
+    """
+    schema = get_schema(pa, table)
+    values = list(zip(*rows)) if rows else [[] for _ in schema]
+    arrays = [pa.array(column_values, type=field.type.value_type).dictionary_encode()
+              if pa.types.is_dictionary(field.type) else pa.array(column_values, type=field.type)
+              for column_values, field in zip(values, schema)]
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+class PartitionWriter:
+    """
+    This class writes the ordered chunks of the table to the files, each file has the rows of one partition of the
+    block range. The file is named by its first block, so the repeated export of the same range overwrites the files.
+    The file is moved to its place only when it is completed. The snapshots are written to one file named by the block,
+    only the newest snapshots are kept.
+    """
+
+    def __init__(self, pa, directory: Path, table: str, file_format: str, partition_size: int):
+        self.pa = pa
+        self.directory = directory
+        self.schema = get_schema(pa, table)
+        self.file_format = file_format
+        self.partition_size = partition_size
+        self.partition = None
+        self.path = None
+        self.writer = None
+
+    def open(self, first_block: int):
+        self.close()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.path = self.directory / f'{first_block}{FORMATS[self.file_format]}'
+        tmp_path = self.path.with_suffix('.tmp')
+        if self.file_format == 'parquet':
+            self.writer = self.pa.parquet.ParquetWriter(tmp_path, self.schema)
+        else:
+            self.writer = self.pa.ipc.new_file(str(tmp_path), self.schema)
+
+    def write(self, table, first_block: int):
+        """
+        @param table: arrow table ordered by the block
+        @param first_block: the first exported block, the first file is named by it
+        """
+        partitions = table['block'].to_numpy() // self.partition_size
+        start = 0
+        for end in list((partitions[1:] != partitions[:-1]).nonzero()[0] + 1) + [len(table)]:
+            if partitions[start] != self.partition:
+                self.partition = partitions[start]
+                self.open(max(first_block, int(self.partition) * self.partition_size))
+            self.writer.write_table(table.slice(start, end - start))
+            start = end
+
+    def write_snapshot(self, table, block: int, keep: int = 1):
+        """
+        @param table: arrow table with the whole snapshot
+        @param block: the block of the snapshot, the file is named by it
+        @param keep: the amount of the newest snapshots to keep, the older ones are removed
+        """
+        self.open(block)
+        self.writer.write_table(table)
+        self.close()
+
+        snapshots = sorted((path for path in self.directory.glob('*') if path.suffix in FORMATS.values()),
+                           key=lambda path: int(path.stem))
+        for path in snapshots[:-max(keep, 1)]:
+            path.unlink()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            os.replace(self.path.with_suffix('.tmp'), self.path)
+            self.writer = None
+
+
+def read_manifest(output: Path) -> dict:
+    """
+    @return: the format and the last exported block of each table
+    """
+    if (output / MANIFEST).exists():
+        return json.loads((output / MANIFEST).read_text())
+    return {'format': None, 'last_block': {}}
+
+
+def write_manifest(output: Path, manifest: dict):
+    tmp_path = output / (MANIFEST + '.tmp')
+    tmp_path.write_text(json.dumps(manifest, indent=2))
+    os.replace(tmp_path, output / MANIFEST)
+
+
+async def export_history(output: str, file_format: str = 'parquet', partition_size: int = 10000,
+                         settle_blocks: int = 2, keep_snapshots: int = 1) -> dict:
+    """
+    This function exports the history that was not exported yet. The blocks and the transactions are exported by the
+    block ranges, the forecasts and the roll ups are exported as the snapshots of the last exported block
+    @param output: directory of the export
+    @param file_format: 'parquet' or 'arrow'
+    @param partition_size: the amount of blocks in one file
+    @param settle_blocks: the last blocks are not exported since their priority fees may be not calculated yet
+    @param keep_snapshots: the amount of the newest snapshots of each table to keep
+    @return: amount of the exported rows of each table
+    """
+    pa = import_pyarrow()
+    output = Path(output)
+    manifest = read_manifest(output)
+    if manifest['format'] not in (None, file_format):
+        raise ValueError(f'The history in {output} is exported as {manifest["format"]}')
+    manifest['format'] = file_format
+
+    last_block = await db_utils.get_blocks().get_max('block')
+    if last_block is None:
+        return {}
+    last_block -= settle_blocks
+
+    tables = {'blocks': db_utils.get_blocks(), 'transactions': db_utils.get_transactions(),
+              'future': db_utils.get_future(), 'hourly_fees': db_utils.get_hourly_fees(),
+              'daily_fees': db_utils.get_daily_fees()}
+    exported = {}
+    for table, column in INCREMENTAL_COLUMNS.items():
+        first_block = manifest['last_block'].get(table, -1) + 1
+        if first_block > last_block:
+            continue
+
+        writer = PartitionWriter(pa, output / table, table, file_format, partition_size)
+        exported[table] = 0
+        async for rows in tables[table].stream_columns_by_range(EXPORTED_COLUMNS[table], column, first_block,
+                                                                last_block):
+            writer.write(to_arrow(pa, table, rows), first_block)
+            exported[table] += len(rows)
+        writer.close()
+        manifest['last_block'][table] = last_block
+
+    for table in [table for table in EXPORTED_COLUMNS if table not in INCREMENTAL_COLUMNS]:
+        rows = await tables[table].get_columns_by_criteria(EXPORTED_COLUMNS[table], {})
+        PartitionWriter(pa, output / table, table, file_format, partition_size).write_snapshot(
+            to_arrow(pa, table, rows), last_block, keep_snapshots)
+        exported[table] = len(rows)
+
+    output.mkdir(parents=True, exist_ok=True)
+    write_manifest(output, manifest)
+    return exported
+
+
+def read_file(pa, path: Path, columns: list = None):
+    """
+    The arrow files are memory-mapped and read without copying, the parquet files are memory-mapped and decoded
+    """
+    if path.suffix == FORMATS['arrow']:
+        table = pa.ipc.open_file(pa.memory_map(str(path))).read_all()
+        return table.select(columns) if columns else table
+    return pa.parquet.read_table(path, columns=columns, memory_map=True)
+
+
+def load(output: str, table: str, first_block: int = None, last_block: int = None, columns: list = None):
+    """
+    This function loads the exported table
+    @param output: directory of the export
+    @param table: name of the table
+    @param first_block: the first block to load
+    @param last_block: the last block to load, the snapshots are loaded as of this block
+    @param columns: columns to load, all by default
+    @return: pyarrow.Table
+    """
+    pa = import_pyarrow()
+    directory = Path(output) / table
+    files = sorted((path for path in directory.glob('*') if path.suffix in FORMATS.values()), key=lambda p: int(p.stem))
+    starts = [int(path.stem) for path in files]
+    schema = get_schema(pa, table)
+    columns = columns or schema.names
+
+    column = INCREMENTAL_COLUMNS.get(table)
+    if column is None:
+        snapshots = [path for path, start in zip(files, starts) if last_block is None or start <= last_block]
+        return read_file(pa, snapshots[-1], columns) if snapshots else schema.empty_table().select(columns)
+
+    # the file has the blocks from its start to the start of the next file
+    selected = [path for i, path in enumerate(files) if (last_block is None or starts[i] <= last_block) and
+                (first_block is None or i + 1 == len(files) or starts[i + 1] > first_block)]
+    if not selected:
+        return schema.empty_table().select(columns)
+
+    result = pa.concat_tables([read_file(pa, path, list(dict.fromkeys(columns + [column]))) for path in selected])
+    mask = None
+    if first_block is not None:
+        mask = pa.compute.greater_equal(result[column], first_block)
+    if last_block is not None:
+        upper = pa.compute.less_equal(result[column], last_block)
+        mask = upper if mask is None else pa.compute.and_(mask, upper)
+    if mask is not None:
+        result = result.filter(mask)
+    return result.select(columns)
+
+
+async def main(args):
+    # the database of the running agent is only read, so it is not migrated or locked for the writes
+    transaction_table, blocks_table, future_table = await init_async_db(path=args.db, read_only=True)
+    db_utils.set_tables(transaction_table, blocks_table, future_table)
+
+    exported = await export_history(args.output, args.format, args.partition_size, args.settle_blocks,
+                                    args.keep_snapshots)
+    if debug_logs_enabled:
+        print(f'INFO: Exported rows: {exported}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Incremental export of the collected history to Parquet/Arrow')
+    parser.add_argument('--db', default='./main.db', help='path to the collected database')
+    parser.add_argument('--output', default='./history', help='directory of the export')
+    parser.add_argument('--format', choices=list(FORMATS), default='parquet', help='format of the exported files')
+    parser.add_argument('--partition-size', type=int, default=10000, help='the amount of blocks in one file')
+    parser.add_argument('--settle-blocks', type=int, default=2, help='the amount of the last blocks to skip')
+    parser.add_argument('--keep-snapshots', type=int, default=1, help='the amount of the newest snapshots to keep')
+    asyncio.run(main(parser.parse_args()))
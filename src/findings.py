@@ -1,5 +1,40 @@
+import numpy as np
 from forta_agent import Finding, FindingType, FindingSeverity
 from src.utils import get_key_by_value
+from src.config import critical_enable, high_enable, medium_enable, low_enable
+
+# the order of the severities is the order of the thresholds checks
+SEVERITIES = ['critical', 'high', 'medium', 'low']
+ENABLED_SEVERITIES = (critical_enable, high_enable, medium_enable, low_enable)
+
+
+def classify_priority_fees(priority_fees, expected, expected_upper, uncertainty,
+                           enabled: tuple = ENABLED_SEVERITIES) -> np.ndarray:
+    """
+    This function applies the thresholds of the 'real_base_fee_detected' mode to the whole batch
+    @param enabled: flags of the enabled severities in the order of SEVERITIES
+    @return: array with the index of the severity in SEVERITIES for each transaction or -1 if there is no finding
+    """
+    error = priority_fees - expected
+    return np.select([(error > 2 * uncertainty) & enabled[0],
+                      (error > 1.5 * uncertainty) & enabled[1],
+                      (error > uncertainty) & enabled[2],
+                      (priority_fees > expected_upper) & enabled[3]], list(range(len(SEVERITIES))), -1)
+
+
+def classify_uncertain_priority_fees(priority_fees_lower, priority_fees_upper, expected, expected_upper, uncertainty,
+                                     enabled: tuple = ENABLED_SEVERITIES) -> np.ndarray:
+    """
+    This function applies the thresholds of the base fee estimation mode to the whole batch
+    @param enabled: flags of the enabled severities in the order of SEVERITIES
+    @return: array with the index of the severity in SEVERITIES for each transaction or -1 if there is no finding
+    """
+    error_lower = priority_fees_lower - expected
+    error_upper = priority_fees_upper - expected
+    return np.select([(error_lower > 2 * uncertainty) & enabled[0],
+                      (error_upper > 2 * uncertainty) & enabled[1],
+                      (priority_fees_lower > expected_upper) & enabled[2],
+                      (priority_fees_upper > expected_upper) & enabled[3]], list(range(len(SEVERITIES))), -1)
 
 
 class UncertainPriorityFeeFindings:
@@ -1,41 +1,176 @@
-import logging
+import numpy as np
 import pandas as pd
-from prophet import Prophet
 import warnings
+from collections import namedtuple
+from src.backends import create_backend, get_backend_class
 from src.db.db_utils import db_utils
+from src.config import forecast_horizon, forecast_max_model_age
+from src.memory import memory_monitor
 
-logger = logging.getLogger('prophet')
-logger.setLevel(logging.ERROR)
-logger = logging.getLogger('cmdstanpy')
-logger.setLevel(logging.ERROR)
-logger = logging.getLogger('stanpy')
-logger.setLevel(logging.ERROR)
 warnings.simplefilter(action='ignore')
 
+# the fitted model of the protocol: name of the backend, serialized model and the last hour of its training data
+CachedModel = namedtuple('CachedModel', ['backend', 'data', 'trained_until'])
 
-async def forecast(protocol: str):
+
+class ModelCache:
+    """
+    This class keeps the last fitted model of each protocol, so the forecast can be extended without the refit. The
+    models are kept serialized since the fitted backends hold their training data.
+    """
+
+    def __init__(self):
+        self.models = {}
+
+    def put(self, protocol: str, backend, trained_until: int):
+        self.models[protocol] = CachedModel(backend.name, backend.serialize(), trained_until)
+
+    def get(self, protocol: str) -> CachedModel or None:
+        return self.models.get(protocol)
+
+    def clear(self):
+        self.models.clear()
+
+
+model_cache = ModelCache()
+memory_monitor.register_cache(model_cache.clear)
+
+
+async def hourly_max_priority_fees(protocol: str) -> tuple:
+    """
+    This function collects the hourly max priority fees of the protocol. The old hours are already rolled up by
+    clean_db(), the recent transactions are read by the chunks and reduced to the hourly values right away, so the whole
+    history is never held in memory. The days older than the hourly roll ups are spread over their hours: each hour of
+    the day gets the max priority fee of the day. One point at the first hour of the day would look like a spike at
+    midnight to the daily seasonality, while the spread days are flat and still shape the trend and the weekly
+    seasonality
+    @param protocol: protocol address
+    @return: DataFrame with the 'ds' and 'y' columns for every hour and the amount of the transactions
+    """
     transaction_table = db_utils.get_transactions()
-    future_table = db_utils.get_future()
-    transactions_rows = await transaction_table.get_all_rows_by_criteria({'contract': protocol})
+    count = 0
+
+    daily = await db_utils.get_daily_fees().get_array_by_criteria(['timestamp', 'priority_fee', 'transactions'],
+                                                                  {'contract': protocol})
+    daily_hours = None
+    if len(daily):
+        count += int(np.nansum(daily[:, 2]))
+        daily_hours = pd.Series(np.repeat(daily[:, 1], 24),
+                                index=(daily[:, 0, None] + np.arange(0, 86400, 3600)).ravel()).groupby(level=0).max()
+
+    rolled_up = await db_utils.get_hourly_fees().get_array_by_criteria(['timestamp', 'priority_fee', 'transactions'],
+                                                                      {'contract': protocol})
+    hourly = None
+    if len(rolled_up):
+        count += int(np.nansum(rolled_up[:, 2]))
+        hourly = pd.Series(rolled_up[:, 1], index=rolled_up[:, 0]).groupby(level=0).max()
+
+    async for chunk in transaction_table.stream_columns_by_criteria(['timestamp', 'priority_fee'],
+                                                                    {'contract': protocol}):
+        data = np.array(chunk, dtype=float)
+        count += len(data)
+        chunk_hourly = pd.Series(data[:, 1], index=data[:, 0] - data[:, 0] % 3600).groupby(level=0).max()
+        hourly = chunk_hourly if hourly is None else pd.concat([hourly, chunk_hourly]).groupby(level=0).max()
+
+    if daily_hours is not None:
+        # the collected hours take precedence over the spread days, and the history still ends at the last hour
+        if hourly is not None:
+            daily_hours = daily_hours[daily_hours.index <= hourly.index.max()]
+        hourly = daily_hours if hourly is None else hourly.combine_first(daily_hours)
+
+    if hourly is None:
+        return pd.DataFrame(columns=['ds', 'y']), count
 
-    df = pd.DataFrame([t.__dict__ for t in transactions_rows])
-    df['timestamp'] = pd.to_datetime(df['timestamp'], unit='s')
-    df = df.set_index('timestamp').resample('H').max().reset_index()
+    # the hours without the transactions are kept empty as the resampling does
+    hourly = hourly.reindex(np.arange(hourly.index.min(), hourly.index.max() + 3600, 3600))
+    return pd.DataFrame({'ds': pd.to_datetime(hourly.index, unit='s'), 'y': hourly.to_numpy()}), count
 
-    if len(transactions_rows) < 2:
+
+async def store_forecast(protocol: str, backend, start: pd.Timestamp) -> int:
+    """
+    This function predicts the upcoming hours with the fitted backend and replaces the forecast of the protocol
+    @param protocol: protocol address
+    @param backend: fitted forecasting backend
+    @param start: the first hour to predict
+    @return: timestamp of the last forecasted hour or None if no hour could be predicted
+    """
+    # only the upcoming hours are looked up by the agent, so there is no need to predict the whole history. The last
+    # collected hour is included because it is the current one until the next hour starts.
+    forecast_rows = backend.predict(start, forecast_horizon + 1)
+    # the hours the backend can't predict, e.g. when the history has only the gaps, are left without the forecast
+    forecast_rows = forecast_rows.dropna(subset=['yhat', 'yhat_lower', 'yhat_upper'])
+    if forecast_rows.empty:
+        return
+
+    rows = pd.DataFrame({
+        'contract': protocol,
+        'timestamp': (forecast_rows['ds'] - pd.Timestamp(0)) // pd.Timedelta(seconds=1),
+        'priority_fee': forecast_rows['yhat'].astype(int),
+        'priority_fee_lower': forecast_rows['yhat_lower'].astype(int),
+        'priority_fee_upper': forecast_rows['yhat_upper'].astype(int),
+    }).to_dict('records')
+
+    # the old forecast is replaced in one transaction, so the readers never see the protocol without the forecast
+    await db_utils.get_future().replace_rows_by_contract(protocol, rows)
+
+    return rows[-1]['timestamp']
+
+
+async def extend_forecast(protocol: str):
+    """
+    This function moves the forecast of the protocol to the last collected hour with the cached model, that is much
+    cheaper than the refit
+    @param protocol: protocol address
+    @return: timestamp of the last forecasted hour or None if there is no model or it is too old
+    """
+    cached = model_cache.get(protocol)
+    if cached is None:
         return
 
-    train = df.reset_index()[['timestamp', 'priority_fee']].rename({'timestamp': 'ds', 'priority_fee': 'y'},
-                                                                   axis='columns')
+    last_timestamp = await db_utils.get_transactions().get_max('timestamp', criteria={'contract': protocol})
+    if last_timestamp is None:
+        return
+    last_hour = last_timestamp - last_timestamp % 3600
+    if last_hour - cached.trained_until > forecast_max_model_age:
+        return
+
+    backend = get_backend_class(cached.backend).load(cached.data)
+    return await store_forecast(protocol, backend, pd.to_datetime(last_hour, unit='s'))
+
+
+async def forecast(protocol: str, refit: bool = True):
+    """
+    This function replaces the forecast of the protocol. The model is fitted on the hourly max priority fees of the
+    protocol, or the cached model is reused if the refit is not needed
+    @param protocol: protocol address
+    @param refit: False extends the forecast with the cached model if it is fresh enough
+    @return: timestamp of the last forecasted hour or None if there is not enough data or memory
+    """
+    if not refit:
+        last_hour = await extend_forecast(protocol)
+        if last_hour is not None:
+            return last_hour
+
+    # the refit holds the whole history several times, so it waits until the memory is released
+    if memory_monitor.over_budget():
+        shrunk = memory_monitor.shrink() is not None
+        if memory_monitor.over_budget():
+            # the warning is printed as often as the caches are shrunk
+            if shrunk:
+                print(f'WARNING: Refit of {protocol} is deferred since the memory budget is exceeded')
+            return
+
+    with memory_monitor.measure('forecast', protocol=protocol):
+        train, transactions_count = await hourly_max_priority_fees(protocol)
 
-    m = Prophet()
-    m.fit(train)
-    future = m.make_future_dataframe(periods=24, freq='H')
+        if transactions_count < 2:
+            return
 
-    forecast_rows = m.predict(future)
+        backend = create_backend(protocol)
+        backend.fit(train)
+        start = train['ds'].iloc[-1]
+        # the backend keeps its own copy of the history
+        del train
+        model_cache.put(protocol, backend, int((start - pd.Timestamp(0)) // pd.Timedelta(seconds=1)))
 
-    await future_table.delete_row_by_contract(protocol)
-    for index, row in forecast_rows.iterrows():
-        await future_table.paste_row(
-            {'contract': protocol, 'timestamp': int(row['ds'].timestamp()), 'priority_fee': int(row['yhat']),
-             'priority_fee_lower': int(row['yhat_lower']), 'priority_fee_upper': int(row['yhat_upper'])})
+        return await store_forecast(protocol, backend, start)
@@ -0,0 +1,208 @@
+import argparse
+import asyncio
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from web3 import Web3
+
+from src.config import test_mode, debug_logs_enabled, database_path
+from src.db.controller import init_async_db
+from src.db.db_utils import db_utils, roll_up_history
+from src.export import EXPORTED_COLUMNS, load
+from src.utils import get_protocols_by_chain, calculate_new_base_fee
+
+BLOCKS_COLUMNS = EXPORTED_COLUMNS['blocks']
+TRANSACTIONS_COLUMNS = EXPORTED_COLUMNS['transactions']
+# the rest of the imported columns are stored as the integers
+TEXT_COLUMNS = ('block_hash', 'tx', 'contract')
+
+
+def read_frame(path: str) -> pd.DataFrame:
+    """
+    This function reads the exported history file. The format is detected by the file extension
+    @param path: path to the .csv, .parquet or .jsonl file or to the table directory exported by src.export
+    @return: DataFrame with the file content
+    """
+    if Path(path).is_dir():
+        return load(Path(path).parent, Path(path).name).to_pandas()
+
+    suffix = Path(path).suffix.lower()
+    if suffix == '.csv':
+        return pd.read_csv(path)
+    elif suffix in ('.parquet', '.pq'):
+        return pd.read_parquet(path)
+    elif suffix in ('.jsonl', '.json'):
+        return pd.read_json(path, lines=True)
+    raise ValueError(f'Unsupported history file format: {path}')
+
+
+def fill_base_fees(blocks: pd.DataFrame) -> pd.DataFrame:
+    """
+    This function fills the missing base fees of the blocks. Known base fees are kept as is, the missing ones are
+    calculated from the previous block as it is done in Ethereum, so the source may contain only the first base fee.
+    @param blocks: DataFrame with the blocks sorted by the block number
+    @return: DataFrame with the filled base_fee column
+    """
+    if 'base_fee' not in blocks:
+        blocks['base_fee'] = np.nan
+
+    base_fees = blocks['base_fee'].to_numpy(dtype=object)
+    if not pd.isna(base_fees).any():
+        return blocks
+
+    numbers = blocks['block'].to_numpy()
+    gas_limits = blocks['gas_limit_total'].to_numpy()
+    gas_used = blocks['gas_used_total'].to_numpy()
+
+    # the recurrence can only be resolved block by block, but it is plain integer arithmetic
+    for i in range(1, len(base_fees)):
+        if pd.isna(base_fees[i]) and not pd.isna(base_fees[i - 1]) and numbers[i] == numbers[i - 1] + 1:
+            base_fees[i] = calculate_new_base_fee(int(base_fees[i - 1]), int(gas_limits[i - 1]), int(gas_used[i - 1]))
+
+    blocks['base_fee'] = base_fees
+    return blocks
+
+
+def prepare_blocks(blocks: pd.DataFrame) -> pd.DataFrame:
+    """
+    This function normalizes the imported blocks to the `blocks` table format
+    @param blocks: raw DataFrame with the blocks
+    @return: DataFrame with the BLOCKS_COLUMNS
+    """
+    blocks = blocks.drop_duplicates('block', keep='last').sort_values('block').reset_index(drop=True)
+    blocks = fill_base_fees(blocks)
+    return blocks
+
+
+def prepare_transactions(transactions: pd.DataFrame, blocks: pd.DataFrame, protocols_addresses: list) -> pd.DataFrame:
+    """
+    This function normalizes the imported transactions to the `transactions` table format. Only the transactions of the
+    protocols are kept, the priority fees are calculated in bulk using the base fees of the blocks.
+    @param transactions: raw DataFrame with the transactions
+    @param blocks: prepared DataFrame with the blocks
+    @param protocols_addresses: lowercase addresses of the protocols
+    @return: DataFrame with the TRANSACTIONS_COLUMNS
+    """
+    transactions = transactions.copy()
+    transactions['contract'] = transactions['contract'].str.lower()
+    transactions = transactions[transactions['contract'].isin(protocols_addresses)]
+    transactions = transactions.drop_duplicates('tx', keep='last')
+
+    # the transactions may come without the timestamps, then they are taken from the blocks. The transactions without
+    # the timestamps would be never rolled up or removed, so they are rejected
+    block_columns = ['block', 'base_fee']
+    if 'timestamp' not in transactions:
+        if 'timestamp' not in blocks:
+            raise ValueError('Neither the transactions nor the blocks have the timestamp column')
+        block_columns.append('timestamp')
+    transactions = transactions.drop(columns=['base_fee'], errors='ignore')
+    transactions = transactions.merge(blocks[block_columns], on='block', how='left')
+    missing = int(transactions['timestamp'].isna().sum())
+    if missing:
+        raise ValueError(f'{missing} transactions have no timestamp')
+
+    calculated = (transactions['gas_price'] - transactions['base_fee']).clip(lower=0)
+    if 'priority_fee' in transactions:
+        priority_fees = transactions['priority_fee']
+        transactions['priority_fee'] = np.where(priority_fees.isna(), calculated, priority_fees)
+    else:
+        transactions['priority_fee'] = calculated
+
+    return transactions.sort_values(['block', 'timestamp'], kind='stable').reset_index(drop=True)
+
+
+def to_rows(df: pd.DataFrame, columns: list) -> list:
+    """
+    This function converts the DataFrame into the list of dicts ready for the bulk insert. NaN values become None and
+    the numbers become python integers, since SQLite stores the fees as the integers. The columns with the missing
+    values are float, so they are cast back to the integers first
+    @param df: DataFrame to convert
+    @param columns: columns to keep
+    @return: list of rows
+    """
+    df = df.reindex(columns=columns)
+    for column in columns:
+        if column not in TEXT_COLUMNS:
+            df[column] = pd.to_numeric(df[column]).round().astype('Int64')
+    df = df.astype(object)
+    df = df.where(pd.notna(df), None)
+    return [{k: (int(v) if isinstance(v, (np.integer, np.floating)) else v) for k, v in row.items()}
+            for row in df.to_dict('records')]
+
+
+def covered_periods(first_timestamp: int, last_timestamp: int, period: int) -> tuple:
+    """
+    @param first_timestamp: the first imported timestamp
+    @param last_timestamp: the last imported timestamp
+    @param period: the length of the period of the roll up in seconds
+    @return: the first and the last start of the periods that are fully inside the imported range
+    """
+    return first_timestamp + (-first_timestamp) % period, last_timestamp - period + 1
+
+
+async def import_history(blocks: pd.DataFrame, transactions: pd.DataFrame, protocols_addresses: list) -> tuple:
+    """
+    This function loads the history into the database. The previously stored rows of the imported block range are
+    replaced, so the import can be safely repeated. The roll ups of the imported protocols in the hours and days fully
+    covered by the import are rebuilt in the same pass as clean_db() does it, the partially covered ones are merged with
+    the imported rows. Everything is written inside one transaction.
+    @param blocks: raw DataFrame with the blocks
+    @param transactions: raw DataFrame with the transactions
+    @param protocols_addresses: lowercase addresses of the protocols
+    @return: amount of the imported blocks and transactions
+    """
+    blocks = prepare_blocks(blocks)
+    transactions = prepare_transactions(transactions, blocks, protocols_addresses)
+
+    blocks_table = db_utils.get_blocks()
+    transactions_table = db_utils.get_transactions()
+    first_block, last_block = int(blocks['block'].min()), int(blocks['block'].max())
+
+    async with db_utils.unit_of_work():
+        await blocks_table.delete_block_range(first_block, last_block)
+        await transactions_table.delete_block_range(first_block, last_block)
+        if len(transactions):
+            # the imported transactions may be already rolled up, so the periods of the imported protocols are rolled up
+            # again from scratch. The periods only partially covered by the import keep their other rows, the imported
+            # ones are merged into them. The roll ups of the other protocols are kept
+            first_timestamp, last_timestamp = int(transactions['timestamp'].min()), int(transactions['timestamp'].max())
+            contracts = transactions['contract'].unique().tolist()
+            for roll_ups, period in ((db_utils.get_hourly_fees(), 3600), (db_utils.get_daily_fees(), 86400)):
+                await roll_ups.delete_timestamp_range(*covered_periods(first_timestamp, last_timestamp, period),
+                                                      contracts=contracts)
+        await blocks_table.paste_rows(to_rows(blocks, BLOCKS_COLUMNS))
+        await transactions_table.paste_rows(to_rows(transactions, TRANSACTIONS_COLUMNS))
+
+        last_timestamp = await transactions_table.get_max('timestamp')
+        if last_timestamp is not None:
+            await roll_up_history(last_timestamp)
+
+    return len(blocks), len(transactions)
+
+
+async def main(args):
+    protocols = get_protocols_by_chain(args.chain_id)
+    protocols_addresses = list(map(lambda x: Web3.toChecksumAddress(x).lower(), protocols.values()))
+
+    transaction_table, blocks_table, future_table = await init_async_db(args.test, args.db,
+                                                                        protocols_addresses=protocols_addresses)
+    db_utils.set_tables(transaction_table, blocks_table, future_table)
+
+    blocks_count, transactions_count = await import_history(read_frame(args.blocks), read_frame(args.transactions),
+                                                            protocols_addresses)
+    if debug_logs_enabled:
+        print(f'INFO: Imported {blocks_count} blocks and {transactions_count} transactions')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Bulk import of the blocks and transactions history')
+    parser.add_argument('--blocks', required=True, help='.csv, .parquet or .jsonl file or exported directory with the '
+                                                        'blocks')
+    parser.add_argument('--transactions', required=True, help='.csv, .parquet or .jsonl file or exported directory '
+                                                              'with the transactions')
+    parser.add_argument('--chain-id', type=int, default=1, help='chain id to select the protocols from the config')
+    parser.add_argument('--db', default=database_path, help='path to the database of the agent, ./main.db or ./test.db '
+                                                            'by default')
+    parser.add_argument('--test', action='store_true', default=test_mode, help='import into the test database')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,206 @@
+import ctypes
+import gc
+import json
+import os
+import resource
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+from src.config import memory_tracking_enabled, memory_tracking_every_n, memory_tracking_frames, memory_budget_mb, \
+    memory_metrics_path, memory_shrink_interval, debug_logs_enabled
+
+# the allocation is attributed to the subsystem of its innermost frame found in these paths
+SUBSYSTEMS = {
+    'forecaster': ('src/forecaster.py', 'src/backends/', 'src/bakeoff.py', '/prophet/', '/cmdstanpy/'),
+    'db': ('src/db/', '/sqlalchemy/', '/aiosqlite/'),
+    'agent': ('src/agent.py', 'src/scoring.py', 'src/findings.py', 'src/seen_hashes.py', 'src/scheduler.py',
+              'src/drift.py', 'src/workers.py'),
+}
+# the traced peak can be reset only since Python 3.9, so the nested measurements report it only there
+reset_traced_peak = getattr(tracemalloc, 'reset_peak', None)
+
+
+def read_rss() -> tuple:
+    """
+    @return: current and peak RSS of the process in bytes, the peak is counted since the last reset_peak_rss()
+    """
+    try:
+        with open('/proc/self/status') as status:
+            values = dict(line.split(':', 1) for line in status if line.startswith(('VmRSS', 'VmHWM')))
+        return int(values['VmRSS'].split()[0]) * 1024, int(values['VmHWM'].split()[0]) * 1024
+    except (OSError, KeyError):
+        # the peak of the whole process life is the only value available on the other systems
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        return peak, peak
+
+
+def reset_peak_rss():
+    """
+    This function resets the peak RSS of the process, it is possible only on Linux
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except OSError:
+        pass
+
+
+def release_memory():
+    """
+    This function returns the freed memory to the system, so RSS is reduced after the caches are shrunk
+    """
+    gc.collect()
+    try:
+        ctypes.CDLL('libc.so.6').malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+class MemoryMonitor:
+    """
+    This class measures the memory of the blocks and the forecasts. RSS and its peak are read for each measured
+    operation, the measurements may be nested. When the tracking is enabled, every Nth outermost operation is traced
+    with tracemalloc together with the nested ones and reports the traced memory of each subsystem, the tracing is
+    stopped between these windows. When RSS exceeds the budget, the registered caches are shrunk and the refits are
+    deferred. The measurements are written to the metrics file as JSON lines.
+    """
+
+    def __init__(self, tracking: bool = memory_tracking_enabled, every_n: int = memory_tracking_every_n,
+                 frames: int = memory_tracking_frames, budget_mb: int = memory_budget_mb,
+                 metrics_path: str = memory_metrics_path, shrink_interval: float = memory_shrink_interval):
+        self.tracking = tracking
+        self.every_n = every_n
+        self.frames = frames
+        self.budget = budget_mb * 2 ** 20
+        self.metrics_path = Path(metrics_path) if metrics_path else None
+        self.shrink_interval = shrink_interval
+        # the amount of the outermost measured operations
+        self.calls = 0
+        # the running peak RSS and traced peak of the open measurements, the outermost first
+        self.peaks = []
+        self.last_shrink = None
+        self.caches = []
+        self.subsystems = {}
+
+    def register_cache(self, shrink):
+        """
+        @param shrink: function without the arguments that releases the memory of the cache
+        @return:
+        """
+        self.caches.append(shrink)
+
+    def over_budget(self) -> bool:
+        return bool(self.budget) and read_rss()[0] > self.budget
+
+    def shrink(self) -> int or None:
+        """
+        This function shrinks the registered caches and returns the freed memory to the system. The caches are shrunk
+        at most once per the shrink interval, since the shrink collects the garbage of the whole process
+        @return: RSS after the shrink or None if the caches were shrunk recently
+        """
+        now = time.monotonic()
+        if self.last_shrink is not None and now - self.last_shrink < self.shrink_interval:
+            return None
+        self.last_shrink = now
+
+        for shrink in self.caches:
+            shrink()
+        release_memory()
+        rss = read_rss()[0]
+        print(f'WARNING: The memory budget of {self.budget // 2 ** 20} MB is exceeded, the caches are shrunk, '
+              f'RSS: {rss // 2 ** 20} MB')
+        return rss
+
+    def measure(self, operation: str, **tags):
+        """
+        @param operation: name of the measured operation
+        @param tags: the values to tag the measurement, e.g. the block number
+        @return: context manager that measures its body
+        """
+        if not (self.tracking or self.budget or self.metrics_path):
+            return nullcontext()
+        return self._measure(operation, tags)
+
+    def fold_peaks(self):
+        """
+        This function adds the current peaks to the running peaks of the open measurements. It is called before the
+        peaks are reset, so the nested measurements don't hide the peaks of the outer ones
+        """
+        peak_rss = read_rss()[1]
+        traced_peak = tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else 0
+        for peaks in self.peaks:
+            peaks[0] = max(peaks[0], peak_rss)
+            peaks[1] = max(peaks[1], traced_peak)
+
+    @contextmanager
+    def _measure(self, operation: str, tags: dict):
+        outermost = not self.peaks
+        if outermost:
+            self.calls += 1
+        traced = outermost and self.tracking and self.calls % self.every_n == 0 and not tracemalloc.is_tracing()
+
+        self.fold_peaks()
+        if traced:
+            tracemalloc.start(self.frames)
+        elif tracemalloc.is_tracing() and reset_traced_peak:
+            reset_traced_peak()
+        reset_peak_rss()
+        rss_before = read_rss()[0]
+        self.peaks.append([rss_before, 0])
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            rss = read_rss()[0]
+            self.fold_peaks()
+            peak_rss, traced_peak = self.peaks.pop()
+            # the current RSS is read first, the peak is kept not lower than it since the counters of the kernel lag
+            peak_rss = max(peak_rss, rss)
+            record = {'time': time.time(), 'pid': os.getpid(), 'operation': operation, **tags,
+                      'elapsed': time.perf_counter() - start, 'rss': rss, 'rss_delta': rss - rss_before,
+                      'peak_rss': peak_rss}
+            if tracemalloc.is_tracing() and (traced or reset_traced_peak):
+                record['traced_peak'] = traced_peak
+            if traced:
+                # the allocations made during the window that are still alive
+                record['subsystems'] = self.attribute(tracemalloc.take_snapshot())
+                tracemalloc.stop()
+                if debug_logs_enabled:
+                    print(f'INFO: Traced memory after {operation}: ' + ', '.join(
+                        f'{name}: {size // 2 ** 20} MB' for name, size in record['subsystems'].items()))
+            if self.budget and rss > self.budget:
+                rss_after_shrink = self.shrink()
+                if rss_after_shrink is not None:
+                    record['rss_after_shrink'] = rss_after_shrink
+            self.save(record)
+
+    def get_subsystem(self, filename: str) -> str or None:
+        if filename not in self.subsystems:
+            path = filename.replace(os.sep, '/')
+            self.subsystems[filename] = next((name for name, patterns in SUBSYSTEMS.items()
+                                              if any(pattern in path for pattern in patterns)), None)
+        return self.subsystems[filename]
+
+    def attribute(self, snapshot) -> dict:
+        """
+        @param snapshot: tracemalloc snapshot
+        @return: dict with the subsystem as a key and the traced bytes as a value
+        """
+        sizes = dict.fromkeys(list(SUBSYSTEMS) + ['other'], 0)
+        for trace in snapshot.traces:
+            # the frames are ordered from the oldest to the most recent one
+            subsystems = (self.get_subsystem(frame.filename) for frame in reversed(trace.traceback))
+            sizes[next((name for name in subsystems if name), 'other')] += trace.size
+        return sizes
+
+    def save(self, record: dict):
+        if self.metrics_path is None:
+            return
+        self.metrics_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.metrics_path, 'a') as metrics:
+            metrics.write(json.dumps(record) + '\n')
+
+
+memory_monitor = MemoryMonitor()
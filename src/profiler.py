@@ -0,0 +1,129 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+from src.config import profiling_enabled, profiling_every_n, profiling_latency_threshold, profiling_interval, \
+    profiling_dir, profiling_max_files
+
+
+class StackSampler:
+    """
+    This class samples the stack of the thread from the separate thread. The stacks are collected in the folded format
+    that is accepted by flamegraph.pl, inferno and speedscope. The sampling thread is started once and sleeps while the
+    sampler is disarmed.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.stacks = Counter()
+        self.thread_id = None
+        self.sample_from = 0.0
+        self.lock = threading.Lock()
+        self.armed = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def arm(self, thread_id: int, delay: float = 0.0):
+        """
+        @param thread_id: id of the sampled thread
+        @param delay: the stacks are not collected until this amount of seconds has passed
+        @return:
+        """
+        with self.lock:
+            self.thread_id = thread_id
+            self.sample_from = time.perf_counter() + delay
+            self.stacks = Counter()
+        if self.thread.ident is None:
+            self.thread.start()
+        self.armed.set()
+
+    def disarm(self) -> Counter:
+        """
+        @return: the stacks collected since the sampler was armed
+        """
+        self.armed.clear()
+        with self.lock:
+            stacks, self.stacks, self.thread_id = self.stacks, Counter(), None
+        return stacks
+
+    def run(self):
+        while self.armed.wait():
+            time.sleep(self.interval)
+            with self.lock:
+                if self.thread_id is None or time.perf_counter() < self.sample_from:
+                    continue
+                frame = sys._current_frames().get(self.thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                if stack:
+                    self.stacks[';'.join(reversed(stack))] += 1
+
+
+class Profiler:
+    """
+    This class profiles the event handlers. When it is enabled every Nth event is sampled from its start, the other
+    events are sampled only after they exceed the latency threshold, so the fast events are just timed. Every Nth event
+    and the events slower than the threshold are saved. When it is disabled the handlers run without any sampling.
+    """
+
+    def __init__(self, enabled: bool = profiling_enabled, every_n: int = profiling_every_n,
+                 latency_threshold: float = profiling_latency_threshold, interval: float = profiling_interval,
+                 directory: str = profiling_dir, max_files: int = profiling_max_files):
+        self.enabled = enabled
+        self.every_n = every_n
+        self.latency_threshold = latency_threshold
+        self.interval = interval
+        self.directory = Path(directory)
+        self.max_files = max_files
+        self.calls = 0
+        # the sampler thread is created on the first profiled event
+        self.sampler = None
+
+    def profile(self, handler: str, block_number: int = None, protocol: str = None):
+        """
+        @param handler: name of the profiled handler
+        @param block_number: block number to tag the profile
+        @param protocol: protocol address to tag the profile
+        @return: context manager that profiles its body
+        """
+        if not self.enabled:
+            return nullcontext()
+        return self._profile(handler, block_number, protocol)
+
+    @contextmanager
+    def _profile(self, handler: str, block_number: int, protocol: str):
+        self.calls += 1
+        sampled = self.calls % self.every_n == 0
+        if self.sampler is None:
+            self.sampler = StackSampler(self.interval)
+        self.sampler.arm(threading.get_ident(), 0.0 if sampled else self.latency_threshold)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            stacks = self.sampler.disarm()
+            if sampled or elapsed >= self.latency_threshold:
+                self.save(stacks, handler, block_number, protocol, elapsed)
+
+    def save(self, stacks: Counter, handler: str, block_number: int, protocol: str, elapsed: float):
+        """
+        This function writes the folded stacks to the file named by the tags and removes the oldest profiles
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tags = [str(time.time_ns()), handler, str(block_number), protocol or 'none', f'{int(elapsed * 1000)}ms']
+        path = self.directory / ('_'.join(tags) + '.folded')
+        path.write_text(''.join(f'{stack} {count}\n' for stack, count in stacks.items()))
+
+        profiles = sorted(self.directory.glob('*.folded'))
+        for old_profile in profiles[:max(len(profiles) - self.max_files, 0)]:
+            old_profile.unlink(missing_ok=True)
+
+
+profiler = Profiler()
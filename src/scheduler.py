@@ -0,0 +1,97 @@
+from src.config import forecast_refresh_lead, forecast_refits_per_block
+from src.drift import DriftTracker
+
+
+class ForecastScheduler:
+    """
+    This class tracks until when the forecast of each protocol is available and decides which protocols should be
+    refreshed before their forecast expires. The expiring forecasts are extended with the cached models, the models are
+    refitted only when their forecasts drift from the observed fees. The drifted protocols are due right away. The time
+    is taken from the blocks, so the replays behave the same way.
+    """
+
+    def __init__(self, refresh_lead: int = forecast_refresh_lead, refits_per_block: int = forecast_refits_per_block,
+                 drift: DriftTracker = None):
+        self.refresh_lead = refresh_lead
+        self.refits_per_block = refits_per_block
+        self.drift = drift or DriftTracker()
+        self.expirations = {}
+        self.postponed = {}
+
+    async def load(self, future_table):
+        """
+        This function restores the forecast coverage from the database after the restart
+        @param future_table: future table methods
+        @return:
+        """
+        last_hours = await future_table.get_max_grouped('timestamp', 'contract')
+        for contract, last_hour in last_hours.items():
+            self.expirations[contract] = last_hour + 3600
+
+    def expires_at(self, contract: str) -> int or None:
+        """
+        @param contract: protocol address
+        @return: timestamp when the protocol will be left without the forecast or None if there is no forecast
+        """
+        return self.expirations.get(contract)
+
+    def record(self, contract: str, last_hour: int or None, timestamp: int, refitted: bool = False):
+        """
+        This function should be called after each forecast
+        @param contract: protocol address
+        @param last_hour: the last forecasted hour returned by the forecaster
+        @param timestamp: current block timestamp
+        @param refitted: the value returned by refit() before the forecast
+        @return:
+        """
+        if last_hour is None:
+            # there is not enough data or memory yet, so it makes no sense to try again during the next hour. The drift
+            # is kept, so the postponed protocol is refitted instead of being extended with the drifted model.
+            self.postponed[contract] = timestamp + 3600
+            return
+        if refitted:
+            # the residuals of the drifted model are forgotten since it is replaced
+            self.drift.reset(contract)
+        self.expirations[contract] = last_hour + 3600
+        if self.expirations[contract] - timestamp <= self.refresh_lead:
+            # the history of the protocol ends in the past, so the forecast can't be moved out of the lead window until
+            # its new transactions are collected. Otherwise it would be refreshed on every block before the others.
+            self.postponed[contract] = timestamp + 3600
+            return
+        self.postponed.pop(contract, None)
+
+    def due(self, timestamp: int, contracts: list, busy: set = frozenset(), limit: int = None) -> list:
+        """
+        This function returns the protocols that should be forecasted now. Each protocol has its own refresh point
+        inside the lead window, so the refits of the protocols forecasted at the same time are spread over time.
+        @param timestamp: current block timestamp
+        @param contracts: protocol addresses
+        @param busy: protocols that are being refitted right now
+        @param limit: the max amount of the returned protocols, refits_per_block by default
+        @return: protocols sorted by the expiration, the soonest first
+        """
+        stagger = self.refresh_lead // max(len(contracts), 1)
+        due = []
+        for i, contract in enumerate(contracts):
+            if self.postponed.get(contract, 0) > timestamp or contract in busy:
+                continue
+            expires_at = self.expirations.get(contract)
+            if expires_at is None or self.drift.drifted(contract) or \
+                    expires_at - timestamp <= self.refresh_lead - i * stagger:
+                due.append(contract)
+
+        due.sort(key=lambda c: self.expirations.get(c) or 0)
+        return due[:self.refits_per_block if limit is None else limit]
+
+    def refit(self, contract: str) -> bool:
+        """
+        This function should be called before the forecast to decide if the model should be refitted or the forecast can
+        be extended with the cached model. Its result should be passed to record(), the drift is reset only when the
+        refit has succeeded.
+        @param contract: protocol address
+        @return: True if the model should be refitted
+        """
+        return self.drift.drifted(contract)
+
+
+forecast_scheduler = ForecastScheduler()
@@ -0,0 +1,100 @@
+from collections import namedtuple
+
+import numpy as np
+
+from src.config import debug_logs_enabled
+from src.db.db_utils import db_utils
+from src.findings import UncertainPriorityFeeFindings, PriorityFeeFindings, SEVERITIES, classify_priority_fees, \
+    classify_uncertain_priority_fees
+
+# the fields of the transaction event needed for the scoring, unlike the event they can be sent to the other process
+TransactionRecord = namedtuple('TransactionRecord', ['hash', 'contract', 'gas_price', 'gas', 'timestamp', 'block'])
+# the forecasted values of the protocol for the hour
+FutureRow = namedtuple('FutureRow', ['contract', 'priority_fee', 'priority_fee_lower', 'priority_fee_upper'])
+
+
+def to_record(transaction_event) -> TransactionRecord:
+    """
+    @param transaction_event: forta_agent.transaction_event.TransactionEvent
+    @return: TransactionRecord of the event
+    """
+    return TransactionRecord(transaction_event.hash, transaction_event.to, transaction_event.transaction.gas_price,
+                             transaction_event.transaction.gas, transaction_event.block.timestamp,
+                             transaction_event.block_number)
+
+
+async def score_transactions(records: list, detected: np.ndarray, maybe_base_fees: list, prev_base_fee: int or None,
+                             base_fee: int or None, future_rows: dict, protocols: dict) -> list:
+    """
+    This function classifies the protocol transactions of one block in one vectorized pass and inserts them into the
+    database at once. The state of the base fee detection should be already replayed for each transaction.
+    @param records: TransactionRecord of each protocol transaction in the order they were received
+    @param detected: the 'real_base_fee_detected' flag at the moment of each transaction
+    @param maybe_base_fees: the cheapest gas price of the block at the moment of each transaction
+    @param prev_base_fee: base fee of the previous block
+    @param base_fee: base fee of the block calculated from the previous one
+    @param future_rows: dict with the protocol address as a key and the forecasted values as a value
+    @param protocols: protocols of the chain to name them in the findings
+    @return: list of the findings for each record
+    """
+    results = [[] for _ in records]
+    rows = [future_rows.get(r.contract) for r in records]
+    has_future = np.array([fr is not None for fr in rows], dtype=bool)
+    detected = np.asarray(detected, dtype=bool)
+    gas_prices = np.array([r.gas_price for r in records], dtype=np.int64)
+    expected = np.array([fr.priority_fee if fr else 0 for fr in rows], dtype=np.int64)
+    expected_upper = np.array([fr.priority_fee_upper if fr else 0 for fr in rows], dtype=np.int64)
+    expected_lower = np.array([fr.priority_fee_lower if fr else 0 for fr in rows], dtype=np.int64)
+    uncertainty = expected_upper - expected_lower
+
+    severities = np.full(len(records), -1)
+    values = [None] * len(records)
+    priority_fees = [None] * len(records)
+
+    if prev_base_fee:
+        real_mask = detected & has_future
+        uncertain_mask = ~detected & has_future
+
+        real_priority_fees = gas_prices - base_fee
+        severities[real_mask] = classify_priority_fees(
+            np.maximum(real_priority_fees, 0)[real_mask], expected[real_mask], expected_upper[real_mask],
+            uncertainty[real_mask])
+
+        base_fee_upper = np.minimum(np.array(maybe_base_fees, dtype=float), prev_base_fee * 1.125)
+        base_fee_lower = np.minimum(prev_base_fee * 0.875, base_fee_upper)
+        priority_fees_lower = gas_prices - base_fee_upper
+        priority_fees_upper = gas_prices - base_fee_lower
+        severities[uncertain_mask] = classify_uncertain_priority_fees(
+            priority_fees_lower[uncertain_mask], priority_fees_upper[uncertain_mask], expected[uncertain_mask],
+            expected_upper[uncertain_mask], uncertainty[uncertain_mask])
+
+        # the priority fee is stored only when it is known for sure
+        real_priority_fees = real_priority_fees.tolist()
+        clipped_priority_fees = np.maximum(gas_prices - base_fee, 0).tolist()
+        priority_fees_lower = priority_fees_lower.tolist()
+        for i in range(len(records)):
+            if real_mask[i]:
+                priority_fees[i] = values[i] = clipped_priority_fees[i]
+            elif detected[i]:
+                priority_fees[i] = real_priority_fees[i]
+            elif has_future[i]:
+                values[i] = priority_fees_lower[i]
+
+    for i, record in enumerate(records):
+        if severities[i] < 0:
+            continue
+        findings_class = PriorityFeeFindings if detected[i] else UncertainPriorityFeeFindings
+        results[i].append(getattr(findings_class, SEVERITIES[severities[i]])(protocols, record.contract,
+                                                                             rows[i].priority_fee_upper, values[i],
+                                                                             record.hash))
+
+    if debug_logs_enabled and records:
+        print(f'INFO: Block: {records[0].block}, analyzed transactions: {len(records)}, '
+              f'findings: {int((severities >= 0).sum())}')
+
+    # insert all the transactions into the database at once
+    await db_utils.get_transactions().paste_rows([{'timestamp': r.timestamp, 'tx': r.hash, 'block': r.block,
+                                                   'contract': r.contract, 'gas': r.gas, 'gas_price': r.gas_price,
+                                                   'priority_fee': priority_fees[i]} for i, r in enumerate(records)])
+
+    return results
@@ -0,0 +1,64 @@
+from collections import OrderedDict
+
+from src.config import seen_hashes_capacity
+from src.memory import memory_monitor
+
+
+class SeenHashes:
+    """
+    This class remembers the hashes of the last analyzed transactions, so the re-delivered transactions are skipped
+    before they reach the database. The oldest hashes are evicted when the capacity is reached, the unique index of the
+    transactions table keeps the ingestion idempotent for them.
+    """
+
+    def __init__(self, capacity: int = seen_hashes_capacity):
+        self.capacity = capacity
+        self.hashes = OrderedDict()
+        self.pending = []
+
+    def add(self, tx_hash: str or None) -> bool:
+        """
+        @param tx_hash: transaction hash
+        @return: False if the hash was already seen, the transactions without the hash are never skipped
+        """
+        if tx_hash is None:
+            return True
+        if tx_hash in self.hashes:
+            self.hashes.move_to_end(tx_hash)
+            return False
+
+        self.hashes[tx_hash] = None
+        self.pending.append(tx_hash)
+        if len(self.hashes) > self.capacity:
+            self.hashes.popitem(last=False)
+        return True
+
+    def commit(self):
+        """
+        This function should be called when the transactions of the event are stored
+        """
+        self.pending = []
+
+    def rollback(self):
+        """
+        This function forgets the hashes added since the last commit, so the transactions of the failed event are
+        analyzed again when they are re-delivered
+        """
+        for tx_hash in self.pending:
+            self.hashes.pop(tx_hash, None)
+        self.pending = []
+
+    def clear(self):
+        self.hashes.clear()
+        self.pending = []
+
+    def shrink(self):
+        """
+        This function evicts the older half of the hashes
+        """
+        for _ in range(len(self.hashes) // 2):
+            self.hashes.popitem(last=False)
+
+
+seen_hashes = SeenHashes()
+memory_monitor.register_cache(seen_hashes.shrink)
@@ -0,0 +1,232 @@
+import asyncio
+import atexit
+import multiprocessing
+import queue
+import traceback
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from src.config import workers_count, test_mode, debug_logs_enabled, database_path
+from src.db.controller import init_async_db
+from src.db.db_utils import db_utils
+from src.forecaster import forecast
+from src.scheduler import forecast_scheduler
+from src.scoring import score_transactions
+
+
+def get_worker(contract: str, workers: int) -> int:
+    """
+    This function assigns the protocol to the worker. crc32 is used instead of hash() since the assignment must be the
+    same in every process and after the restart
+    @param contract: protocol address
+    @param workers: the amount of the workers
+    @return: index of the worker
+    """
+    return zlib.crc32(contract.encode()) % workers
+
+
+async def serve(jobs, results, protocols: dict, test: bool, path: str or None):
+    """
+    This function runs the jobs of the worker until None is received. The protocol transactions are scored and stored
+    with 'score' jobs, the protocols are forecasted with 'forecast' jobs. The cached models stay in the worker since the
+    protocol is always forecasted by the same worker.
+    """
+    transaction_table, blocks_table, future_table = await init_async_db(
+        test, path, wal=True, protocols_addresses=[address.lower() for address in protocols.values()])
+    db_utils.set_tables(transaction_table, blocks_table, future_table)
+
+    while True:
+        job = jobs.get()
+        if job is None:
+            return
+        sequence, kind, payload = job
+        try:
+            if kind == 'score':
+                async with db_utils.unit_of_work():
+                    result = await score_transactions(*payload, protocols)
+            else:
+                # the forecast is replaced in one transaction by itself, the fit doesn't hold the write transaction
+                result = {protocol: await forecast(protocol, refit) for protocol, refit in payload}
+        except Exception:
+            results.put((sequence, 'error', traceback.format_exc()))
+            continue
+        results.put((sequence, kind, result))
+
+
+def run_worker(jobs, results, protocols: dict, test: bool, path: str or None):
+    """
+    This function is the entry point of the worker process. It doesn't import the agent, so the workers don't connect
+    to the node
+    """
+    asyncio.run(serve(jobs, results, protocols, test, path))
+
+
+class Dispatcher:
+    """
+    This class runs the protocols analysis in the worker processes. The protocols are partitioned between the workers
+    by the address, so each worker scores the transactions and refits the models only of its own protocols. The agent
+    process remains the dispatcher: it tracks the base fee and the blocks once and merges the findings of the workers
+    back in the order of the events. The scheduled refits are not awaited, so a slow refit delays only the blocks that
+    have the transactions of the protocols of the same worker.
+    """
+
+    def __init__(self, protocols: dict, workers: int = workers_count, test: bool = test_mode, path: str = None):
+        self.workers = workers
+        # spawn is used since the forked workers would inherit the connections and the threads of the agent
+        context = multiprocessing.get_context('spawn')
+        self.results = context.Queue()
+        self.jobs = [context.Queue() for _ in range(workers)]
+        self.processes = [context.Process(target=run_worker, args=(jobs, self.results, protocols, test, path),
+                                          daemon=True) for jobs in self.jobs]
+        self.sequence = 0
+        # the scheduled refits in progress: sequence -> (worker, block timestamp, refit flags of the protocols)
+        self.refits = {}
+        # the results received while waiting for the other jobs
+        self.finished = {}
+        # the results are awaited in this thread, so the event loop is not blocked by the queue
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def start(self):
+        for process in self.processes:
+            process.start()
+
+    def stop(self):
+        for jobs in self.jobs:
+            jobs.put(None)
+        for process in self.processes:
+            process.join()
+        self.executor.shutdown()
+
+    def submit(self, worker: int, kind: str, payload) -> int:
+        """
+        @return: sequence number of the job
+        """
+        self.sequence += 1
+        self.jobs[worker].put((self.sequence, kind, payload))
+        return self.sequence
+
+    def receive(self, timeout: float or None) -> bool:
+        """
+        This function takes the next result from the workers. The results of the scheduled refits are recorded right
+        away, the rest are kept until they are awaited
+        @param timeout: the amount of seconds to wait for the result, 0 doesn't wait
+        @return: False if there was no result
+        """
+        try:
+            sequence, kind, result = self.results.get(timeout=timeout) if timeout else self.results.get_nowait()
+        except queue.Empty:
+            return False
+
+        if sequence not in self.refits:
+            self.finished[sequence] = (kind, result)
+            return True
+
+        worker, timestamp, refits = self.refits.pop(sequence)
+        if kind == 'error':
+            # the failed refit is retried after an hour as if there was not enough data
+            print(f'WARNING: Refit has failed in the worker {worker}:\n{result}')
+            result = dict.fromkeys(refits)
+        for protocol, last_hour in result.items():
+            forecast_scheduler.record(protocol, last_hour, timestamp, refits[protocol])
+        return True
+
+    def wait(self, sequences: list) -> list:
+        """
+        @param sequences: sequence numbers of the jobs
+        @return: results of the jobs in the same order
+        """
+        while any(sequence not in self.finished for sequence in sequences):
+            if not self.receive(timeout=1) and not all(process.is_alive() for process in self.processes):
+                raise RuntimeError('The worker process has exited')
+
+        results = [self.finished.pop(sequence) for sequence in sequences]
+        for kind, result in results:
+            if kind == 'error':
+                raise RuntimeError(f'The worker has failed:\n{result}')
+        return [result for _, result in results]
+
+    async def wait_async(self, sequences: list) -> list:
+        """
+        This function is wait() that doesn't block the event loop
+        @param sequences: sequence numbers of the jobs
+        @return: results of the jobs in the same order
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.wait, sequences)
+
+    async def score(self, records: list, detected, maybe_base_fees: list, prev_base_fee: int or None,
+                    base_fee: int or None, future_rows: dict, protocols: dict) -> list:
+        """
+        This function has the signature of score_transactions(), it scores the records of each worker in parallel
+        @return: list of the findings for each record
+        """
+        shards = {}
+        for i, record in enumerate(records):
+            shards.setdefault(get_worker(record.contract, self.workers), []).append(i)
+
+        sequences = [self.submit(worker, 'score', (
+            [records[i] for i in indices], detected[indices], [maybe_base_fees[i] for i in indices], prev_base_fee,
+            base_fee, {c: fr for c, fr in future_rows.items() if get_worker(c, self.workers) == worker}))
+            for worker, indices in shards.items()]
+
+        results = [[] for _ in records]
+        for indices, findings in zip(shards.values(), await self.wait_async(sequences)):
+            for i, record_findings in zip(indices, findings):
+                results[i] = record_findings
+        return results
+
+    async def forecast(self, protocols_to_forecast: list, timestamp: int) -> None:
+        """
+        This function has the signature of forecast_protocols(), the protocols of the different workers are forecasted
+        in parallel
+        """
+        refits = {protocol: forecast_scheduler.refit(protocol) for protocol in protocols_to_forecast}
+        shards = {}
+        for protocol, refit in refits.items():
+            shards.setdefault(get_worker(protocol, self.workers), []).append((protocol, refit))
+
+        sequences = [self.submit(worker, 'forecast', shard) for worker, shard in shards.items()]
+        for result in await self.wait_async(sequences):
+            for protocol, last_hour in result.items():
+                forecast_scheduler.record(protocol, last_hour, timestamp, refits[protocol])
+
+    def refresh(self, timestamp: int, contracts: list) -> None:
+        """
+        This function starts the scheduled refits in the background, one refit per idle worker
+        @param timestamp: current block timestamp
+        @param contracts: protocol addresses
+        """
+        while self.receive(timeout=0):
+            pass
+
+        busy_workers = {worker for worker, _, _ in self.refits.values()}
+        busy = {c for c in contracts if get_worker(c, self.workers) in busy_workers}
+        for protocol in forecast_scheduler.due(timestamp, contracts, busy=busy, limit=len(contracts)):
+            worker = get_worker(protocol, self.workers)
+            if worker in busy_workers:
+                continue
+            busy_workers.add(worker)
+            if debug_logs_enabled:
+                print(f'INFO: Refreshing forecast for {protocol} in the worker {worker}, '
+                      f'expires at: {forecast_scheduler.expires_at(protocol)}')
+            shard = [(protocol, forecast_scheduler.refit(protocol))]
+            self.refits[self.submit(worker, 'forecast', shard)] = (worker, timestamp, dict(shard))
+
+
+dispatcher = None
+
+
+def get_dispatcher(protocols: dict, workers: int = workers_count, test: bool = test_mode,
+                   path: str = database_path) -> Dispatcher:
+    """
+    @param protocols: protocols of the chain
+    @param workers: the amount of the workers
+    @param test: True if the workers use the test database
+    @param path: the database file of the agent, the workers use the same one
+    @return: the started dispatcher, the workers are stopped at exit
+    """
+    global dispatcher
+    if dispatcher is None:
+        dispatcher = Dispatcher(protocols, workers, test, path)
+        dispatcher.start()
+        atexit.register(dispatcher.stop)
+    return dispatcher
@@ -1,16 +1,31 @@
+import asyncio
 import random
 
+import pytest
 from forta_agent import FindingSeverity, create_transaction_event, create_block_event
 from web3 import Web3
 
-from src.agent import provide_handle_transaction, provide_handle_block
+import src.agent as agent
+from src.agent import provide_handle_transaction, provide_handle_block, provide_handle_transactions, \
+    TransactionsBuffer
+from src.scheduler import ForecastScheduler
 from src.utils import calculate_new_base_fee, get_protocols_by_chain
+from fixtures import BLOCK, NEXT_HOUR, generate_fixture
 
 FREE_ETH_ADDRESS = "0xE0dD882D4dA747e9848D05584e6b42c6320868be"
 protocols = get_protocols_by_chain(1)
 protocols_addresses = list(map(lambda x: Web3.toChecksumAddress(x).lower(), protocols.values()))
 
 
+@pytest.fixture(autouse=True, scope='module')
+def database(tmp_path_factory):
+    # the agent works with the in-memory copy of the generated database
+    path = tmp_path_factory.mktemp('agent_test') / 'test.db'
+    asyncio.run(generate_fixture(str(path), protocols))
+    agent.database_path = str(path)
+    agent.in_memory_db = True
+
+
 class TestSmartGasUsageAgent:
     def test_block_fee_calculation(self):
         """
@@ -168,3 +183,121 @@ class TestSmartGasUsageAgent:
 
         findings = provide_handle_transaction()(tx_event)
         assert len(findings) == 0
+
+    def test_batch_handling_returns_the_same_findings_as_the_per_event_handling(self):
+        gas_prices = [1000000000, 10000000000000, 115566665807, 2550000000000, 16000000000, 500000000000]
+        tx_events = [create_transaction_event({
+            'transaction': {
+                'hash': f'0x{i:064x}',
+                'from': FREE_ETH_ADDRESS,
+                'to': protocols_addresses[i % len(protocols_addresses)] if i % 4 else FREE_ETH_ADDRESS.lower(),
+                'gas_price': gas_price,
+
+            },
+            'block': {
+                'number': 14442800,
+                'timestamp': 1648041590,
+            },
+        }) for i, gas_price in enumerate(gas_prices * 3)]
+
+        def comparable(findings):
+            return [{k: v for k, v in vars(f).items() if k != 'timestamp'} for f in findings]
+
+        for real_base_fee_detected in (False, True):
+            state = (float('inf'), real_base_fee_detected, agent.win_streak)
+
+            agent.maybe_base_fee, agent.real_base_fee_detected, agent.win_streak = state
+            agent.seen_hashes.clear()
+            findings = [finding for tx_event in tx_events for finding in provide_handle_transaction()(tx_event)]
+            state_after = (agent.maybe_base_fee, agent.real_base_fee_detected, agent.win_streak)
+
+            agent.maybe_base_fee, agent.real_base_fee_detected, agent.win_streak = state
+            agent.seen_hashes.clear()
+            batch_findings = provide_handle_transactions()(tx_events)
+
+            assert comparable(batch_findings) == comparable(findings)
+            assert (agent.maybe_base_fee, agent.real_base_fee_detected, agent.win_streak) == state_after
+
+    def test_buffered_transactions_return_the_same_findings_as_the_batch_handling(self):
+        gas_prices = [10000000000000, 115566665807, 2550000000000, 500000000000]
+        # both blocks have the previous one in the database
+        tx_events = [create_transaction_event({
+            'transaction': {
+                'hash': f'0x{block * 10 + i:064x}',
+                'from': FREE_ETH_ADDRESS,
+                'to': protocols_addresses[i % len(protocols_addresses)],
+                'gas_price': gas_price,
+
+            },
+            'block': {
+                'number': block,
+                'timestamp': timestamp,
+            },
+        }) for block, timestamp in ((BLOCK, 1648041590), (BLOCK + 1700, NEXT_HOUR + 590))
+            for i, gas_price in enumerate(gas_prices)]
+
+        def comparable(findings):
+            return [{k: v for k, v in vars(f).items() if k != 'timestamp'} for f in findings]
+
+        state = (float('inf'), True, agent.win_streak)
+        agent.maybe_base_fee, agent.real_base_fee_detected, agent.win_streak = state
+        agent.seen_hashes.clear()
+        expected = [provide_handle_transactions()(tx_events[:len(gas_prices)]),
+                    provide_handle_transactions()(tx_events[len(gas_prices):])]
+
+        agent.maybe_base_fee, agent.real_base_fee_detected, agent.win_streak = state
+        agent.seen_hashes.clear()
+        buffer = TransactionsBuffer(handler=provide_handle_transactions())
+        returned = [buffer.add(tx_event) for tx_event in tx_events]
+
+        # the findings of the first block are returned when the first transaction of the next block is received
+        assert all(findings == [] for i, findings in enumerate(returned) if i != len(gas_prices))
+        assert expected[0] and comparable(returned[len(gas_prices)]) == comparable(expected[0])
+        assert expected[1] and comparable(buffer.flush()) == comparable(expected[1])
+        assert buffer.transaction_events == []
+
+    def test_redelivered_transaction_is_analyzed_and_stored_once(self):
+        tx_event = create_transaction_event({
+            'transaction': {
+                'hash': f'0x{10 ** 6:064x}',
+                'from': FREE_ETH_ADDRESS,
+                'to': protocols.get('RoninBridge').lower(),
+                'gas_price': 10000000000000,
+
+            },
+            'block': {
+                'number': 14442800,
+                'timestamp': 1648041590,
+            },
+        })
+
+        findings = provide_handle_transaction()(tx_event)
+        assert len(findings) == 1
+        assert provide_handle_transaction()(tx_event) == []
+        assert provide_handle_transactions()([tx_event, tx_event]) == []
+
+        # the unique index keeps the single row even if the hash was evicted from the filter
+        agent.seen_hashes.clear()
+        provide_handle_transaction()(tx_event)
+        rows = asyncio.run(agent.db_utils.get_transactions().get_columns_by_criteria(['tx'], {'tx': tx_event.hash}))
+        assert len(rows) == 1
+
+    def test_failed_refresh_postpones_the_protocol_instead_of_failing_the_block(self, monkeypatch):
+        scheduler = ForecastScheduler(refresh_lead=3600, refits_per_block=len(protocols_addresses))
+        forecasted = []
+
+        async def failing_forecast(protocol, refit):
+            forecasted.append(protocol)
+            raise ValueError('Dataframe has less than 2 non-NaN rows')
+
+        monkeypatch.setattr(agent, 'forecast_scheduler', scheduler)
+        monkeypatch.setattr(agent, 'forecast', failing_forecast)
+        monkeypatch.setattr(agent, 'current_capacity', agent.minimal_capacity_to_forecast + 1, raising=False)
+        block_event = create_block_event({'block': {'number': BLOCK, 'timestamp': 1648041590}})
+
+        asyncio.run(agent.refresh_forecasts(block_event))
+
+        # every due protocol is tried once and retried an hour later
+        assert forecasted == protocols_addresses
+        assert scheduler.due(1648041590 + 1800, protocols_addresses) == []
+        assert scheduler.due(1648041590 + 3600, protocols_addresses) == protocols_addresses
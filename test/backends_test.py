@@ -0,0 +1,57 @@
+import pandas as pd
+import pytest
+
+from src.backends import get_backend_class, get_backend_name
+from src.backends.deeplog_backend import DeepLogBackend
+from src.backends.prophet_backend import ProphetBackend
+from src.config import ETHER_protocols
+
+
+class TestForecastBackends:
+    def test_default_backend_is_used_for_not_configured_protocols(self):
+        assert get_backend_name(ETHER_protocols.get('OpenSea').lower()) == 'prophet'
+        assert get_backend_class('deeplog') is DeepLogBackend
+
+    def test_unknown_backend_raises(self):
+        with pytest.raises(ValueError):
+            get_backend_class('arima')
+
+    def test_deeplog_bounds_follow_the_hour_of_the_day_and_survive_serialization(self):
+        train = pd.DataFrame({'ds': pd.date_range('2022-03-20', periods=24 * 7, freq=pd.Timedelta(hours=1))})
+        train['y'] = [10 ** 9 * (10 if ds.hour == 12 else 1) + i for i, ds in enumerate(train['ds'])]
+
+        backend = DeepLogBackend()
+        backend.profile = backend.build_profile(train)
+        restored = DeepLogBackend.load(backend.serialize())
+        forecast = restored.predict(pd.Timestamp('2022-03-27 11:00'), 3)
+
+        assert forecast['ds'].dt.hour.tolist() == [11, 12, 13]
+        assert forecast['yhat'].iloc[1] > 5 * forecast['yhat'].iloc[0]
+        assert (forecast['yhat_lower'] <= forecast['yhat']).all() and (forecast['yhat'] <= forecast['yhat_upper']).all()
+
+    def test_deeplog_hours_without_values_get_the_bounds_of_the_whole_day(self):
+        train = pd.DataFrame({'ds': pd.date_range('2022-03-20', periods=24 * 7, freq=pd.Timedelta(hours=1))})
+        train['y'] = [None if ds.hour == 12 else 10 ** 9 + i for i, ds in enumerate(train['ds'])]
+
+        backend = DeepLogBackend()
+        backend.profile = backend.build_profile(train)
+        forecast = backend.predict(pd.Timestamp('2022-03-27 11:00'), 3)
+
+        assert not forecast.isna().any().any()
+        assert forecast.iloc[1][['yhat', 'yhat_lower', 'yhat_upper']].tolist() == backend.profile['all']
+
+    def test_prophet_forecast_survives_serialization(self):
+        train = pd.DataFrame({'ds': pd.date_range('2022-03-20', periods=24 * 7, freq=pd.Timedelta(hours=1))})
+        train['y'] = [10 ** 9 * (10 if ds.hour == 12 else 1) for ds in train['ds']]
+        # the empty hours are NaN as they are collected by the forecaster
+        train.loc[train['ds'].dt.hour == 3, 'y'] = None
+
+        backend = ProphetBackend()
+        backend.fit(train)
+        forecast = backend.predict(pd.Timestamp('2022-03-27 11:00'), 3)
+        restored = ProphetBackend.load(backend.serialize()).predict(pd.Timestamp('2022-03-27 11:00'), 3)
+
+        assert forecast.columns.tolist() == ['ds', 'yhat', 'yhat_lower', 'yhat_upper']
+        assert forecast['ds'].dt.hour.tolist() == [11, 12, 13]
+        assert forecast['yhat'].iloc[1] > max(forecast['yhat'].iloc[0], forecast['yhat'].iloc[2])
+        assert restored['yhat'].tolist() == pytest.approx(forecast['yhat'].tolist())
@@ -0,0 +1,55 @@
+import ctypes
+
+import numpy as np
+import pandas as pd
+
+from src.bakeoff import RESULT_COLUMNS, backtest, format_table
+from src.backends.deeplog_backend import DeepLogBackend
+
+NATIVE_MEMORY = 64 * 2 ** 20
+
+
+class NativeBackend(DeepLogBackend):
+    """
+    DeepLog backend without the detector, its fit allocates the memory outside of the Python allocators as the Stan
+    models do
+    """
+
+    def fit(self, train: pd.DataFrame) -> None:
+        libc = ctypes.CDLL('libc.so.6')
+        libc.malloc.restype = ctypes.c_void_p
+        buffer = libc.malloc(NATIVE_MEMORY)
+        # the pages are counted in RSS only when they are touched
+        ctypes.memset(buffer, 1, NATIVE_MEMORY)
+        libc.free(ctypes.c_void_p(buffer))
+        self.profile = self.build_profile(train.dropna(subset=['y']))
+
+
+def synthetic_series(days: int) -> tuple:
+    ds = pd.date_range('2022-03-20', periods=24 * days, freq=pd.Timedelta(hours=1))
+    y = np.array([10 ** 9 * (10 if hour == 12 else 1) for hour in ds.hour], dtype=float)
+    timestamps = (ds - pd.Timestamp(0)) // pd.Timedelta(seconds=1)
+    # the transactions of the last hours are twice more expensive than usual
+    transactions = np.column_stack([timestamps + 60, y * np.where(np.arange(len(y)) >= len(y) - 6, 2, 1)])
+    return pd.DataFrame({'ds': ds, 'y': y}), transactions
+
+
+class TestBakeoff:
+    def test_backtest_reports_the_metrics_of_each_origin(self):
+        series, transactions = synthetic_series(days=6)
+        result = backtest(NativeBackend, series, transactions, min_train=72, step=24, horizon=25)
+
+        assert result['origins'] == 3
+        assert result['coverage'] > 0.9 and result['mae_gwei'] < 1
+        # the horizons overlap by one hour, the transactions of this hour are evaluated only once
+        assert result['transactions'] == 24 + 24 + 24 and result['critical'] + result['high'] > 0
+        assert set(result) | {'protocol', 'backend'} == set(RESULT_COLUMNS)
+        assert format_table([{'protocol': 'OpenSea', 'backend': 'native', **result}]).splitlines()[0].split() == \
+            RESULT_COLUMNS
+
+    def test_peak_rss_includes_the_native_allocations(self):
+        series, transactions = synthetic_series(days=4)
+        result = backtest(NativeBackend, series, transactions, min_train=72, step=24, horizon=25)
+
+        assert result['peak_memory_mb'] < 16
+        assert result['peak_rss_mb'] >= NATIVE_MEMORY / 2 ** 20 * 0.9
@@ -0,0 +1,32 @@
+import asyncio
+
+import pytest
+
+from fixtures import PROTOCOLS, ProfileBackend
+from src import forecaster
+from src.db.controller import init_async_db
+from src.db.db_utils import db_utils
+
+
+@pytest.fixture
+def tables(tmp_path):
+    """
+    The empty database of the test with the PROTOCOLS registered, its tables are set to db_utils
+    @return: methods of the transactions, blocks and future tables
+    """
+    tables = asyncio.run(init_async_db(path=tmp_path / 'test.db', protocols_addresses=PROTOCOLS))
+    db_utils.set_tables(*tables)
+    return tables
+
+
+@pytest.fixture
+def profile_backend(monkeypatch):
+    """
+    The forecaster fits the ProfileBackend without the cached models
+    @return: ProfileBackend class with the reset counters
+    """
+    monkeypatch.setattr(forecaster, 'create_backend', lambda protocol: ProfileBackend())
+    forecaster.model_cache.clear()
+    ProfileBackend.fits = 0
+    ProfileBackend.predicted = []
+    return ProfileBackend
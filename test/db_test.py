@@ -0,0 +1,254 @@
+import asyncio
+import os
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from fixtures import PROTOCOLS
+from src.db.controller import init_async_db, snapshot_db
+from src.db.db_utils import db_utils
+from src.forecaster import hourly_max_priority_fees
+
+PROTOCOL_A, PROTOCOL_B = PROTOCOLS
+
+
+def transaction_row(i, contract=PROTOCOL_A):
+    return {'timestamp': 1648040400 + i, 'tx': f'0x{i:064x}', 'block': 14442800 + i, 'contract': contract, 'gas': 21000,
+            'gas_price': 10 ** 10, 'priority_fee': i}
+
+
+class TestMethods:
+    def test_unit_of_work_commits_all_the_methods_together(self, tables):
+        transactions, blocks, future = tables
+
+        async def run():
+            async with db_utils.unit_of_work():
+                await asyncio.gather(*[transactions.paste_row(transaction_row(i)) for i in range(10)])
+                await transactions.update_row_by_criteria({'priority_fee': 100}, {'block': 14442800})
+                assert await transactions.count_rows() == 10
+            return await transactions.get_first_columns_by_criteria(['priority_fee'], {'block': 14442800})
+
+        assert asyncio.run(run()).priority_fee == 100
+
+    def test_unit_of_work_is_rolled_back_on_exception(self, tables):
+        transactions, blocks, future = tables
+
+        async def run():
+            await transactions.paste_row(transaction_row(0))
+            with pytest.raises(ValueError):
+                async with db_utils.unit_of_work():
+                    await transactions.paste_rows([transaction_row(i) for i in range(1, 5)])
+                    raise ValueError
+            return await transactions.count_rows()
+
+        assert asyncio.run(run()) == 1
+
+    def test_projections_and_stream_return_only_the_requested_columns(self, tables):
+        transactions, blocks, future = tables
+
+        async def run():
+            await transactions.paste_rows([transaction_row(i, PROTOCOL_A if i % 2 else PROTOCOL_B) for i in range(25)])
+            rows = await transactions.get_columns_by_criteria(['tx', 'priority_fee'], {'contract': PROTOCOL_A})
+            array = await transactions.get_array_by_criteria(['block', 'priority_fee'], {'contract': PROTOCOL_A})
+            async with db_utils.unit_of_work():
+                chunks = [chunk async for chunk in
+                          transactions.stream_columns_by_criteria(['priority_fee'], {'contract': PROTOCOL_A}, batch_size=5)]
+            return rows, array, chunks
+
+        rows, array, chunks = asyncio.run(run())
+        assert [tuple(row) for row in rows] == [(f'0x{i:064x}', i) for i in range(1, 25, 2)]
+        assert array.shape == (12, 2) and array[:, 1].tolist() == list(range(1, 25, 2))
+        assert [len(chunk) for chunk in chunks] == [5, 5, 2]
+
+    def test_stream_consumer_may_use_the_database_inside_the_unit_of_work(self, tables):
+        transactions, blocks, future = tables
+
+        async def run():
+            await transactions.paste_rows([transaction_row(i) for i in reversed(range(12))])
+            blocks_read = []
+            async with db_utils.unit_of_work():
+                async for chunk in transactions.stream_columns_by_range(['block'], 'block', 14442800, 14442811,
+                                                                         batch_size=5):
+                    blocks_read += [row.block for row in chunk]
+                    await future.paste_row({'contract': PROTOCOL_A, 'timestamp': chunk[0].block, 'priority_fee': 1,
+                                            'priority_fee_lower': 0, 'priority_fee_upper': 2})
+                # the abandoned stream doesn't hold the lock
+                async for _ in transactions.stream_columns_by_criteria(['tx'], {}, batch_size=5):
+                    break
+                return blocks_read, await future.count_rows()
+
+        blocks_read, future_rows = asyncio.run(asyncio.wait_for(run(), timeout=10))
+        assert blocks_read == list(range(14442800, 14442812)) and future_rows == 3
+
+    def test_failed_replace_keeps_the_old_forecast(self, tables):
+        transactions, blocks, future = tables
+
+        def future_row(timestamp, **columns):
+            return {'contract': PROTOCOL_A, 'timestamp': timestamp, 'priority_fee': 1, 'priority_fee_lower': 0,
+                    'priority_fee_upper': 2, **columns}
+
+        async def run():
+            await future.replace_rows_by_contract(PROTOCOL_A, [future_row(1648040400), future_row(1648044000)])
+            # the insert fails on the unregistered protocol after the old rows are deleted
+            with pytest.raises(Exception, match='is not registered'):
+                await future.replace_rows_by_contract(PROTOCOL_A, [future_row(1648047600),
+                                                                   future_row(1648047600, contract='0x' + 'c' * 40)])
+            return await future.get_columns_by_criteria(['timestamp'], {'contract': PROTOCOL_A})
+
+        assert sorted(row.timestamp for row in asyncio.run(run())) == [1648040400, 1648044000]
+
+    def test_pasted_transactions_are_upserted_by_the_hash(self, tables):
+        transactions, blocks, future = tables
+
+        async def run():
+            await transactions.paste_rows([transaction_row(i) for i in range(5)])
+            await transactions.paste_row({**transaction_row(1), 'priority_fee': None, 'gas': 50000})
+            await transactions.paste_rows([{**transaction_row(i), 'priority_fee': 100} for i in range(3, 7)])
+            return await transactions.get_columns_by_criteria(['tx', 'gas', 'priority_fee'], {'contract': PROTOCOL_A})
+
+        rows = sorted(tuple(row) for row in asyncio.run(run()))
+        assert rows == [(f'0x{0:064x}', 21000, 0), (f'0x{1:064x}', 50000, 1), (f'0x{2:064x}', 21000, 2)] + \
+            [(f'0x{i:064x}', 21000, 100) for i in range(3, 7)]
+
+    def test_old_transactions_are_rolled_up_to_the_hourly_and_daily_fees(self, tables):
+        transactions, blocks, future = tables
+        hourly_fees, daily_fees = db_utils.get_hourly_fees(), db_utils.get_daily_fees()
+        hour = 1648040400
+
+        async def run():
+            # two transactions per 20 minutes of each protocol during 3 hours
+            await transactions.paste_rows([{**transaction_row(i, PROTOCOL_A if i % 2 else PROTOCOL_B),
+                                            'timestamp': hour + i // 2 * 1200} for i in range(18)])
+            # the first hour is rolled up partially and then merged with the rest of it
+            rolled_up = [await hourly_fees.roll_up(transactions, 3600, hour + 1200),
+                         await hourly_fees.roll_up(transactions, 3600, hour + 7200)]
+            rows = await hourly_fees.get_columns_by_criteria(['timestamp', 'priority_fee', 'transactions'],
+                                                             {'contract': PROTOCOL_A})
+            train, count = await hourly_max_priority_fees(PROTOCOL_A)
+            await daily_fees.roll_up(hourly_fees, 86400, hour + 7200)
+            daily = await daily_fees.get_columns_by_criteria(['timestamp', 'priority_fee', 'transactions'],
+                                                             {'contract': PROTOCOL_A})
+            long_train, long_count = await hourly_max_priority_fees(PROTOCOL_A)
+            return rolled_up, rows, train, count, daily, await hourly_fees.count_rows(), long_train, long_count
+
+        rolled_up, rows, train, count, daily, hourly_left, long_train, long_count = asyncio.run(run())
+        assert rolled_up == [2, 10]
+        assert sorted(tuple(row) for row in rows) == [(hour, 5, 3), (hour + 3600, 11, 3)]
+        assert train['y'].tolist() == [5, 11, 17] and count == 9
+        assert [tuple(row) for row in daily] == [(hour - hour % 86400, 11, 6)] and hourly_left == 0
+        # the rolled up day is still in the history of the forecaster, its max is spread over its hours
+        assert long_train['ds'].iloc[0] == pd.Timestamp(hour - hour % 86400, unit='s') and long_count == 9
+        assert long_train['y'].tolist() == [11] * ((hour % 86400 + 7200) // 3600) + [17]
+
+    def test_in_memory_database_is_restored_from_its_snapshot(self, tmp_path):
+        path = str(tmp_path / 'snapshot.db')
+
+        async def run():
+            transactions, blocks, future = await init_async_db(path=path, protocols_addresses=[PROTOCOL_A],
+                                                               in_memory=True)
+            await transactions.paste_rows([transaction_row(i) for i in range(5)])
+            saved = os.path.exists(path)
+            assert await snapshot_db()
+            await transactions.paste_row(transaction_row(5))
+
+            transactions, blocks, future = await init_async_db(path=path, in_memory=True)
+            return saved, await transactions.get_columns_by_criteria(['tx', 'contract'], {})
+
+        saved, rows = asyncio.run(run())
+        assert not saved
+        assert [tuple(row) for row in rows] == [(f'0x{i:064x}', PROTOCOL_A) for i in range(5)]
+
+    def test_migration_removes_the_duplicated_transactions(self, tmp_path):
+        path = tmp_path / 'old.db'
+        connection = sqlite3.connect(path)
+        connection.execute('CREATE TABLE transactions (id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp INTEGER, '
+                           'tx VARCHAR, block INTEGER, contract VARCHAR, gas INTEGER, gas_price INTEGER, '
+                           'priority_fee INTEGER)')
+        connection.executemany('INSERT INTO transactions (tx, block, priority_fee) VALUES (?, ?, ?)',
+                               [('0x1', 1, 1), ('0x1', 1, 2), ('0x2', 2, 3), (None, 3, 4), (None, 3, 5)])
+        connection.commit()
+        connection.close()
+
+        transactions, blocks, future = asyncio.run(init_async_db(path=path))
+        rows = asyncio.run(transactions.get_columns_by_criteria(['tx', 'priority_fee'], {'block': 1}))
+        # the odd length hashes are padded
+        assert [tuple(row) for row in rows] == [('0x01', 2)]
+        assert asyncio.run(transactions.get_columns_by_criteria(['block'], {'tx': '0x2'}))[0].block == 2
+        assert asyncio.run(transactions.count_rows()) == 4
+
+    def test_migration_encodes_the_legacy_rows(self, tmp_path):
+        path = tmp_path / 'old.db'
+        connection = sqlite3.connect(path)
+        # the legacy tables have the extra columns, and the blocks have no base fee yet
+        connection.execute('CREATE TABLE transactions (id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp INTEGER, '
+                           'tx VARCHAR, block INTEGER, contract VARCHAR, gas INTEGER, gas_price INTEGER, '
+                           'priority_fee INTEGER, nonce INTEGER)')
+        connection.execute('CREATE TABLE blocks (id INTEGER PRIMARY KEY AUTOINCREMENT, block INTEGER, '
+                           'block_hash VARCHAR, gas_used_total INTEGER, gas_limit_total INTEGER)')
+        connection.execute('CREATE TABLE future (id INTEGER PRIMARY KEY AUTOINCREMENT, contract VARCHAR, '
+                           'timestamp INTEGER, priority_fee INTEGER, priority_fee_lower INTEGER, '
+                           'priority_fee_upper INTEGER, model VARCHAR)')
+        connection.executemany('INSERT INTO transactions (timestamp, tx, block, contract, gas, gas_price, priority_fee, '
+                               'nonce) VALUES (?, ?, ?, ?, 21000, 10000000000, ?, 0)',
+                               [(1648040400, f'0x{i:064x}', 14442800 + i, PROTOCOL_A if i % 2 else PROTOCOL_B, i)
+                                for i in range(5)])
+        connection.executemany('INSERT INTO blocks (block, block_hash, gas_used_total, gas_limit_total) '
+                               'VALUES (?, ?, 15000000, 30000000)',
+                               [(14442800 + i, f'0x{i:064X}') for i in range(3)])
+        connection.execute('INSERT INTO future (contract, timestamp, priority_fee, priority_fee_lower, '
+                           f"priority_fee_upper, model) VALUES ('{PROTOCOL_A}', 1648040400, 5, 1, 18, 'prophet')")
+        connection.commit()
+        connection.close()
+
+        transactions, blocks, future = asyncio.run(init_async_db(path=path))
+        rows = asyncio.run(transactions.get_columns_by_criteria(['tx', 'contract', 'priority_fee'],
+                                                                {'contract': PROTOCOL_A}))
+        assert [tuple(row) for row in rows] == [(f'0x{i:064x}', PROTOCOL_A, i) for i in (1, 3)]
+        rows = asyncio.run(blocks.get_columns_by_criteria(['block', 'block_hash', 'base_fee'], {'block': 14442801}))
+        assert [tuple(row) for row in rows] == [(14442801, f'0x{1:064x}', None)]
+        rows = asyncio.run(future.get_columns_by_criteria(['contract', 'priority_fee_upper'], {'timestamp': 1648040400}))
+        assert [tuple(row) for row in rows] == [(PROTOCOL_A, 18)]
+
+        connection = sqlite3.connect(path)
+        assert connection.execute('SELECT DISTINCT typeof(tx), typeof(contract_id) FROM transactions').fetchall() == \
+            [('blob', 'integer')]
+        assert 'nonce' not in [column[1] for column in connection.execute('PRAGMA table_info(transactions)')]
+        connection.close()
+
+    def test_migration_indexes_the_transactions_of_the_protocol(self, tables, tmp_path):
+        connection = sqlite3.connect(tmp_path / 'test.db')
+        connection.execute('DROP INDEX ix_transactions_contract_timestamp')
+        connection.commit()
+        connection.close()
+
+        asyncio.run(init_async_db(path=tmp_path / 'test.db'))
+        connection = sqlite3.connect(tmp_path / 'test.db')
+        plan = connection.execute('EXPLAIN QUERY PLAN SELECT timestamp, priority_fee FROM transactions '
+                                  'WHERE contract_id = 1 AND timestamp < 1648040400').fetchall()
+        connection.close()
+        assert 'ix_transactions_contract_timestamp' in plan[0][-1]
+
+    def test_read_only_database_is_not_migrated_or_changed(self, tables, tmp_path):
+        transactions, blocks, future = tables
+        asyncio.run(transactions.paste_rows([transaction_row(i) for i in range(3)]))
+        content = (tmp_path / 'test.db').read_bytes()
+
+        transactions, blocks, future = asyncio.run(init_async_db(path=tmp_path / 'test.db', read_only=True))
+        rows = asyncio.run(transactions.get_columns_by_criteria(['tx'], {'contract': PROTOCOL_A}))
+        assert [row.tx for row in rows] == [f'0x{i:064x}' for i in range(3)]
+        with pytest.raises(Exception, match='readonly database'):
+            asyncio.run(transactions.paste_row(transaction_row(3)))
+        assert (tmp_path / 'test.db').read_bytes() == content
+
+        # the outdated database is left as it is
+        path = tmp_path / 'old.db'
+        connection = sqlite3.connect(path)
+        connection.execute('CREATE TABLE transactions (id INTEGER PRIMARY KEY AUTOINCREMENT, tx VARCHAR)')
+        connection.close()
+        with pytest.raises(ValueError, match='outdated schema'):
+            asyncio.run(init_async_db(path=path, read_only=True))
+        connection = sqlite3.connect(path)
+        assert [row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")] == \
+            ['transactions', 'sqlite_sequence']
+        connection.close()
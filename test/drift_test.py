@@ -0,0 +1,88 @@
+import asyncio
+from types import SimpleNamespace
+
+from fixtures import HOUR, PROTOCOLS, paste_hours
+from src import agent, forecaster
+from src.drift import DriftTracker
+from src.memory import MemoryMonitor
+from src.scoring import FutureRow
+from src.scheduler import ForecastScheduler
+
+PROTOCOL = PROTOCOLS[0]
+
+
+class TestDrift:
+    def test_biased_residuals_and_low_coverage_trigger_the_refit(self):
+        row = FutureRow(PROTOCOL, 100, 90, 110)
+        tracker = DriftTracker(alpha=0.5, residual_threshold=1, coverage_threshold=0.5, min_hours=3)
+        scheduler = ForecastScheduler(refresh_lead=3600, refits_per_block=1, drift=tracker)
+        scheduler.record(PROTOCOL, HOUR + 24 * 3600, HOUR)
+
+        for observed in (105, 95, 100, 108):
+            tracker.observe(PROTOCOL, observed, row)
+        assert not tracker.drifted(PROTOCOL)
+        assert scheduler.due(HOUR, [PROTOCOL]) == []
+        assert not scheduler.refit(PROTOCOL)
+
+        for observed in (150, 160):
+            tracker.observe(PROTOCOL, observed, row)
+        assert tracker.residual(PROTOCOL) > 1 and tracker.coverage(PROTOCOL) < 0.5
+        assert scheduler.due(HOUR, [PROTOCOL]) == [PROTOCOL]
+        assert scheduler.refit(PROTOCOL)
+        # the drift is forgotten only when the model is replaced
+        scheduler.record(PROTOCOL, None, HOUR, refitted=True)
+        assert scheduler.refit(PROTOCOL)
+        scheduler.record(PROTOCOL, HOUR + 48 * 3600, HOUR, refitted=True)
+        assert not scheduler.refit(PROTOCOL) and tracker.residual(PROTOCOL) is None
+
+    def test_drift_is_compared_with_the_forecast_of_the_start_of_the_hour(self, tables, monkeypatch):
+        transactions, blocks, future = tables
+        tracker = DriftTracker(alpha=0.5, residual_threshold=1, coverage_threshold=0.5, min_hours=1)
+        monkeypatch.setattr(agent, 'forecast_scheduler', ForecastScheduler(refresh_lead=3600, refits_per_block=1,
+                                                                           drift=tracker))
+        monkeypatch.setattr(agent, 'drift_hour', None)
+        monkeypatch.setattr(agent, 'drift_rows', {})
+        monkeypatch.setattr(agent, 'debug_logs_enabled', False)
+
+        def block_event(timestamp: int):
+            return SimpleNamespace(block=SimpleNamespace(timestamp=timestamp))
+
+        def forecast_row(priority_fee: int) -> dict:
+            return {'contract': PROTOCOL, 'timestamp': HOUR, 'priority_fee': priority_fee,
+                    'priority_fee_lower': priority_fee - 10, 'priority_fee_upper': priority_fee + 10}
+
+        async def run():
+            await future.paste_row(forecast_row(100))
+            await agent.track_drift(block_event(HOUR + 12))
+            # the forecast is refreshed during the hour and follows the observed fees
+            await future.replace_rows_by_contract(PROTOCOL, [forecast_row(1000)])
+            await transactions.paste_row({'timestamp': HOUR + 600, 'tx': f'0x{1:064x}', 'block': 14442800,
+                                          'contract': PROTOCOL, 'gas': 21000, 'gas_price': 10 ** 10,
+                                          'priority_fee': 1000})
+            await agent.track_drift(block_event(HOUR + 3600 + 12))
+
+        asyncio.run(run())
+        assert tracker.residual(PROTOCOL) == (1000 - 100) / 20
+        assert tracker.drifted(PROTOCOL)
+
+    def test_drift_is_kept_until_the_deferred_refit_succeeds(self, tables, profile_backend, monkeypatch):
+        transactions, blocks, future = tables
+        paste_hours(transactions, 0, 48)
+        timestamp = HOUR + 47 * 3600
+        tracker = DriftTracker(alpha=0.5, residual_threshold=1, coverage_threshold=0.5, min_hours=1)
+        scheduler = ForecastScheduler(refresh_lead=3600, refits_per_block=1, drift=tracker)
+        monkeypatch.setattr(agent, 'forecast_scheduler', scheduler)
+        asyncio.run(agent.forecast_protocols([PROTOCOL], timestamp))
+        for observed in (150, 160):
+            tracker.observe(PROTOCOL, observed, FutureRow(PROTOCOL, 100, 90, 110))
+
+        monkeypatch.setattr(forecaster, 'memory_monitor', MemoryMonitor(tracking=False, budget_mb=1, metrics_path=''))
+        asyncio.run(agent.forecast_protocols([PROTOCOL], timestamp))
+        # the cached model is not extended, the refit is retried after an hour
+        assert profile_backend.fits == 1 and tracker.drifted(PROTOCOL)
+        assert scheduler.due(timestamp + 1800, [PROTOCOL]) == []
+        assert scheduler.due(timestamp + 3600, [PROTOCOL]) == [PROTOCOL]
+
+        monkeypatch.setattr(forecaster, 'memory_monitor', MemoryMonitor(tracking=False, budget_mb=0, metrics_path=''))
+        asyncio.run(agent.forecast_protocols([PROTOCOL], timestamp + 3600))
+        assert profile_backend.fits == 2 and not tracker.drifted(PROTOCOL)
@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+from fixtures import PROTOCOLS
+from src.db.db_utils import db_utils
+from src.export import export_history, load
+
+
+def block_row(block):
+    return {'block': block, 'block_hash': f'0x{block:064x}', 'gas_used_total': 15000000, 'gas_limit_total': 30000000,
+            'base_fee': 2 * 10 ** 10}
+
+
+def transaction_row(block, i):
+    return {'timestamp': 1648040400 + block * 12, 'tx': f'0x{block * 10 + i:064x}', 'block': block,
+            'contract': PROTOCOLS[i % 2], 'gas': 21000, 'gas_price': 3 * 10 ** 10, 'priority_fee': 10 ** 10 + i}
+
+
+async def paste_blocks(blocks):
+    await db_utils.get_blocks().paste_rows([block_row(block) for block in blocks])
+    await db_utils.get_transactions().paste_rows([transaction_row(block, i) for block in blocks for i in range(3)])
+
+
+class TestExport:
+    @pytest.mark.parametrize('file_format', ['parquet', 'arrow'])
+    def test_history_is_exported_incrementally_and_loaded_back(self, tables, tmp_path, file_format):
+        output = tmp_path / 'history'
+
+        asyncio.run(paste_blocks(range(95, 125)))
+        asyncio.run(tables[2].paste_row({'contract': PROTOCOLS[0], 'timestamp': 1648040400, 'priority_fee': 1,
+                                         'priority_fee_lower': 0, 'priority_fee_upper': 2}))
+        # the last 2 blocks are not exported yet
+        assert asyncio.run(export_history(output, file_format, partition_size=10)) == \
+               {'blocks': 28, 'transactions': 84, 'future': 1, 'hourly_fees': 0, 'daily_fees': 0}
+
+        asyncio.run(paste_blocks(range(125, 140)))
+        assert asyncio.run(export_history(output, file_format, partition_size=10, keep_snapshots=2)) == \
+               {'blocks': 15, 'transactions': 45, 'future': 1, 'hourly_fees': 0, 'daily_fees': 0}
+
+        assert sorted(path.stem for path in (output / 'blocks').iterdir()) == ['100', '110', '120', '123', '130', '90']
+        assert load(output, 'blocks')['block'].to_pylist() == list(range(95, 138))
+
+        transactions = load(output, 'transactions', first_block=105, last_block=126, columns=['tx', 'contract'])
+        assert transactions.column_names == ['tx', 'contract']
+        assert transactions['tx'].to_pylist() == [f'0x{block * 10 + i:064x}' for block in range(105, 127)
+                                                  for i in range(3)]
+        assert set(transactions['contract'].to_pylist()) == set(PROTOCOLS)
+        assert load(output, 'future', last_block=130)['priority_fee'].to_pylist() == [1]
+
+    def test_only_the_newest_snapshots_are_kept(self, tables, tmp_path):
+        output = tmp_path / 'history'
+
+        asyncio.run(paste_blocks(range(100, 110)))
+        asyncio.run(tables[2].paste_row({'contract': PROTOCOLS[0], 'timestamp': 1648040400, 'priority_fee': 1,
+                                         'priority_fee_lower': 0, 'priority_fee_upper': 2}))
+        asyncio.run(export_history(output))
+        asyncio.run(tables[2].paste_row({'contract': PROTOCOLS[1], 'timestamp': 1648040400, 'priority_fee': 3,
+                                         'priority_fee_lower': 0, 'priority_fee_upper': 4}))
+        # the repeated export of the same block overwrites the snapshot
+        asyncio.run(export_history(output))
+        asyncio.run(paste_blocks(range(110, 115)))
+        asyncio.run(export_history(output))
+
+        for table in ('future', 'hourly_fees', 'daily_fees'):
+            assert [path.name for path in (output / table).iterdir()] == ['112.parquet']
+        assert sorted(load(output, 'future')['priority_fee'].to_pylist()) == [1, 3]
+        assert load(output, 'future', last_block=107).num_rows == 0
@@ -0,0 +1,73 @@
+import asyncio
+
+import pandas as pd
+
+from src.backends.deeplog_backend import DeepLogBackend
+from src.db.controller import init_async_db
+
+BLOCK = 14442800
+HOUR = 1648040400
+NEXT_HOUR = 1648062000
+BASE_FEE = 15566665807
+GWEI = 10 ** 9
+# the protocols registered in the database of the tables fixture
+PROTOCOLS = ['0x' + 'a' * 40, '0x' + 'b' * 40]
+
+
+async def generate_fixture(path: str, protocols: dict):
+    """
+    This function generates the small database for the agent tests instead of the collected preset. It has the blocks
+    before the tested ones and the forecasts of the tested hours
+    @param path: path to the database file
+    @param protocols: protocols of the chain
+    @return:
+    """
+    transactions, blocks, future = await init_async_db(path=path, protocols_addresses=[
+        address.lower() for address in protocols.values()])
+
+    # the half full blocks keep the base fee
+    await blocks.paste_rows([{'block': block, 'block_hash': None, 'gas_used_total': 15000000,
+                              'gas_limit_total': 30000000, 'base_fee': BASE_FEE}
+                             for block in (BLOCK - 2, BLOCK - 1, BLOCK + 1698, BLOCK + 1699)])
+
+    # OpenSea is volatile, its priority fee is lower at the first hour
+    rows = []
+    for name, address in protocols.items():
+        for hour in (HOUR, NEXT_HOUR):
+            if name == 'OpenSea':
+                fees = (500, 100, 1000) if hour == HOUR else (1500, 0, 3064)
+            else:
+                fees = (5, 1, 18)
+            rows.append({'contract': address.lower(), 'timestamp': hour, 'priority_fee': fees[0] * GWEI,
+                         'priority_fee_lower': fees[1] * GWEI, 'priority_fee_upper': fees[2] * GWEI})
+    await future.paste_rows(rows)
+
+
+class ProfileBackend(DeepLogBackend):
+    """
+    DeepLog backend without the detector, so it can be fitted without the tods package
+    """
+    fits = 0
+    predicted = []
+
+    def fit(self, train: pd.DataFrame) -> None:
+        ProfileBackend.fits += 1
+        self.profile = self.build_profile(train)
+
+    def predict(self, start: pd.Timestamp, periods: int) -> pd.DataFrame:
+        ProfileBackend.predicted.append((start, periods))
+        return super().predict(start, periods)
+
+
+def paste_hours(transactions, first_hour: int, hours: int):
+    """
+    This function stores one transaction of the first of the PROTOCOLS for each hour starting from the HOUR
+    @param transactions: methods of the transactions table
+    @param first_hour: the first hour after the HOUR
+    @param hours: the amount of the hours
+    @return:
+    """
+    asyncio.run(transactions.paste_rows([
+        {'timestamp': HOUR + hour * 3600, 'tx': f'0x{hour:064x}', 'block': 14442800 + hour, 'contract': PROTOCOLS[0],
+         'gas': 21000, 'gas_price': 10 ** 10, 'priority_fee': 10 ** 9 + hour}
+        for hour in range(first_hour, first_hour + hours)]))
@@ -0,0 +1,63 @@
+import asyncio
+import json
+
+import pandas as pd
+
+from fixtures import HOUR, PROTOCOLS, paste_hours
+from src import forecaster
+from src.db.db_utils import db_utils
+
+PROTOCOL = PROTOCOLS[0]
+
+
+class TestForecaster:
+    def test_only_the_forecast_horizon_is_predicted(self, tables, profile_backend):
+        transactions, blocks, future = tables
+        paste_hours(transactions, 0, 48)
+
+        last_hour = asyncio.run(forecaster.forecast(PROTOCOL))
+        rows = asyncio.run(future.get_columns_by_criteria(['timestamp'], {'contract': PROTOCOL}))
+
+        # the history is not predicted, the forecast starts at the last collected hour
+        assert profile_backend.predicted == [(pd.Timestamp(HOUR + 47 * 3600, unit='s'),
+                                              forecaster.forecast_horizon + 1)]
+        assert sorted(row.timestamp for row in rows) == [HOUR + (47 + hour) * 3600
+                                                         for hour in range(forecaster.forecast_horizon + 1)]
+        assert last_hour == HOUR + (47 + forecaster.forecast_horizon) * 3600
+
+    def test_forecast_is_extended_with_the_cached_model_until_it_is_too_old(self, tables, profile_backend,
+                                                                            monkeypatch):
+        transactions, blocks, future = tables
+        paste_hours(transactions, 0, 48)
+
+        last_hour = asyncio.run(forecaster.forecast(PROTOCOL, refit=False))
+        assert profile_backend.fits == 1
+        assert last_hour == HOUR + (47 + forecaster.forecast_horizon) * 3600
+
+        paste_hours(transactions, 48, 24)
+        last_hour = asyncio.run(forecaster.forecast(PROTOCOL, refit=False))
+        assert profile_backend.fits == 1
+        assert last_hour == HOUR + (71 + forecaster.forecast_horizon) * 3600
+        assert asyncio.run(future.get_max('timestamp')) == last_hour
+
+        asyncio.run(forecaster.forecast(PROTOCOL, refit=True))
+        assert profile_backend.fits == 2
+
+        monkeypatch.setattr(forecaster, 'forecast_max_model_age', 3600)
+        paste_hours(transactions, 72, 2)
+        asyncio.run(forecaster.forecast(PROTOCOL, refit=False))
+        assert profile_backend.fits == 3
+
+    def test_rolled_up_days_do_not_skew_the_seasonality_at_midnight(self, tables, profile_backend):
+        transactions, blocks, future = tables
+        paste_hours(transactions, 0, 48)
+        day = HOUR - HOUR % 86400
+        asyncio.run(db_utils.get_daily_fees().paste_rows([
+            {'contract': PROTOCOL, 'timestamp': day - days * 86400, 'priority_fee': 10 ** 10, 'transactions': 24}
+            for days in range(1, 15)]))
+
+        asyncio.run(forecaster.forecast(PROTOCOL))
+        profile = json.loads(forecaster.model_cache.get(PROTOCOL).data)
+        # each hour of the day has the same amount of the expensive days
+        medians = {hour: bounds[0] for hour, bounds in profile['hours'].items()}
+        assert medians == {str(hour): 10 ** 10 for hour in range(24)}
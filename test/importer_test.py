@@ -0,0 +1,132 @@
+import asyncio
+
+import pandas as pd
+import pytest
+
+from fixtures import PROTOCOLS
+from src.db.db_utils import db_utils
+from src.importer import BLOCKS_COLUMNS, TRANSACTIONS_COLUMNS, import_history, prepare_blocks, prepare_transactions, \
+    to_rows
+
+PROTOCOL = PROTOCOLS[0]
+OTHER = '0x' + 'c' * 40
+GWEI = 10 ** 9
+HOUR = 1648040400
+
+
+def raw_blocks(**columns) -> pd.DataFrame:
+    # the blocks are unordered and the second one is duplicated
+    return pd.DataFrame({'block': [2, 1, 2], 'block_hash': ['0x02', '0x01', '0x02'],
+                         'gas_used_total': [15000000] * 3, 'gas_limit_total': [30000000] * 3,
+                         'base_fee': [None, 10 * GWEI, None], **columns})
+
+
+def raw_transactions(**columns) -> pd.DataFrame:
+    return pd.DataFrame({'tx': ['0x03', '0x01', '0x02', '0x01', '0x04'], 'block': [2, 2, 1, 2, 1],
+                         'contract': [PROTOCOL.upper().replace('0X', '0x'), PROTOCOL, PROTOCOL, PROTOCOL, OTHER],
+                         'gas': [21000] * 5, 'gas_price': [12 * GWEI, 11 * GWEI, 13 * GWEI, 14 * GWEI, 15 * GWEI],
+                         **columns})
+
+
+class TestImporter:
+    def test_transactions_get_the_base_fees_and_timestamps_of_their_blocks(self):
+        blocks = prepare_blocks(raw_blocks(timestamp=[1648040412, 1648040400, 1648040412]))
+        transactions = prepare_transactions(raw_transactions(), blocks, [PROTOCOL])
+
+        assert blocks['block'].tolist() == [1, 2] and blocks['base_fee'].tolist() == [10 * GWEI, 10 * GWEI]
+        assert transactions['timestamp'].tolist() == [1648040400, 1648040412, 1648040412]
+        assert transactions['priority_fee'].tolist() == [3 * GWEI, 2 * GWEI, 4 * GWEI]
+
+    def test_duplicates_and_other_contracts_are_dropped(self):
+        blocks = prepare_blocks(raw_blocks(timestamp=[1648040412, 1648040400, 1648040412]))
+        transactions = prepare_transactions(raw_transactions(), blocks, [PROTOCOL])
+
+        # the last copy of the duplicated transaction is kept, the lowercase contracts are matched
+        assert sorted(transactions['tx']) == ['0x01', '0x02', '0x03']
+        assert transactions.set_index('tx').loc['0x01', 'gas_price'] == 14 * GWEI
+        assert set(transactions['contract']) == {PROTOCOL}
+
+    def test_transactions_are_sorted_by_the_block_and_the_timestamp(self):
+        blocks = prepare_blocks(raw_blocks())
+        transactions = prepare_transactions(raw_transactions(timestamp=[1648040415, 1648040413, 1648040400,
+                                                                         1648040412, 1648040400],
+                                                             priority_fee=[None, 5 * GWEI, None, None, None]),
+                                            blocks, [PROTOCOL])
+
+        assert transactions['tx'].tolist() == ['0x02', '0x01', '0x03']
+        # the known priority fees are kept
+        assert transactions['priority_fee'].tolist() == [3 * GWEI, 4 * GWEI, 2 * GWEI]
+
+    def test_transactions_without_timestamps_are_rejected(self):
+        blocks = prepare_blocks(raw_blocks())
+        with pytest.raises(ValueError, match='timestamp column'):
+            prepare_transactions(raw_transactions(), blocks, [PROTOCOL])
+
+        # the block of the second transaction is not imported
+        blocks = prepare_blocks(raw_blocks(timestamp=[1648040412, 1648040400, 1648040412]).iloc[1:2])
+        with pytest.raises(ValueError, match='2 transactions have no timestamp'):
+            prepare_transactions(raw_transactions(), blocks, [PROTOCOL])
+
+    def test_repeated_import_rebuilds_the_roll_ups(self, tables):
+        transactions, blocks, future = tables
+        hourly_fees = db_utils.get_hourly_fees()
+        # one transaction each 8 hours, the transactions older than 2 days before the last one are rolled up right away
+        raw_blocks_rows = pd.DataFrame({'block': range(1, 10), 'block_hash': [f'0x{i:02x}' for i in range(1, 10)],
+                                        'gas_used_total': 15000000, 'gas_limit_total': 30000000,
+                                        'base_fee': 10 * GWEI, 'timestamp': [HOUR + i * 8 * 3600 for i in range(9)]})
+        raw_transactions_rows = pd.DataFrame({'tx': [f'0x{i:064x}' for i in range(1, 10)], 'block': range(1, 10),
+                                              'contract': PROTOCOL, 'gas': 21000, 'gas_price': 12 * GWEI})
+
+        async def run():
+            counts = []
+            for _ in range(2):
+                await import_history(raw_blocks_rows, raw_transactions_rows, PROTOCOLS)
+                rows = await hourly_fees.get_columns_by_criteria(['timestamp', 'transactions'], {'contract': PROTOCOL})
+                counts.append((sorted(tuple(row) for row in rows), await transactions.count_rows()))
+            return counts
+
+        first, second = asyncio.run(run())
+        assert first == second
+        assert first == ([(HOUR, 1), (HOUR + 8 * 3600, 1)], 7)
+
+    def test_import_keeps_the_roll_ups_of_the_other_protocols(self, tables):
+        hourly_fees = db_utils.get_hourly_fees()
+        live_row = (PROTOCOLS[1], HOUR, 7 * GWEI, 3)
+        # the second block is 3 days later, so the transaction of the first one is rolled up right away
+        blocks = raw_blocks(timestamp=[HOUR + 3 * 86400, HOUR, HOUR + 3 * 86400])
+
+        async def run():
+            await hourly_fees.paste_row(dict(zip(['contract', 'timestamp', 'priority_fee', 'transactions'], live_row)))
+            await import_history(blocks, raw_transactions(), PROTOCOLS)
+            rows = await hourly_fees.get_columns_by_criteria(['contract', 'timestamp', 'priority_fee', 'transactions'],
+                                                             {'timestamp': HOUR})
+            return sorted(tuple(row) for row in rows)
+
+        assert asyncio.run(run()) == [(PROTOCOL, HOUR, 3 * GWEI, 1), live_row]
+
+    def test_missing_fees_are_stored_as_integers(self):
+        blocks = prepare_blocks(raw_blocks(timestamp=[1648040412, 1648040400, 1648040412]))
+        # the gas price of the kept copy of the duplicated transaction is missing
+        transactions = prepare_transactions(raw_transactions(gas_price=[12 * GWEI, 11 * GWEI, 13 * GWEI, None,
+                                                                        15 * GWEI]), blocks, [PROTOCOL])
+        rows = to_rows(transactions, TRANSACTIONS_COLUMNS)
+
+        assert [row['priority_fee'] for row in rows] == [3 * GWEI, 2 * GWEI, None]
+        assert all(type(row[column]) is int for row in rows for column in ('timestamp', 'block', 'gas', 'gas_price',
+                                                                           'priority_fee') if row[column] is not None)
+        assert all(type(row['base_fee']) is int for row in to_rows(blocks, BLOCKS_COLUMNS))
+
+    def test_import_keeps_the_roll_ups_of_the_partially_covered_days(self, tables):
+        daily_fees = db_utils.get_daily_fees()
+        # the hours of the day before the import were rolled up by the agent
+        live_row = (PROTOCOL, HOUR - HOUR % 86400, 7 * GWEI, 3)
+        blocks = raw_blocks(timestamp=[HOUR + 3 * 86400, HOUR, HOUR + 3 * 86400])
+
+        async def run():
+            await daily_fees.paste_row(dict(zip(['contract', 'timestamp', 'priority_fee', 'transactions'], live_row)))
+            await import_history(blocks, raw_transactions(), PROTOCOLS)
+            rows = await daily_fees.get_columns_by_criteria(['contract', 'timestamp', 'priority_fee', 'transactions'],
+                                                            {'contract': PROTOCOL})
+            return [tuple(row) for row in rows]
+
+        assert asyncio.run(run()) == [live_row]
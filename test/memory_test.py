@@ -0,0 +1,90 @@
+import asyncio
+import json
+import tracemalloc
+
+import pytest
+
+from fixtures import PROTOCOLS, paste_hours
+from src import forecaster
+from src.memory import MemoryMonitor, read_rss
+from src.seen_hashes import SeenHashes
+
+ALLOCATION = 64 * 2 ** 20
+
+
+@pytest.fixture(autouse=True)
+def stop_tracing():
+    yield
+    tracemalloc.stop()
+
+
+def read_records(path) -> list:
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+class TestMemoryMonitor:
+    def test_disabled_monitor_writes_nothing(self, tmp_path):
+        monitor = MemoryMonitor(tracking=False, budget_mb=0, metrics_path='')
+        with monitor.measure('handle_block', block=14442800):
+            pass
+
+        assert monitor.calls == 0 and list(tmp_path.iterdir()) == []
+
+    def test_allocations_are_attributed_to_the_subsystems(self, tmp_path):
+        monitor = MemoryMonitor(tracking=True, every_n=2, budget_mb=0, metrics_path=str(tmp_path / 'memory.jsonl'))
+        hashes = SeenHashes(capacity=10 ** 5)
+        for block in range(2):
+            with monitor.measure('handle_block', block=block):
+                for i in range(5000):
+                    hashes.add(f'0x{block:032x}{i:032x}')
+            # the tracing is stopped between the traced blocks
+            assert not tracemalloc.is_tracing()
+
+        records = read_records(tmp_path / 'memory.jsonl')
+        assert [record['block'] for record in records] == [0, 1]
+        assert all(record['rss'] > 0 and record['peak_rss'] >= record['rss'] for record in records)
+        assert 'subsystems' not in records[0] and 'traced_peak' not in records[0]
+        # the hashes are the agent state
+        assert records[1]['subsystems']['agent'] > 5000 * 64
+        assert records[1]['traced_peak'] >= sum(records[1]['subsystems'].values())
+
+    def test_nested_measurements_keep_the_peak_of_the_outer_one(self, tmp_path):
+        monitor = MemoryMonitor(tracking=False, budget_mb=0, metrics_path=str(tmp_path / 'memory.jsonl'))
+        with monitor.measure('handle_block', block=14442800):
+            # the large buffer is returned to the system right away, only the peak remembers it
+            buffer = bytearray(ALLOCATION)
+            buffer[::4096] = b'\x01' * len(buffer[::4096])
+            del buffer
+            with monitor.measure('forecast', protocol='0x1a2a1c938ce3ec39b6d47113c7955baa9dd454f2'):
+                pass
+
+        forecast_record, block_record = read_records(tmp_path / 'memory.jsonl')
+        assert monitor.calls == 1 and monitor.peaks == []
+        assert block_record['peak_rss'] - block_record['rss'] > ALLOCATION * 0.9
+        assert forecast_record['peak_rss'] - forecast_record['rss'] < ALLOCATION / 2
+
+    def test_caches_are_shrunk_when_the_budget_is_exceeded(self, tmp_path):
+        monitor = MemoryMonitor(tracking=False, budget_mb=1, metrics_path=str(tmp_path / 'memory.jsonl'))
+        hashes = SeenHashes()
+        for i in range(10):
+            hashes.add(f'0x{i:064x}')
+        monitor.register_cache(hashes.shrink)
+
+        assert monitor.over_budget() and read_rss()[0] > 2 ** 20
+        for _ in range(2):
+            with monitor.measure('forecast', protocol='0x1a2a1c938ce3ec39b6d47113c7955baa9dd454f2'):
+                pass
+
+        # the second shrink is skipped since the caches were shrunk recently
+        records = read_records(tmp_path / 'memory.jsonl')
+        assert [record['operation'] for record in records] == ['forecast', 'forecast']
+        assert 'rss_after_shrink' in records[0] and 'rss_after_shrink' not in records[1]
+        assert list(hashes.hashes) == [f'0x{i:064x}' for i in range(5, 10)]
+
+    def test_refit_is_deferred_while_the_memory_budget_is_exceeded(self, tables, profile_backend, monkeypatch):
+        transactions, blocks, future = tables
+        paste_hours(transactions, 0, 48)
+        monkeypatch.setattr(forecaster, 'memory_monitor', MemoryMonitor(tracking=False, budget_mb=1, metrics_path=''))
+
+        assert asyncio.run(forecaster.forecast(PROTOCOLS[0], refit=True)) is None
+        assert profile_backend.fits == 0 and asyncio.run(future.count_rows()) == 0
@@ -0,0 +1,52 @@
+import threading
+import time
+
+from src.profiler import Profiler
+
+
+def slow_handler():
+    time.sleep(0.05)
+
+
+class TestProfiler:
+    def test_disabled_profiler_writes_nothing(self, tmp_path):
+        profiler = Profiler(enabled=False, every_n=1, directory=tmp_path)
+        with profiler.profile('handle_block', 14442800):
+            slow_handler()
+
+        assert list(tmp_path.iterdir()) == []
+
+    def test_slow_events_are_saved_as_folded_stacks(self, tmp_path):
+        profiler = Profiler(enabled=True, every_n=1000, latency_threshold=0.01, interval=0.001, directory=tmp_path)
+        with profiler.profile('handle_transaction', 14442800, '0x1a2a1c938ce3ec39b6d47113c7955baa9dd454f2'):
+            slow_handler()
+        with profiler.profile('handle_transaction', 14442801):
+            pass
+
+        profiles = list(tmp_path.glob('*.folded'))
+        assert len(profiles) == 1
+        assert '_handle_transaction_14442800_0x1a2a1c938ce3ec39b6d47113c7955baa9dd454f2_' in profiles[0].name
+        stack, count = profiles[0].read_text().splitlines()[0].rsplit(' ', 1)
+        assert 'slow_handler' in stack and int(count) > 0
+
+    def test_only_the_newest_profiles_are_kept(self, tmp_path):
+        profiler = Profiler(enabled=True, every_n=1, interval=0.001, directory=tmp_path, max_files=3)
+        for block_number in range(5):
+            with profiler.profile('handle_block', block_number):
+                slow_handler()
+
+        assert sorted(p.name.split('_')[3] for p in tmp_path.glob('*.folded')) == ['2', '3', '4']
+
+    def test_only_the_nth_event_is_sampled_by_the_shared_thread(self, tmp_path):
+        profiler = Profiler(enabled=True, every_n=3, latency_threshold=10, interval=0.001, directory=tmp_path)
+        threads = threading.active_count()
+        samples = []
+        for block_number in range(3):
+            with profiler.profile('handle_block', block_number):
+                slow_handler()
+                samples.append(sum(profiler.sampler.stacks.values()))
+
+        # the fast events are only timed
+        assert samples[:2] == [0, 0] and samples[2] > 0
+        assert threading.active_count() == threads + 1
+        assert [p.name.split('_')[3] for p in tmp_path.glob('*.folded')] == ['2']
@@ -0,0 +1,51 @@
+from src.scheduler import ForecastScheduler
+
+PROTOCOLS = ['0x1', '0x2', '0x3']
+
+
+class TestForecastScheduler:
+    def test_protocols_without_forecast_are_due_one_per_block(self):
+        scheduler = ForecastScheduler(refresh_lead=3600, refits_per_block=1)
+
+        assert scheduler.due(1648040400, PROTOCOLS) == ['0x1']
+        scheduler.record('0x1', 1648040400 + 24 * 3600, 1648040400)
+        assert scheduler.due(1648040412, PROTOCOLS) == ['0x2']
+
+    def test_refits_are_staggered_inside_the_lead_window(self):
+        scheduler = ForecastScheduler(refresh_lead=3600, refits_per_block=3)
+        for protocol in PROTOCOLS:
+            scheduler.record(protocol, 1648040400, 1648000000)
+        expires_at = scheduler.expires_at('0x1')
+
+        assert scheduler.due(expires_at - 3600, PROTOCOLS) == ['0x1']
+        assert scheduler.due(expires_at - 2400, PROTOCOLS) == ['0x1', '0x2']
+        assert scheduler.due(expires_at - 1200, PROTOCOLS) == PROTOCOLS
+
+    def test_protocol_without_enough_data_is_postponed_for_an_hour(self):
+        scheduler = ForecastScheduler(refresh_lead=3600, refits_per_block=1)
+        scheduler.record('0x1', None, 1648040400)
+
+        assert scheduler.expires_at('0x1') is None
+        assert scheduler.due(1648040412, ['0x1']) == []
+        assert scheduler.due(1648044001, ['0x1']) == ['0x1']
+
+    def test_busy_protocols_are_not_due(self):
+        scheduler = ForecastScheduler(refresh_lead=3600, refits_per_block=1)
+
+        assert scheduler.due(1648040400, PROTOCOLS, busy={'0x1'}) == ['0x2']
+        assert scheduler.due(1648040400, PROTOCOLS, busy={'0x1'}, limit=3) == ['0x2', '0x3']
+
+    def test_stale_protocol_does_not_starve_the_others(self):
+        scheduler = ForecastScheduler(refresh_lead=3600, refits_per_block=1)
+        start = 1648040400
+        # the stale protocol has no recent transactions, so its forecast still ends in the past after the refit
+        last_hours = {'0x1': start - 48 * 3600, '0x2': start + 24 * 3600}
+        scheduler.record('0x2', start - 1800, start - 24 * 3600)
+
+        refreshed = []
+        for timestamp in range(start, start + 7200, 12):
+            for protocol in scheduler.due(timestamp, ['0x1', '0x2']):
+                refreshed.append((protocol, timestamp))
+                scheduler.record(protocol, last_hours[protocol], timestamp)
+
+        assert refreshed == [('0x1', start), ('0x2', start + 12), ('0x1', start + 3600)]
@@ -0,0 +1,21 @@
+from src.seen_hashes import SeenHashes
+
+
+class TestSeenHashes:
+    def test_keeps_only_the_last_hashes(self):
+        seen_hashes = SeenHashes(capacity=3)
+        assert [seen_hashes.add(tx_hash) for tx_hash in ['0x1', '0x2', '0x1', '0x3', '0x4']] == \
+               [True, True, False, True, True]
+        # 0x2 was the least recently seen hash, so it was evicted by 0x4
+        assert seen_hashes.add('0x2')
+        assert not seen_hashes.add('0x4')
+        assert seen_hashes.add(None) and seen_hashes.add(None)
+
+    def test_rollback_forgets_the_hashes_since_the_last_commit(self):
+        seen_hashes = SeenHashes()
+        seen_hashes.add('0x1')
+        seen_hashes.commit()
+        seen_hashes.add('0x2')
+        seen_hashes.rollback()
+        assert not seen_hashes.add('0x1')
+        assert seen_hashes.add('0x2')
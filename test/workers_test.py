@@ -0,0 +1,71 @@
+import asyncio
+import atexit
+
+import numpy as np
+from forta_agent import FindingSeverity
+
+from src.db.controller import init_async_db
+from src.scoring import FutureRow, TransactionRecord
+from src import workers
+from src.scheduler import forecast_scheduler
+from src.workers import Dispatcher, get_dispatcher, get_worker
+
+PROTOCOLS = {f'Protocol{i}': f'0x{i:040x}' for i in range(8)}
+
+
+class TestWorkers:
+    def test_protocols_are_partitioned_by_the_address(self):
+        workers = [get_worker(address, 3) for address in PROTOCOLS.values()]
+
+        assert workers == [get_worker(address, 3) for address in PROTOCOLS.values()]
+        assert set(workers) == {0, 1, 2}
+
+    def test_findings_of_the_workers_are_merged_in_the_order_of_the_records(self, tmp_path):
+        path = tmp_path / 'workers_test.db'
+        transactions, blocks, future = asyncio.run(init_async_db(path=path, wal=True,
+                                                               protocols_addresses=PROTOCOLS.values()))
+        base_fee = 20 * 10 ** 9
+        addresses = list(PROTOCOLS.values())
+        # every second transaction pays 1000 GWei priority fee that is much higher than the forecasted 2 GWei
+        records = [TransactionRecord(f'0x{i:064x}', addresses[i % len(addresses)],
+                                     base_fee + (1000 if i % 2 else 1) * 10 ** 9, 21000, 1648041590, 14442800)
+                   for i in range(32)]
+        future_rows = {address: FutureRow(address, 10 ** 9, 0, 2 * 10 ** 9) for address in addresses}
+
+        dispatcher = Dispatcher(PROTOCOLS, workers=3, path=str(path))
+        dispatcher.start()
+        try:
+            findings = asyncio.run(dispatcher.score(records, np.ones(len(records), dtype=bool),
+                                                    [base_fee] * len(records), base_fee, base_fee, future_rows,
+                                                    PROTOCOLS))
+        finally:
+            dispatcher.stop()
+
+        assert [len(record_findings) for record_findings in findings] == [i % 2 for i in range(32)]
+        assert all(record_findings[0].severity == FindingSeverity.Critical and
+                   record_findings[0].metadata['tx_hash'] == records[i].hash
+                   for i, record_findings in enumerate(findings) if record_findings)
+        assert asyncio.run(transactions.count_rows()) == 32
+
+    def test_workers_use_the_database_of_the_agent(self, tmp_path, monkeypatch):
+        path = tmp_path / 'agent.db'
+        transactions, _, future = asyncio.run(init_async_db(path=path, wal=True,
+                                                            protocols_addresses=PROTOCOLS.values()))
+        address = PROTOCOLS['Protocol0']
+        # two days of the hourly transactions are written by the agent
+        asyncio.run(transactions.paste_rows([{'timestamp': 1648040400 + hour * 3600, 'tx': f'0x{hour:064x}',
+                                              'block': 14442800 + hour * 300, 'contract': address, 'gas': 21000,
+                                              'gas_price': 30 * 10 ** 9, 'priority_fee': (1 + hour % 3) * 10 ** 9}
+                                             for hour in range(48)]))
+
+        monkeypatch.setattr(workers, 'dispatcher', None)
+        dispatcher = get_dispatcher(PROTOCOLS, workers=2, path=str(path))
+        try:
+            asyncio.run(dispatcher.forecast([address], 1648040400 + 48 * 3600))
+        finally:
+            atexit.unregister(dispatcher.stop)
+            dispatcher.stop()
+
+        # the worker has read the history of the agent and has written the forecast back to the same database
+        assert asyncio.run(future.get_columns_by_criteria(['timestamp'], {'contract': address}))
+        assert forecast_scheduler.expires_at(address) is not None